@@ -0,0 +1,78 @@
+"""
+Compares StudyDocuments.parse + rows2frame with StudyDocuments.parse_columnar
+and parse_parallel on a synthetic block-join response.
+
+    python benchmarks/bench_solr_parse.py [number of study documents]
+"""
+import sys
+import time
+
+import pandas as pd
+
+from pynanomapper import client_solr
+
+STUDIES_PER_SUBSTANCE = 10
+
+
+def synthetic_docs(nstudies=100000):
+    docs = []
+    for s in range(max(1, nstudies // STUDIES_PER_SUBSTANCE)):
+        s_uuid = "SUBST-{}".format(s)
+        children = [{"type_s": "composition", "component_s": "CORE",
+                     "CASRN_s": "1314-13-2", "formula_s": "ZnO"}]
+        for i in range(STUDIES_PER_SUBSTANCE):
+            study_id = "{}/{}".format(s_uuid, i)
+            doc_uuid = "DOC-{}-{}".format(s, i // 2)
+            children.append({"type_s": "study", "id": study_id,
+                             "document_uuid_s": doc_uuid, "s_uuid_s": s_uuid,
+                             "topcategory_s": "TOX",
+                             "endpointcategory_s": "ENM_0000068_SECTION",
+                             "guidance_s": "OECD TG 203",
+                             "effectendpoint_s": "IC50", "unit_s": "ug/ml",
+                             "effectendpoint_synonym_ss": ["IC50"],
+                             "loQualifier_s": "=", "loValue_d": 0.5 * i,
+                             "reference_s": "ref", "reference_year_s": "2020",
+                             "reference_owner_s": "owner"})
+            children.append({"type_s": "conditions", "effectid_hs": study_id,
+                             "id": study_id + "/cn",
+                             "E.exposure_time_s": "24 h",
+                             "concentration_s": str(i)})
+            if i % 2 == 0:
+                children.append({"type_s": "params", "id": doc_uuid + "/prm",
+                                 "document_uuid_s": doc_uuid,
+                                 "E.method_s": "MTT", "T.cell_s": "A549"})
+        docs.append({"id": s_uuid, "type_s": "substance", "dbtag_hss": ["ENM"],
+                     "name_hs": "substance {}".format(s),
+                     "publicname_hs": "public {}".format(s),
+                     "owner_name_hs": "provider", "substanceType_hs": "NPO_1486",
+                     "s_uuid_hs": s_uuid, "_childDocuments_": children})
+    return docs
+
+
+def main(nstudies=100000):
+    docs = synthetic_docs(nstudies)
+    sd = client_solr.StudyDocuments()
+
+    start = time.perf_counter()
+    expected = sd.rows2frame(sd.parse(docs, process=None))
+    t_rows = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df = sd.parse_columnar(docs, process=None)
+    t_columnar = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df_parallel = sd.parse_parallel(docs, chunksize=1000, process=None)
+    t_parallel = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(df, expected)
+    pd.testing.assert_frame_equal(df_parallel, expected)
+    print("{} study documents, {} columns".format(len(df), len(df.columns)))
+    print("parse + rows2frame\t{:.2f} s".format(t_rows))
+    print("parse_columnar\t\t{:.2f} s".format(t_columnar))
+    print("parse_parallel\t\t{:.2f} s".format(t_parallel))
+    print("speed-up\t\t{:.1f}x, parallel {:.1f}x".format(t_rows / t_columnar, t_rows / t_parallel))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -1,12 +1,46 @@
+import threading
 from pathlib import Path
 
+import pandas as pd
 from jproperties import Properties
 
+# (folder, topic, verbose) -> (mtime, {key : value})
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def load_dictionary(folder, topic, verbose=True):
+    """
+    Contents of the topic .properties (verbose) or .terse.properties file in
+    folder as a plain dict, parsed once per process and reloaded when the file
+    modification time changes. Raises OSError if the file cannot be read.
+    """
+    suffix = '.properties' if verbose else '.terse.properties'
+    prop_file = Path(folder).resolve() / (topic + suffix)
+    mtime = prop_file.stat().st_mtime_ns
+    key = (str(prop_file.parent), topic, verbose)
+    with _registry_lock:
+        cached = _registry.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    properties = Properties()
+    with open(prop_file, 'rb') as f:
+        properties.load(f, 'utf-8')
+    lookup = {k: v.data for k, v in properties.items()}
+    with _registry_lock:
+        _registry[key] = (mtime, lookup)
+    return lookup
+
+
+def clear_cache():
+    with _registry_lock:
+        _registry.clear()
+
 
 class Dictionary:
 
     def __init__(self, folder='./annotation/', topic='endpoint', verbose=True):
-        self.lookup = Properties()
+        self.lookup = None
         self.topic = topic
         self.folder = Path(folder)
         self.folder.mkdir(parents=True, exist_ok=True)
@@ -14,15 +48,8 @@ class Dictionary:
         self.loadDictionary()
 
     def loadDictionary(self):
-        suffix = '.properties'
-        if self.verbose:
-            suffix = '.properties'
-        else:
-            suffix = '.terse.properties'
-        prop_file = self.folder / (self.topic + suffix)
         try:
-            with open(prop_file, 'rb') as f:
-                self.lookup.load(f, 'utf-8')
+            self.lookup = load_dictionary(self.folder, self.topic, self.verbose)
         except Exception as err:
             self.lookup = None
             print(err)
@@ -32,14 +59,16 @@ class Dictionary:
             return None
         try:
             x_ = x.replace(' ', '_').replace('\t', '').upper().strip()
-            if x in self.lookup:
-                value, meta = self.lookup[x_]
-                return value
-            else:
-                return x
+            return self.lookup.get(x_, x)
         except Exception:
             return None
 
+    def annotate_series(self, series):
+        """Series.apply(annotate), annotating each distinct value once"""
+        codes, uniques = pd.factorize(series)
+        values = pd.Series([self.annotate(x) for x in uniques] + [self.annotate(None)], dtype=object)
+        return pd.Series(values.to_numpy()[codes], index=series.index, name=series.name, dtype=object)
+
     def getLink(self, ontouri):
         if ontouri.startswith('http'):
             return 'http://bioportal.bioontology.org/ontologies/ENM/?p=classes&conceptid=' + ontouri
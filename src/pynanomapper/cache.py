@@ -0,0 +1,134 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
+class ResponseCache:
+    """
+    On-disk cache of HTTP responses, in a SQLite file in folder. Entries are
+    keyed by method, URL and body (with the parameters sorted) and a hash of
+    the credentials headers. An entry younger than ttl seconds is served
+    without a request; an older one with an ETag or Last-Modified header is
+    revalidated with a conditional request. When the stored bodies exceed
+    max_size bytes, the least recently used entries are removed.
+
+    Use it through connection.create_session(cache=ResponseCache(...)).
+    """
+    auth_headers = ("Authorization", "X-Gravitee-Api-Key", "Cookie")
+    # stored body is already decoded
+    skip_headers = ("Content-Encoding", "Content-Length", "Transfer-Encoding", "Connection")
+
+    def __init__(self, folder='./cache/', ttl=86400, max_size=1 << 30, exclude=("/update",)):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.exclude = exclude
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.folder / "http_cache.sqlite", check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS response (
+                key TEXT PRIMARY KEY, url TEXT, status INTEGER, headers TEXT, body BLOB,
+                etag TEXT, last_modified TEXT, stored REAL, accessed REAL, size INTEGER)""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS response_accessed ON response(accessed)")
+
+    def cacheable(self, request):
+        """GET requests and POSTs to a Solr /select handler, except paths in exclude"""
+        path = urlsplit(request.url).path
+        if any(x in path for x in self.exclude):
+            return False
+        return request.method == "GET" or (request.method == "POST" and path.endswith("/select"))
+
+    def key(self, request):
+        url = urlsplit(request.url)
+        query = urlencode(sorted(parse_qsl(url.query, keep_blank_values=True)))
+        url = urlunsplit((url.scheme, url.netloc.lower(), url.path, query, ""))
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        content_type = request.headers.get("Content-Type", "")
+        try:
+            if content_type.startswith("application/x-www-form-urlencoded"):
+                body = urlencode(sorted(parse_qsl(body.decode("utf-8"), keep_blank_values=True))).encode("utf-8")
+            elif content_type.startswith("application/json") and body:
+                body = json.dumps(json.loads(body), sort_keys=True).encode("utf-8")
+        except ValueError:
+            # not what the content type says, keyed as sent
+            pass
+        identity = "\n".join(str(request.headers.get(h, "")) for h in self.auth_headers)
+        digest = hashlib.sha256()
+        for part in (request.method.encode("utf-8"), url.encode("utf-8"), body, identity.encode("utf-8")):
+            digest.update(hashlib.sha256(part).digest())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """The entry as a dict with a 'fresh' flag, or None"""
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute(
+                "SELECT url, status, headers, body, etag, last_modified, stored FROM response WHERE key=?",
+                (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE response SET accessed=? WHERE key=?", (now, key))
+        url, status, headers, body, etag, last_modified, stored = row
+        return {"url": url, "status": status, "headers": json.loads(headers), "body": body,
+                "etag": etag, "last_modified": last_modified, "fresh": now - stored < self.ttl}
+
+    def put(self, key, response):
+        body = response.content
+        headers = {k: v for k, v in response.headers.items() if k not in self.skip_headers}
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO response VALUES (?,?,?,?,?,?,?,?,?,?)",
+                            (key, response.url, response.status_code, json.dumps(headers), body,
+                             response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                             now, now, len(body)))
+            self._evict()
+
+    def revalidated(self, key):
+        with self.lock, self.db:
+            self.db.execute("UPDATE response SET stored=? WHERE key=?", (time.time(), key))
+
+    def _evict(self):
+        total = self.db.execute("SELECT COALESCE(SUM(size),0) FROM response").fetchone()[0]
+        if total <= self.max_size:
+            return
+        remove = []
+        for key, size in self.db.execute("SELECT key, size FROM response ORDER BY accessed"):
+            if total <= self.max_size:
+                break
+            remove.append((key,))
+            total = total - size
+        self.db.executemany("DELETE FROM response WHERE key=?", remove)
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM response")
+
+    def size(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*), COALESCE(SUM(size),0) FROM response").fetchone()
+
+    @staticmethod
+    def response(entry, request):
+        """requests.Response rebuilt from a cache entry"""
+        r = requests.Response()
+        r.status_code = entry["status"]
+        r.reason = "OK"
+        r.headers = CaseInsensitiveDict(entry["headers"])
+        r.url = entry["url"]
+        r.encoding = get_encoding_from_headers(r.headers)
+        r._content = entry["body"]
+        r._content_consumed = True
+        r.request = request
+        r.from_cache = True
+        return r
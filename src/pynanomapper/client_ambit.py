@@ -3,11 +3,15 @@ import logging
 import json
 import csv
 import requests
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 global logger
 logger = logging.getLogger()
 
 from os.path import isfile, join
 from requests.auth import AuthBase
+from pynanomapper import connection
 
 _default_ambit="https://apps.ideaconsult.net/nanoreg1"
 
@@ -15,6 +19,7 @@ class AMBITResource:
     root = None
     resource="/"
     key=None
+    session=None
 
     def __init__(self,root_uri=_default_ambit,resource="/",key=None):
         self.resource=resource
@@ -29,12 +34,12 @@ class AMBITResource:
             url = url + self.key
         return url
 
-    def get(self,params=None, media="application/json",page=0,pagesize=10,auth=None,verbose=False):
+    def get(self,params=None, media="application/json",page=0,pagesize=10,auth=None,verbose=False,session=None):
         url = self.uricompose()
         params = self.getParams(params,page,pagesize,media)
         if verbose:
             print("Sending request to {} params {}".format(url,params))
-        r = requests.get(url,params=params, auth=auth)
+        r = connection.get_session(session if session is not None else self.session).get(url,params=params, auth=auth)
         return r
 
     def getParams(self,params=None,page=0,pagesize=10,media="application/json"):
@@ -48,6 +53,73 @@ class AMBITResource:
     def parse(self,response):
         return response
 
+    def count(self,response):
+        """Total number of records, if the response tells, otherwise None"""
+        for key in ("numFound","total"):
+            if isinstance(response.get(key),int):
+                return response[key]
+        return None
+
+    def fetch_page(self,params=None,media="application/json",page=0,pagesize=10,auth=None,session=None):
+        r = self.get(dict(params) if params else None,media=media,page=page,pagesize=pagesize,auth=auth,session=session)
+        r.raise_for_status()
+        return r.json()
+
+    def records(self,response):
+        """
+        The list of records of a response: parse() if it is a list, else
+        the dataEntry or task list of the parsed response (e.g. compounds
+        and tasks); TypeError otherwise.
+        """
+        parsed = self.parse(response)
+        if isinstance(parsed,list):
+            return parsed
+        if isinstance(parsed,dict):
+            for key in ("dataEntry","task"):
+                if isinstance(parsed.get(key),list):
+                    return parsed[key]
+        raise TypeError("{} response has no list of records".format(type(self).__name__))
+
+    def iter_all(self,params=None,media="application/json",pagesize=100,auth=None,workers=4,session=None):
+        """
+        Yields the records (see records()) of all pages in order. Pages are
+        fetched by workers threads, at most workers pages ahead of the
+        consumer; if count() gives the total the last page is known,
+        otherwise the next pages are requested until one comes back with
+        less than pagesize records.
+        """
+        response = self.fetch_page(params,media,0,pagesize,auth,session)
+        records = self.records(response)
+        total = self.count(response)
+        yield from records
+        if len(records) < pagesize and total is None:
+            return
+        last = None if total is None else math.ceil(total/pagesize)-1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            def fetch(page):
+                return executor.submit(self.fetch_page,params,media,page,pagesize,auth,session)
+            page = workers if last is None else min(workers,last)
+            pending = deque(fetch(p) for p in range(1,page+1))
+            try:
+                while pending:
+                    records = self.records(pending.popleft().result())
+                    yield from records
+                    if last is None and len(records) < pagesize:
+                        break
+                    if last is None or page < last:
+                        page = page + 1
+                        pending.append(fetch(page))
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def fetch_all(self,params=None,media="application/json",pagesize=100,auth=None,workers=4,session=None,frame=True):
+        """All records from iter_all, as a flattened DataFrame (pd.json_normalize) or a list"""
+        records = list(self.iter_all(params,media=media,pagesize=pagesize,auth=auth,workers=workers,session=session))
+        if frame:
+            return pd.json_normalize(records)
+        return records
+
 class AMBITSubstance(AMBITResource):
 
     def __init__(self,root_uri=_default_ambit,resource="/substance",key=None):
@@ -0,0 +1,120 @@
+import asyncio
+import contextlib
+
+from pynanomapper import client_ambit
+from pynanomapper import connection
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class AsyncAMBITResource(client_ambit.AMBITResource):
+    """
+    asyncio version of AMBITResource, with the same uricompose, getParams
+    and parse. Requests go through client, an httpx.AsyncClient, or, when
+    client is None, through the shared requests session on a worker thread.
+    A semaphore shared by several resources bounds the concurrent requests.
+    """
+    client = None
+    semaphore = None
+
+    async def get(self,params=None, media="application/json",page=0,pagesize=10,auth=None,verbose=False):
+        url = self.uricompose()
+        params = self.getParams(params,page,pagesize,media)
+        if verbose:
+            print("Sending request to {} params {}".format(url,params))
+        async with (self.semaphore if self.semaphore is not None else contextlib.nullcontext()):
+            if self.client is None:
+                return await asyncio.to_thread(connection.get_session(self.session).get,url,params=params,auth=auth)
+            return await self.client.get(url,params=params,auth=auth)
+
+    async def fetch(self,params=None,page=0,pagesize=10,auth=None):
+        r = await self.get(params=params,page=page,pagesize=pagesize,auth=auth)
+        r.raise_for_status()
+        return self.parse(r.json())
+
+    async def fetch_all(self,params=None,pagesize=1000,auth=None):
+        """
+        The records (see records()) of all pages, requested one after the
+        other until a page has less than pagesize records or the count()
+        total is reached
+        """
+        records = []
+        page = 0
+        while True:
+            r = await self.get(params=dict(params) if params else None,page=page,pagesize=pagesize,auth=auth)
+            r.raise_for_status()
+            response = r.json()
+            batch = self.records(response)
+            records.extend(batch)
+            total = self.count(response)
+            if len(batch) < pagesize or (total is not None and len(records) >= total):
+                return records
+            page = page + 1
+
+
+class AsyncAMBITSubstance(AsyncAMBITResource, client_ambit.AMBITSubstance):
+    pass
+
+class AsyncAMBITSubstanceComposition(AsyncAMBITResource, client_ambit.AMBITSubstanceComposition):
+    pass
+
+class AsyncAMBITSubstanceStudy(AsyncAMBITResource, client_ambit.AMBITSubstanceStudy):
+    pass
+
+class AsyncAMBITInvestigation(AsyncAMBITResource, client_ambit.AMBITInvestigation):
+    pass
+
+class AsyncAMBITCompound(AsyncAMBITResource, client_ambit.AMBITCompound):
+    pass
+
+
+def create_client(limit=10,timeout=300):
+    """httpx.AsyncClient with a connection pool sized for limit concurrent requests"""
+    if httpx is None:
+        raise ImportError("httpx is required for create_client, pip install httpx")
+    return httpx.AsyncClient(limits=httpx.Limits(max_connections=limit,max_keepalive_connections=limit),timeout=timeout)
+
+
+async def fetch_substances(substance_uris,auth=None,limit=10,client=None,study=True,composition=True,pagesize=1000):
+    """
+    Fetches the studies and/or the composition of every substance URI
+    (e.g. https://host/enm/substance/<uuid>) with at most limit requests in
+    flight. Returns {substance_uri : {"study" : [...], "composition" : [...]}},
+    with all the pages of pagesize records of each list; failed requests are
+    returned as the exception instead of the list.
+    If client is None and httpx is installed, an httpx.AsyncClient is
+    created and closed here.
+    """
+    resources = []
+    if study:
+        resources.append(("study",AsyncAMBITSubstanceStudy))
+    if composition:
+        resources.append(("composition",AsyncAMBITSubstanceComposition))
+    semaphore = asyncio.Semaphore(limit)
+    own_client = client is None and httpx is not None
+    if own_client:
+        client = create_client(limit=limit)
+    try:
+        tasks = []
+        for uri in substance_uris:
+            for (key,cls) in resources:
+                resource = cls(root_uri=uri)
+                resource.client = client
+                resource.semaphore = semaphore
+                tasks.append((uri,key,resource.fetch_all(pagesize=pagesize,auth=auth)))
+        results = await asyncio.gather(*[task for (uri,key,task) in tasks],return_exceptions=True)
+    finally:
+        if own_client:
+            await client.aclose()
+    substances = {}
+    for (uri,key,task), result in zip(tasks,results):
+        substances.setdefault(uri,{})[key] = result
+    return substances
+
+
+def harvest(substance_uris,auth=None,limit=10,study=True,composition=True,pagesize=1000):
+    """Blocking fetch_substances, for scripts without a running event loop"""
+    return asyncio.run(fetch_substances(substance_uris,auth=auth,limit=limit,study=study,composition=composition,pagesize=pagesize))
@@ -6,22 +6,238 @@ import numpy as np
 import logging
 
 import re
+import operator
+import itertools
+import time
+import threading
+from collections import deque
 global logger
 logger = logging.getLogger()
 import json
+import codecs
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pynanomapper import annotation
+from pynanomapper import connection
 
-def post(service_uri,query,auth=None):
-    r = requests.post(service_uri + "/select",data=query, auth=auth)
+# markers for StudyDocuments._study_columns defaults
+_REQUIRED = object()
+_MISSING = object()
+
+def post(service_uri,query,auth=None,session=None,**kwargs):
+    r = connection.get_session(session).post(service_uri + "/select",data=query, auth=auth, **kwargs)
     return r
 
-def get(service_uri,query,auth=None):
-    r = requests.get(service_uri + "/select",params=query, auth=auth)
+def get(service_uri,query,auth=None,session=None,**kwargs):
+    r = connection.get_session(session).get(service_uri + "/select",params=query, auth=auth, **kwargs)
     return r
 
-def knn_query(solr_field,topk,vector):
+def cursor_pages(service_uri,query,auth=None,rows=100,sort="id asc",prefetch=True,method=post,session=None):
+    """
+    Solr cursorMark deep paging. Yields the json response of each page;
+    with prefetch the next page is requested on a background thread while
+    the caller processes the current one, so at most two pages are held.
+    sort has to include the uniqueKey field (id) as a tie breaker.
+    """
+    query = dict(query)
+    query.pop('start',None)
+    query['rows'] = rows
+    query['sort'] = sort
+
+    def fetch(cursor):
+        q = dict(query)
+        q['cursorMark'] = cursor
+        r = method(service_uri,query=q,auth=auth,session=session)
+        r.raise_for_status()
+        return r.json()
+
+    cursor = '*'
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(fetch,cursor)
+        while True:
+            page = future.result()
+            next_cursor = page.get('nextCursorMark',cursor)
+            if next_cursor == cursor or not page['response']['docs']:
+                yield page
+                return
+            cursor = next_cursor
+            if prefetch:
+                future = executor.submit(fetch,cursor)
+            yield page
+            if not prefetch:
+                future = executor.submit(fetch,cursor)
+
+class _JSONStream:
+    """
+    Incremental reader over an iterable of utf-8 byte chunks. Values are
+    decoded with json.JSONDecoder.raw_decode once the buffer holds them
+    completely; consumed text is dropped from the buffer on every read.
+    """
+    _ws = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self,chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def read(self,size=1):
+        if self.eof:
+            return False
+        parts = []
+        n = 0
+        for chunk in self.chunks:
+            text = self.decoder.decode(chunk)
+            parts.append(text)
+            n = n + len(text)
+            if n >= size:
+                break
+        else:
+            parts.append(self.decoder.decode(b'',final=True))
+            self.eof = True
+        self.buf = self.buf[self.pos:] + ''.join(parts)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = self._ws.match(self.buf,self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.read():
+                raise ValueError("Unexpected end of json stream")
+
+    def expect(self,char):
+        if self.peek() != char:
+            raise ValueError("Expected '{}' at '{}'".format(char,self.buf[self.pos:self.pos+20]))
+        self.pos = self.pos + 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buf,self.pos)
+                # a number at the end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # at least double the unparsed text before trying again
+            self.read(len(self.buf)-self.pos)
+
+    def keys(self):
+        """Iterates the keys of an object whose '{' was consumed; the caller reads each value."""
+        if self.peek() == '}':
+            self.pos = self.pos + 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            char = self.peek()
+            self.pos = self.pos + 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError("Expected ',' or '}}' at '{}'".format(self.buf[self.pos-1:self.pos+20]))
+
+def iter_json_docs(chunks,header=None,container='response'):
+    """
+    Yields the response.docs of a Solr json response one at a time, while
+    the body is being read. chunks is an iterable of bytes, e.g.
+    r.iter_content() of a request sent with stream=True. Everything else in
+    the response (responseHeader, numFound, nextCursorMark, facets ...) is
+    stored in header, if given. container is the key holding the docs,
+    'result-set' for streaming expressions.
+    """
+    if header is None:
+        header = {}
+    stream = _JSONStream(chunks)
+    stream.expect('{')
+    for key in stream.keys():
+        if key != container:
+            header[key] = stream.value()
+            continue
+        response = header[container] = {}
+        stream.expect('{')
+        for rkey in stream.keys():
+            if rkey != 'docs':
+                response[rkey] = stream.value()
+                continue
+            stream.expect('[')
+            if stream.peek() == ']':
+                stream.pos = stream.pos + 1
+                continue
+            while True:
+                yield stream.value()
+                char = stream.peek()
+                stream.pos = stream.pos + 1
+                if char == ']':
+                    break
+                if char != ',':
+                    raise ValueError("Expected ',' or ']' at '{}'".format(stream.buf[stream.pos-1:stream.pos+20]))
+
+def format_vector(vector,precision=None):
+    """
+    Comma-joined vector; with precision, each value is written with that
+    many significant digits, which keeps knn queries short.
+    """
+    if hasattr(vector,"tolist"):
+        vector = vector.tolist()
+    if precision is None:
+        return ','.join(map(str, vector))
+    return ",".join(["%.{}g".format(precision)] * len(vector)) % tuple(vector)
+
+def knn_query(solr_field,topk,vector,precision=None):
     query = "!knn f={} topK={}".format(solr_field,topk)
-    return "{"+query+"}[" + ','.join(map(str, vector)) + "]"
+    return "{"+query+"}[" + format_vector(vector,precision) + "]"
+
+def knn_search(service_uri,vectors,solr_field="dense_256",topk=10,auth=None,query_ids=None,fq=None,fl="id,score",
+               precision=6,workers=8,method=post,session=None):
+    """
+    Runs one {!knn} query per row of vectors (an n x dim matrix, e.g. from
+    StudyRaman.xy2embedding), up to workers at a time.
+    Returns a DataFrame with columns query_id, rank, hit_id, score and any
+    other fields in fl; query_ids default to the row numbers.
+    Queries that fail are logged and have no hits; their query_ids are in
+    attrs failed_queries, to tell them from queries without neighbours.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors,dtype=float))
+    if query_ids is None:
+        query_ids = range(vectors.shape[0])
+    query_ids = list(query_ids)
+    if len(query_ids) != vectors.shape[0]:
+        raise ValueError("{} query_ids for {} vectors".format(len(query_ids),vectors.shape[0]))
+    fields = [f for f in fl.split(",") if f not in ("id","score")]
+    session = connection.get_session(session)
+
+    def search(row):
+        query = {"q" : knn_query(solr_field,topk,vectors[row],precision), "fl" : fl, "rows" : topk}
+        if fq is not None:
+            query["fq"] = fq
+        try:
+            r = method(service_uri,query,auth=auth,session=session)
+            r.raise_for_status()
+            return r.json()["response"]["docs"]
+        except Exception as err:
+            logger.error("knn query {} failed: {}".format(query_ids[row],err))
+            return None
+
+    rows = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for row, docs in enumerate(executor.map(search,range(len(query_ids)))):
+            if docs is None:
+                failed.append(query_ids[row])
+                continue
+            for rank, doc in enumerate(docs):
+                rows.append([query_ids[row],rank,doc.get("id"),doc.get("score")] + [doc.get(f) for f in fields])
+    df = pd.DataFrame(rows,columns=["query_id","rank","hit_id","score"] + fields)
+    df.attrs["failed_queries"] = failed
+    return df
 
 def print_docs(res):
     if not (res is None):
@@ -74,6 +290,88 @@ class Facets:
                     else:
                         process(prefix,nval,count,key,(*_tuple,val))
 
+    @staticmethod
+    def _buckets(node,missing_label="_"):
+        # (val, count, node) of the next level, in the order parse visits them
+        children = []
+        for key, value in node.items():
+            if key == 'count' or key == 'val':
+                continue
+            if isinstance(value, dict):
+                buckets = value.get('buckets')
+                if buckets is not None:
+                    children.extend([(bucket.get('val',missing_label),bucket['count'],bucket) for bucket in buckets])
+                missing = value.get('missing')
+                if missing is not None and missing['count'] > 0:
+                    children.append((missing_label,missing['count'],missing))
+            else:
+                children.append((value,node.get('count'),None))
+        return children
+
+    def flatten(self,facets,fields=None,totals=False,statistics="count",missing_label="_",total_label="_total"):
+        """
+        Nested json.facet response (as from getNestedFacets) to a count table
+        indexed by a MultiIndex with one level per field, without recursion.
+        Rows are the leaf buckets in the order parse visits them. With totals,
+        every intermediate bucket and the root get a row too, with
+        total_label in the levels below them.
+        """
+        if fields is None:
+            depth = 0
+            node = facets
+            while node is not None:
+                children = self._buckets(node,missing_label)
+                if not children:
+                    break
+                depth = depth + 1
+                node = children[0][2]
+            names = ["level{}".format(i+1) for i in range(depth)]
+        else:
+            depth = len(fields)
+            names = list(fields)
+        columns = [[] for i in range(depth)]
+        counts = []
+        path = [None] * depth
+
+        def emit_total(level,count):
+            for i in range(depth):
+                columns[i].append(path[i] if i < level else total_label)
+            counts.append(count)
+
+        if depth > 0:
+            if totals:
+                emit_total(0,facets.get('count'))
+            stack = [iter(self._buckets(facets,missing_label))]
+            while stack:
+                level = len(stack)
+                child = next(stack[-1],None)
+                if child is None:
+                    stack.pop()
+                    continue
+                val, count, node = child
+                path[level-1] = val
+                if level == depth:
+                    for i in range(depth):
+                        columns[i].append(path[i])
+                    counts.append(count)
+                    continue
+                if totals:
+                    emit_total(level,count)
+                if node is None:
+                    continue
+                children = self._buckets(node,missing_label)
+                if level + 1 == depth:
+                    # leaf level, appended at once
+                    n = len(children)
+                    for i in range(level):
+                        columns[i].extend(itertools.repeat(path[i],n))
+                    columns[level].extend([c[0] for c in children])
+                    counts.extend([c[1] for c in children])
+                else:
+                    stack.append(iter(children))
+        index = pd.MultiIndex.from_arrays(columns,names=names) if depth > 0 else pd.RangeIndex(0)
+        return pd.DataFrame({statistics : counts},index=index)
+
     def getFacet(self,field="endpointcategory_s",n=1,nested=None):
         fieldname="field{}".format(n)
         type_facet = "{}:{},{}:{} ,limit : -1, mincount:1, missing:true ".format("type","terms","field",field)
@@ -126,46 +424,281 @@ class Facets:
 
         return pd.DataFrame({key1 : fields_name, "count" : fields_count, key2 : field_2})
 
-    def summary(this,service_uri,auth_object,query="*:*",fq="type_s:study",statistics="Number of data points",fields=["topcategory_s","endpointcategory_s","E.method_s","substanceType_s","publicname_s","reference_owner_s"],log_query=None,log_result=None):
-        colnames=["Z"]
-        colnames.extend(fields)
-        colnames.append(statistics)
-        _stats=[]
-        def process(prefix,val,count,key,_tuple):
-            if len(_tuple)==len(fields):
-                _tuple = (*_tuple,val,count)
-                _stats.append(_tuple)
+    def annotate_summary(this,df):
+        """Adds the annotation columns of summary to df, in place"""
+        if "substanceType_s" in df.columns:
+            a = annotation.DictionarySubstancetypes(folder=this.annotation_folder,verbose=False)
+            df[ 'substanceType_name']=a.annotate_series(df[ 'substanceType_s'])
+        if "substanceType_hs" in df.columns:
+            a = annotation.DictionarySubstancetypes(folder=this.annotation_folder,verbose=False)
+            a.verbose=False
+            df[ 'substanceType_name']=a.annotate_series(df[ 'substanceType_hs'])
+        if "endpointcategory_s" in df.columns:
+            a = annotation.DictionaryEndpointCategory(folder=this.annotation_folder)
+            df[ 'endpointcategory_term']=a.annotate_series(df[ 'endpointcategory_s'])
+            a = annotation.DictionaryEndpointCategoryNames(folder=this.annotation_folder)
+            df[ 'endpointcategory_name']=a.annotate_series(df[ 'endpointcategory_s'])
+
+        if "E.method_s" in df.columns:
+            a = annotation.DictionaryAssays(folder=this.annotation_folder)
+            df[ 'method_term']=a.annotate_series(df[ 'E.method_s'])
+        return df
+
+    def getPagedFacet(self,field,n=1,offset=0,limit=100,missing=True):
+        facet = {"type" : "terms", "field" : field, "limit" : limit, "offset" : offset, "mincount" : 1, "missing" : missing}
+        return json.dumps({"field{}".format(n) : facet})
+
+    @staticmethod
+    def _filter(field,val,missing_label="_"):
+        if val == missing_label:
+            return "-{}:[* TO *]".format(field)
+        return "{!term f="+field+"}"+str(val)
+
+    def iter_drilldown(self,service_uri,auth_object,query="*:*",fq="type_s:study",fields=["topcategory_s","endpointcategory_s","E.method_s","substanceType_s","publicname_s","reference_owner_s"],
+                statistics="Number of data points",page_size=100,workers=4,max_buckets=1000000,max_memory=None,session=None,missing_label="_",budget=None):
+        """
+        Summary counts without one unbounded nested facet query: the first
+        field is paged with offset/limit, and for every page the buckets of
+        the next fields are requested per parent bucket (filtered by its
+        values), up to workers at a time, also paged.
+        Yields one DataFrame per top level page, with the rows of summary in
+        the same order. Stops after max_buckets buckets in total or when the
+        yielded frames take more than max_memory bytes, and logs a warning;
+        the rows of the last page that fit in max_buckets are yielded first.
+        If given, the budget dict is updated with the buckets and memory used
+        and whether the results were truncated.
+        """
+        session = connection.get_session(session)
+        depth = len(fields)
+        if budget is None:
+            budget = {}
+        budget.update({"buckets" : 0, "memory" : 0, "truncated" : False})
+        lock = threading.Lock()
+
+        def reserve(n):
+            # buckets are counted as the pages arrive, by all the workers
+            with lock:
+                allowed = max(0,min(n,max_buckets-budget["buckets"]))
+                budget["buckets"] = budget["buckets"] + allowed
+                if allowed < n:
+                    budget["truncated"] = True
+                return allowed
+
+        def expand(path):
+            level = len(path)
+            filters = [fq] if fq else []
+            filters.extend([self._filter(fields[i],path[i],missing_label) for i in range(level)])
+            children = []
+            offset = 0
+            while True:
+                with lock:
+                    if budget["truncated"]:
+                        return children
+                q = {'q': query, 'fq' : filters, "wt" : "json", 'rows': 0,
+                    "json.facet": self.getPagedFacet(fields[level],depth-level,offset,page_size)}
+                r = post(service_uri,query=q,auth=auth_object,session=session)
+                r.raise_for_status()
+                facet = r.json().get("facets",{}).get("field{}".format(depth-level),{})
+                buckets = facet.get("buckets",[])
+                page = [(*path,bucket["val"],bucket["count"]) for bucket in buckets]
+                offset = offset + len(buckets)
+                last = len(buckets) < page_size
+                if last:
+                    missing = facet.get("missing")
+                    if missing is not None and missing["count"] > 0:
+                        page.append((*path,missing_label,missing["count"]))
+                allowed = reserve(len(page))
+                children.extend(page[:allowed])
+                if last or allowed < len(page):
+                    return children
+
+        columns = list(fields) + [statistics]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            offset = 0
+            filters = [fq] if fq else []
+            while True:
+                q = {'q': query, 'fq' : filters, "wt" : "json", 'rows': 0,
+                    "json.facet": self.getPagedFacet(fields[0],depth,offset,page_size)}
+                r = post(service_uri,query=q,auth=auth_object,session=session)
+                r.raise_for_status()
+                facet = r.json().get("facets",{}).get("field{}".format(depth),{})
+                buckets = facet.get("buckets",[])
+                frontier = [(bucket["val"],bucket["count"]) for bucket in buckets]
+                last = len(buckets) < page_size
+                missing = facet.get("missing")
+                if last and missing is not None and missing["count"] > 0:
+                    frontier.append((missing_label,missing["count"]))
+                offset = offset + len(buckets)
+                frontier = frontier[:reserve(len(frontier))]
+                for level in range(1,depth):
+                    if budget["truncated"]:
+                        break
+                    children = []
+                    for expanded in executor.map(expand,[node[:-1] for node in frontier]):
+                        children.extend(expanded)
+                    frontier = children
+                # the leaves that fit are yielded, also from a truncated page
+                if frontier and len(frontier[0]) == depth + 1:
+                    df = pd.DataFrame(frontier,columns=columns)
+                    budget["memory"] = budget["memory"] + df.memory_usage(deep=True).sum()
+                    yield df
+                    if max_memory is not None and budget["memory"] > max_memory:
+                        budget["truncated"] = True
+                        logger.warning("Facet drill-down stopped at {} bytes".format(budget["memory"]))
+                        return
+                if budget["truncated"]:
+                    logger.warning("Facet drill-down stopped at {} buckets".format(budget["buckets"]))
+                    return
+                if last:
+                    return
+
+    def summary_paged(this,service_uri,auth_object,query="*:*",fq="type_s:study",statistics="Number of data points",fields=["topcategory_s","endpointcategory_s","E.method_s","substanceType_s","publicname_s","reference_owner_s"],
+                page_size=100,workers=4,max_buckets=1000000,max_memory=None,session=None):
+        """
+        Same DataFrame as summary, built by iter_drilldown. df.attrs["truncated"]
+        is True if a budget was exceeded.
+        """
+        budget = {}
+        chunks = list(this.iter_drilldown(service_uri,auth_object,query=query,fq=fq,fields=fields,statistics=statistics,page_size=page_size,
+                workers=workers,max_buckets=max_buckets,max_memory=max_memory,session=session,budget=budget))
+        df = pd.concat(chunks,ignore_index=True) if chunks else pd.DataFrame(columns=list(fields)+[statistics])
+        this.annotate_summary(df)
+        df.attrs["truncated"] = budget["truncated"]
+        return df
+
+    # solr study/substance fields -> StudyDocuments.parse columns, besides the
+    # ones in StudyDocuments._study_columns
+    _local_fields = {
+        "dbtag_hss" : "db", "dbtag_s" : "db",
+        "name_s" : "m.substance.name", "name_hs" : "m.substance.name",
+        "publicname_s" : "m.public.name", "publicname_hs" : "m.public.name",
+        "owner_name_s" : "m.materialprovider", "owner_name_hs" : "m.materialprovider",
+        "substanceType_s" : "m.substance.type", "substanceType_hs" : "m.substance.type",
+    }
+
+    @staticmethod
+    def local_column(field,columns=()):
+        """Column of a StudyDocuments.parse table holding the solr field"""
+        if field in Facets._local_fields:
+            return Facets._local_fields[field]
+        for column, (_field, default) in StudyDocuments._study_columns.items():
+            if _field == field:
+                return column
+        for prefix in ("x.params.","x.conditions."):
+            column = prefix + re.sub("_s$","",field)
+            if column in columns:
+                return column
+        return field
+
+    @staticmethod
+    def filter_mask(df,fq):
+        """
+        Boolean mask of the df rows matching fq, a filter query or a list of
+        them. Supports clauses joined by AND, optionally negated with - or
+        NOT, of the forms field:value, field:"value", field:(a OR b),
+        field:[* TO *], field:* and {!term f=field}value; type_s:study is
+        always true for a study table.
+        """
+        mask = np.ones(len(df),dtype=bool)
+        if fq is None:
+            return mask
+        for query in ([fq] if isinstance(fq,str) else fq):
+            if query is None or query.strip() in ('','*:*'):
+                continue
+            if query.startswith("{!term f="):
+                field, value = query[len("{!term f="):].split("}",1)
+                clauses = [(False,field,[value])]
             else:
-                #print(prefix,val,count,key,_tuple)
-                pass
+                clauses = []
+                for clause in re.split(r"\s+AND\s+",query.strip()):
+                    m = re.fullmatch(r'(-|NOT\s+)?([^:\s]+):(\[\*\s+TO\s+\*\]|\*|"[^"]*"|\([^)]*\)|\S+)',clause.strip())
+                    if m is None:
+                        raise ValueError("Unsupported filter {}".format(clause))
+                    negate, field, value = m.groups()
+                    if value.startswith("["):
+                        value = None
+                    elif value == "*":
+                        value = None
+                    elif value.startswith("("):
+                        value = [v.strip().strip('"') for v in re.split(r"\s+OR\s+",value[1:-1])]
+                    else:
+                        value = [value.strip('"')]
+                    clauses.append((negate is not None,field,value))
+            for negate, field, values in clauses:
+                if field == "type_s" and values == ["study"]:
+                    continue
+                column = Facets.local_column(field,df.columns)
+                if not column in df.columns:
+                    match = np.zeros(len(df),dtype=bool)
+                elif values is None:
+                    match = df[column].notna().to_numpy() & (df[column].astype(object) != '').to_numpy()
+                else:
+                    match = df[column].astype(object).isin(values).to_numpy()
+                mask &= ~match if negate else match
+        return mask
+
+    def summary_local(this,studies,fq="type_s:study",statistics="Number of data points",fields=["topcategory_s","endpointcategory_s","E.method_s","substanceType_s","publicname_s","reference_owner_s"],
+                totals=False,missing_label="_",total_label="_total"):
+        """
+        summary computed from a study table instead of Solr: a DataFrame from
+        StudyDocuments.parse/rows2frame, or a Parquet file or dataset of one.
+        fields are solr field names, mapped to the table columns by
+        local_column; fq as in filter_mask. Rows are ordered as Solr orders
+        the nested buckets: by count, then value, with the missing bucket last.
+        """
+        if not isinstance(studies,pd.DataFrame):
+            studies = pd.read_parquet(studies)
+        columns = [Facets.local_column(field,studies.columns) for field in fields]
+        df = pd.DataFrame({field : (studies[column].astype(object) if column in studies.columns else pd.Series(None,index=studies.index,dtype=object))
+                    for field, column in zip(fields,columns)})
+        df = df.loc[Facets.filter_mask(studies,fq)]
+        for field in fields:
+            if df[field].map(lambda x: isinstance(x,list)).any():
+                df = df.explode(field)
+            df[field] = df[field].where(df[field].notna() & (df[field] != ''),missing_label)
+        n = len(fields)
+        rows = df.groupby(fields,sort=False).size().rename(statistics).reset_index() if n > 0 else pd.DataFrame(columns=[statistics])
+        if totals:
+            frames = [rows]
+            for level in range(n):
+                if level == 0:
+                    total = pd.DataFrame({statistics : [len(df)]})
+                else:
+                    total = df.groupby(fields[:level],sort=False).size().rename(statistics).reset_index()
+                for field in fields[level:]:
+                    total[field] = total_label
+                frames.append(total[fields + [statistics]])
+            rows = pd.concat(frames,ignore_index=True)
+        # lexsort keys, last key is the primary one
+        keys = []
+        for level in range(n):
+            prefix = df.groupby(fields[:level+1],sort=False).size()
+            index = pd.MultiIndex.from_frame(rows[fields[:level+1]]) if level > 0 else pd.Index(rows[fields[0]])
+            is_total = (rows[fields[level]] == total_label).to_numpy()
+            count = prefix.reindex(index).to_numpy(dtype=float)
+            count[is_total] = np.inf
+            values = rows[fields[level]]
+            uniques = pd.unique(values)
+            rank = {value : i for i, value in enumerate(sorted(uniques,key=str))}
+            keys.append(((values == missing_label).to_numpy(),-count,values.map(rank).to_numpy()))
+        order = np.lexsort([key for level in reversed(keys) for key in reversed(level)]) if keys else np.arange(len(rows))
+        rows = rows.iloc[order].reset_index(drop=True)
+        this.annotate_summary(rows)
+        return rows
+
+    def summary(this,service_uri,auth_object,query="*:*",fq="type_s:study",statistics="Number of data points",fields=["topcategory_s","endpointcategory_s","E.method_s","substanceType_s","publicname_s","reference_owner_s"],log_query=None,log_result=None,session=None,totals=False):
         q=this.getQuery(query=query,facets=fields,fq=fq)
         if log_query!=None:
             log_query(q)
 
-        r = post(service_uri,query=q,auth=auth_object)
+        r = post(service_uri,query=q,auth=auth_object,session=session)
         response_json=r.json()
 
         if r.status_code==200:
             if log_result!=None:
                 log_result(response_json)
-            this.parse(response_json['facets'],prefix=">",process=process)
-            df = pd.DataFrame(_stats,columns=colnames).drop("Z", axis=1)
-            if "substanceType_s" in df.columns:
-                a = annotation.DictionarySubstancetypes(folder=this.annotation_folder,verbose=False)
-                df[ 'substanceType_name']=df[ 'substanceType_s'].apply(a.annotate)
-            if "substanceType_hs" in df.columns:
-                a = annotation.DictionarySubstancetypes(folder=this.annotation_folder,verbose=False)
-                a.verbose=False
-                df[ 'substanceType_name']=df[ 'substanceType_hs'].apply(a.annotate)
-            if "endpointcategory_s" in df.columns:
-                a = annotation.DictionaryEndpointCategory(folder=this.annotation_folder)
-                df[ 'endpointcategory_term']=df[ 'endpointcategory_s'].apply(a.annotate)
-                a = annotation.DictionaryEndpointCategoryNames(folder=this.annotation_folder)
-                df[ 'endpointcategory_name']=df[ 'endpointcategory_s'].apply(a.annotate)
-
-            if "method_term" in df.columns:
-                a = annotation.DictionaryAssays(folder=this.annotation_folder)
-                df[ 'method_term']=df[method_field].apply(a.annotate)
+            df = this.flatten(response_json['facets'],fields=fields,totals=totals,statistics=statistics).reset_index()
+            this.annotate_summary(df)
             return (df)
         else:
             print(r.status_code)
@@ -249,6 +782,10 @@ class StudyDocuments:
     def rows2frame(self,rows):
         df = pd.DataFrame(rows)
         #df = df.replace(np.nan, '', regex=True)
+        return StudyDocuments.categorize(df)
+
+    @staticmethod
+    def categorize(df):
         for prefix in ['db','m.','p.','uuid.','value.endpoint','value.range.lo.qualifier','value.range.up.qualifier','value.uncertainty_type','value.unit','x.','xR.']:
             filter_col = [col for col in df if col.startswith(prefix)]
             for col in filter_col:
@@ -607,16 +1144,661 @@ class StudyDocuments:
                     rows.append(row)
         return (rows)
 
+    # column -> (child document field, default), in the column order of parse()
+    _study_columns = {
+        'p.oht.module' : ('topcategory_s', _REQUIRED),
+        'p.oht.section' : ('endpointcategory_s', _REQUIRED),
+        'p.guidance' : ('guidance_s', ''),
+        'p.reference' : ('reference_s', None),
+        'p.reference_year' : ('reference_year_s', None),
+        'p.study_provider' : ('reference_owner_s', None),
+        'value.endpoint' : ('effectendpoint_s', ''),
+        'value.endpoint_synonym' : ('effectendpoint_synonym_ss', []),
+        'value.endpoint_type' : ('effectendpoint_type_s', ''),
+        'value.range.lo.qualifier' : ('loQualifier_s', ''),
+        'value.range.up.qualifier' : ('upQualifier_s', ''),
+        'value.range.lo' : ('loValue_d', np.nan),
+        'value.range.up' : ('upValue_d', np.nan),
+        'value.unit' : ('unit_s', ''),
+        'value.text' : ('textValue_s', ''),
+        'value.uncertainty' : ('err_d', np.nan),
+        'value.uncertainty_type' : ('errQualifier_s', ''),
+        'xR.reliability' : ('reliability_s', None),
+        'xR.studyResultType' : ('studyResultType_s', ''),
+        'xR.purposeFlag' : ('purposeFlag_s', ''),
+        'xx.QualityRemark' : (None, None),
+        'uuid.substance' : ('s_uuid_s', ''),
+        'uuid.document' : ('document_uuid_s', _REQUIRED),
+        'uuid.assay' : ('assay_uuid_s', _MISSING),
+        'uuid.investigation' : ('investigation_uuid_s', _MISSING),
+    }
+    _record_columns = tuple(col for (col, (field, default)) in _study_columns.items() if field is not None)
+    _record_getter = operator.itemgetter(*[field for (field, default) in _study_columns.values() if field is not None])
+    _record_defaults = {field : default for (field, default) in _study_columns.values() if not (field is None or default is _REQUIRED)}
+    # substance level columns, one value per block
+    _substance_columns = ('db','m.substance.name','m.public.name','m.materialprovider','m.substance.type')
+    # composition child field -> column suffix
+    _component_columns = {
+        'CASRN_s' : 'CAS',
+        'EINECS_s' : 'EINECS',
+        'SMILES_s' : 'SMILES',
+        'InChIKey_s' : 'InChIKey',
+        'InChI_s' : 'InChI',
+        'formula_s' : 'formula',
+    }
+    _skip_fields = frozenset(("type_s","document_uuid_s","id","topcategory_s","endpointcategory_s"))
+
+    def iter_query(self,service_uri,query,auth=None,rows=100,frame=True,process=None,prefetch=True,session=None):
+        """
+        Runs a getQuery() query with cursorMark paging, rows substances per
+        page, and yields each page parsed, as a DataFrame (parse_columnar)
+        or as a list of row dicts (parse).
+        """
+        for page in cursor_pages(service_uri,query,auth=auth,rows=rows,prefetch=prefetch,session=session):
+            docs = page['response']['docs']
+            if not docs:
+                continue
+            if frame:
+                yield self.parse_columnar(docs,process=process)
+            else:
+                yield self.parse(docs,process=process)
+
+    def stream_query(self,service_uri,query,auth=None,batch=100,frame=True,process=None,chunk_size=1<<16,session=None):
+        """
+        Sends a getQuery() query and parses the response while it arrives,
+        see parse_stream.
+        """
+        r = post(service_uri,query=query,auth=auth,stream=True,session=session)
+        try:
+            r.raise_for_status()
+            yield from self.parse_stream(r.iter_content(chunk_size=chunk_size),batch=batch,frame=frame,process=process)
+        finally:
+            r.close()
+
+    def parse_stream(self,chunks,batch=100,frame=True,process=None,header=None):
+        """
+        Parses a {!parent} block-join response from an iterable of byte
+        chunks. Each substance document is parsed as soon as it is complete
+        and every batch substances are yielded as a DataFrame (as from
+        parse_columnar) or as a list of row dicts (as from parse).
+        """
+        columns = StudyColumns()
+        docs = []
+        record = 0
+        for doc in iter_json_docs(chunks,header=header):
+            record=record+1
+            if process!=None:
+                process(record,doc)
+            if frame:
+                self.parse_block(doc,columns)
+            else:
+                docs.append(doc)
+            if record % batch == 0:
+                yield self.columns2frame(columns) if frame else self.parse(docs,process=None)
+                columns = StudyColumns()
+                docs = []
+        if record % batch != 0:
+            yield self.columns2frame(columns) if frame else self.parse(docs,process=None)
+
+    def parse_columnar(self,docs,process=process_record):
+        """
+        Same result as rows2frame(parse(docs)), but the fields are collected
+        column by column instead of building one dict per study document.
+        The dict form of settings['fields'] is not supported here.
+        """
+        columns = StudyColumns()
+        record=0
+        for doc in docs:
+            record=record+1
+            if process!=None:
+                process(record,doc)
+            self.parse_block(doc,columns)
+        return self.columns2frame(columns)
+
+    def parse_parallel(self,docs,workers=None,chunksize=200,frame=True,process=process_record,executor=None):
+        """
+        parse_columnar (frame=True) or parse (frame=False) with the substance
+        documents split in consecutive chunks of chunksize, parsed in a
+        process pool of workers processes (or executor, if given). The
+        results are merged in the original order; process is called here,
+        for every document in order, not in the workers.
+        """
+        chunks = []
+        chunk = []
+        record = 0
+        for doc in docs:
+            record=record+1
+            if process!=None:
+                process(record,doc)
+            chunk.append(doc)
+            if len(chunk) >= chunksize:
+                chunks.append(chunk)
+                chunk = []
+        if chunk:
+            chunks.append(chunk)
+        tasks = [(chunk,frame,self.settings) for chunk in chunks]
+        if executor is None:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_parse_chunk,tasks))
+        else:
+            results = list(executor.map(_parse_chunk,tasks))
+        if not frame:
+            return [row for rows in results for row in rows]
+        return self.merge_frames(results)
+
+    @staticmethod
+    def merge_frames(frames):
+        """
+        Concatenates parse_columnar results of consecutive chunks, with the
+        columns in order of first appearance and each categorical column
+        recoded over the union of the values, as one parse_columnar call would.
+        """
+        frames = [df for df in frames if len(df.columns) > 0]
+        if not frames:
+            return pd.DataFrame()
+        categorical = set()
+        for df in frames:
+            categorical.update(col for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype))
+        merged = pd.concat([df.astype({col : object for col in df.columns if col in categorical}) for df in frames],
+                    ignore_index=True, sort=False)
+        for col in merged.columns:
+            if col in categorical:
+                values = merged[col].to_numpy(dtype=object)
+                merged[col] = _categorical(np.where(pd.isna(values),None,values))
+        return merged
+
+    def parse_block(self,doc,columns):
+        if (not '_childDocuments_' in doc):
+            return 0
+        studies = []
+        params = {}
+        conditions = {}
+        components = {}
+        ncomponents = 0
+        for childdoc in doc['_childDocuments_']:
+            _type = childdoc['type_s']
+            if _type == 'study':
+                studies.append(childdoc)
+            elif _type == 'params':
+                params[childdoc['document_uuid_s']] = childdoc
+            elif _type == 'conditions':
+                conditions[childdoc['effectid_hs']] = childdoc
+            elif _type == 'composition':
+                ncomponents = ncomponents + 1
+                prefix="c{}.".format(ncomponents)
+                components[prefix+"type"] = childdoc['component_s']
+                for field in self._component_columns:
+                    if field in childdoc:
+                        components[prefix+self._component_columns[field]] = childdoc[field]
+        n = len(studies)
+        if n == 0:
+            return 0
+
+        columns.blocks.append((''.join(doc['dbtag_hss']), doc['name_hs'],
+                doc.get('publicname_hs'), doc.get('owner_name_hs'), doc.get('substanceType_hs')))
+        columns.counts.append(n)
+        columns.components.append(components)
+        getter = self._record_getter
+        defaults = self._record_defaults
+        columns.records.extend([getter(defaults | childdoc) for childdoc in studies])
+        columns.ids.extend([childdoc['id'] for childdoc in studies])
+
+        _conditions = [conditions.get(childdoc['id']) for childdoc in studies]
+        _params = [params.get(childdoc['document_uuid_s']) for childdoc in studies]
+        columns.conditions.extend(_conditions)
+        columns.params.extend(_params)
+        # register the new fields in the order rows2frame would see them
+        seen_conditions = columns.seen("x.conditions.")
+        seen_params = columns.seen("x.params.")
+        for i in range(n):
+            if not (_conditions[i] is None or seen_conditions.issuperset(_conditions[i])):
+                columns.register("x.conditions.",_conditions[i])
+            if not (_params[i] is None or seen_params.issuperset(_params[i])):
+                columns.register("x.params.",_params[i])
+            if i == 0:
+                columns.register("",components)
+        columns.nrows = columns.nrows + n
+        return n
+
+    def _core_columns(self,columns):
+        # substance and study columns of columns2frame, without the sparse ones
+        n = columns.nrows
+        counts = np.array(columns.counts)
+        frame = {}
+        for col, values in zip(self._substance_columns, zip(*columns.blocks)):
+            block = _categorical(np.fromiter(values, dtype=object, count=len(values)))
+            frame[col] = pd.Categorical.from_codes(np.repeat(block.codes,counts), dtype=block.dtype)
+
+        data = {}
+        for col, values in zip(self._record_columns, zip(*columns.records)):
+            data[col] = np.fromiter(values, dtype=object, count=n)
+        data['p.guidance'] = np.fromiter((value if value.__class__ is str else str(value) for value in data['p.guidance']), dtype=object, count=n)
+        data['value.endpoint_synonym'] = np.fromiter(map(';'.join, data['value.endpoint_synonym']), dtype=object, count=n)
+        for col, fallback in (('uuid.assay','uuid.document'),('uuid.investigation','uuid.assay')):
+            missing = data[col] == _MISSING
+            data[col][missing] = data[fallback][missing]
+        for col in ('value.range.lo','value.range.up','value.uncertainty'):
+            try:
+                data[col] = data[col].astype(float)
+            except (TypeError, ValueError):
+                data[col] = data[col].tolist()
+
+        lo = np.asarray(data['value.range.lo'], dtype=float)
+        up = np.asarray(data['value.range.up'], dtype=float)
+        missing_unit = (pd.isna(data['value.unit']) | (data['value.unit'] == '')) & (~np.isnan(lo) | ~np.isnan(up))
+        empty_endpoint = data['value.endpoint'] == ''
+        remark = np.full(n, '', dtype=object)
+        remark[missing_unit] = 'Missing unit'
+        remark[empty_endpoint] = 'empty endpoint'
+        remark[missing_unit & empty_endpoint] = 'Missing unit;empty endpoint'
+        data['xx.QualityRemark'] = remark.tolist()
+        data['value.text'] = data['value.text'].tolist()
+
+        for col in self._study_columns:
+            values = data[col]
+            frame[col] = _categorical(values) if isinstance(values, np.ndarray) and values.dtype == object else values
+        return frame
+
+    def columns2frame(self,columns):
+        n = columns.nrows
+        if n == 0:
+            return pd.DataFrame()
+        counts = np.array(columns.counts)
+        frame = self._core_columns(columns)
+
+        sparse = {}
+        for prefix, docs in (("x.conditions.",columns.conditions),("x.params.",columns.params)):
+            if prefix in columns.prefixes:
+                sparse[prefix] = pd.DataFrame([{} if doc is None else doc for doc in docs])
+        if "" in columns.prefixes:
+            sparse[""] = pd.DataFrame(columns.components).take(np.repeat(np.arange(len(counts)),counts)).reset_index(drop=True)
+        for prefix, field in columns.order:
+            col = prefix + re.sub("_s$","",field) if prefix else field
+            values = sparse[prefix][field]
+            if col in frame:
+                values = values.combine_first(frame[col])
+            frame[col] = values.values if prefix else values.tolist()
+        df = pd.DataFrame(frame)
+        for col in df:
+            if col.startswith('x.') and df[col].dtype != 'category':
+                df[col] = df[col].astype('category')
+        return df
+
+    def parse_long(self,docs,process=process_record):
+        """
+        parse_columnar without the wide x.conditions.*, x.params.* and c<n>.*
+        columns. Returns a dict of DataFrames: "studies", the study table with
+        an id.study column, and the long tables "conditions" (id.study, name,
+        value), "params" (uuid.document, name, value) and "components"
+        (id.study, component, name, value). long2wide restores the wide table.
+        """
+        columns = StudyColumns()
+        record=0
+        for doc in docs:
+            record=record+1
+            if process!=None:
+                process(record,doc)
+            self.parse_block(doc,columns)
+        return self.columns2long(columns)
+
+    def columns2long(self,columns):
+        tables = {}
+        if columns.nrows == 0:
+            tables["studies"] = pd.DataFrame(columns=list(self._substance_columns)+list(self._study_columns)+["id.study"])
+        else:
+            frame = self._core_columns(columns)
+            frame["id.study"] = columns.ids
+            tables["studies"] = pd.DataFrame(frame)
+        skip = self._skip_fields
+
+        keys, names, values = [], [], []
+        for study_id, doc in zip(columns.ids,columns.conditions):
+            if doc is None:
+                continue
+            for field, value in doc.items():
+                if not field in skip:
+                    keys.append(study_id)
+                    names.append(field)
+                    values.append(value)
+        tables["conditions"] = self._long_frame({"id.study" : keys},names,values)
+
+        index = self._record_columns.index('uuid.document')
+        seen = set()
+        keys, names, values = [], [], []
+        for record, doc in zip(columns.records,columns.params):
+            if doc is None or record[index] in seen:
+                continue
+            seen.add(record[index])
+            for field, value in doc.items():
+                if not field in skip:
+                    keys.append(record[index])
+                    names.append(field)
+                    values.append(value)
+        tables["params"] = self._long_frame({"uuid.document" : keys},names,values)
+
+        keys, numbers, names, values = [], [], [], []
+        start = 0
+        for count, components in zip(columns.counts,columns.components):
+            ids = columns.ids[start:start+count]
+            start = start + count
+            for col, value in components.items():
+                number, name = col.split(".",1)
+                for study_id in ids:
+                    keys.append(study_id)
+                    numbers.append(int(number[1:]))
+                    names.append(name)
+                    values.append(value)
+        tables["components"] = self._long_frame({"id.study" : keys, "component" : np.array(numbers,dtype=int)},names,values,strip=False)
+        return tables
+
+    @staticmethod
+    def _long_frame(keys,names,values,strip=True):
+        frame = {key : _categorical(np.array(v,dtype=object)) if key != "component" else v for key, v in keys.items()}
+        if strip:
+            names = [re.sub("_s$","",name) for name in names]
+        frame["name"] = _categorical(np.array(names,dtype=object))
+        frame["value"] = pd.Series(values,dtype=object) if values else pd.Series([],dtype=object)
+        return pd.DataFrame(frame)
+
+    @staticmethod
+    def long2wide(tables,keep_ids=False):
+        """
+        Wide study table, as from parse_columnar, from the parse_long tables.
+        The sparse columns follow the core ones, conditions, params and then
+        components, each in order of first appearance.
+        """
+        df = tables["studies"].copy()
+        for name, key, prefix in (("conditions","id.study","x.conditions."),("params","uuid.document","x.params.")):
+            table = tables[name]
+            if len(table) == 0:
+                continue
+            order = pd.unique(table["name"].astype(object))
+            wide = table.astype({key : object, "name" : object}).pivot(index=key,columns="name",values="value")
+            wide = wide.reindex(df[key].astype(object).to_numpy())
+            for field in order:
+                df[prefix+field] = pd.Categorical(wide[field].to_numpy())
+        table = tables["components"]
+        if len(table) > 0:
+            table = table.astype({"id.study" : object, "name" : object})
+            cols = "c" + table["component"].astype(str) + "." + table["name"]
+            order = pd.unique(cols)
+            wide = table.assign(col=cols).pivot(index="id.study",columns="col",values="value")
+            wide = wide.reindex(df["id.study"].astype(object).to_numpy())
+            for col in order:
+                df[col] = wide[col].tolist()
+        if not keep_ids:
+            df = df.drop(columns="id.study")
+        return df
+
+
+def _parse_chunk(task):
+    # StudyDocuments.parse_parallel worker
+    (docs,frame,settings) = task
+    parser = StudyDocuments()
+    parser.settings = settings
+    if frame:
+        return parser.parse_columnar(docs,process=None)
+    return parser.parse(docs,process=None)
+
+
+def _categorical(values):
+    """
+    values.astype('category') for an object array, with the categories sorted
+    once over the unique values instead of over the whole column.
+    """
+    codes, uniques = pd.factorize(values)
+    try:
+        order = uniques.argsort()
+    except TypeError:
+        return pd.Categorical(values)
+    # the extra last slot maps the missing value code -1 onto itself
+    rank = np.full(len(order)+1, -1, dtype=codes.dtype)
+    rank[order] = np.arange(len(order), dtype=codes.dtype)
+    codes = rank[codes]
+    return pd.Categorical.from_codes(codes, categories=uniques[order])
+
+
+class StudyColumns:
+    """
+    Column store filled by StudyDocuments.parse_block. Substance fields and
+    components are kept once per block, study fields as one tuple per study
+    document, and the x.conditions.* / x.params.* documents by reference,
+    one per row. The order of first appearance of the sparse fields is
+    recorded, so that the columns come out as in rows2frame.
+    """
+    def __init__(self):
+        self.blocks = []
+        self.counts = []
+        self.components = []
+        self.records = []
+        self.ids = []
+        self.conditions = []
+        self.params = []
+        self.order = []
+        self.prefixes = set()
+        self.nrows = 0
+        self._seen = {}
+
+    def seen(self,prefix):
+        try:
+            return self._seen[prefix]
+        except KeyError:
+            self._seen[prefix] = seen = set(StudyDocuments._skip_fields) if prefix else set()
+            return seen
+
+    def register(self,prefix,doc):
+        seen = self.seen(prefix)
+        if seen.issuperset(doc):
+            return
+        self.prefixes.add(prefix)
+        for field in doc:
+            if not field in seen:
+                seen.add(field)
+                self.order.append((prefix,field))
+
 
 class Materials:
     def getQuery(self,query='*:*',facets=None,fq='', fl='*',rows=1000):
         query={'q': query,'fq' : fq, "wt" : "json", 'fl' : fl, 'rows': rows}
         return query
 
+    def iter_query(self,service_uri,query,auth=None,rows=1000,frame=True,prefetch=True,session=None):
+        """
+        Runs a getQuery() query with cursorMark paging and yields the docs
+        of each page, as a DataFrame or as the list from the response.
+        """
+        for page in cursor_pages(service_uri,query,auth=auth,rows=rows,prefetch=prefetch,session=session):
+            docs = page['response']['docs']
+            if not docs:
+                continue
+            yield pd.DataFrame(docs) if frame else docs
+
+
+class Export:
+    """
+    Flat extraction of docValues fields through the /export handler of the
+    Solr core at service_uri, streamed into DataFrame chunks with columns
+    typed from the Solr schema. qualifies() tells whether a field list can be
+    exported; frames() falls back to cursorMark paging over /select when not.
+    """
+    # solr field type -> (pandas dtype, multivalued)
+    _types = {
+        "pdouble" : "float64", "pfloat" : "float64", "double" : "float64", "float" : "float64",
+        "plong" : "Int64", "pint" : "Int64", "long" : "Int64", "int" : "Int64",
+        "boolean" : "boolean", "pdate" : "datetime64[ns, UTC]", "date" : "datetime64[ns, UTC]",
+        "string" : "object",
+    }
+    # dtype from the dynamic field suffix if the schema is not available
+    _suffixes = {"_d" : "float64", "_f" : "float64", "_l" : "Int64", "_i" : "Int64", "_b" : "boolean", "_dt" : "datetime64[ns, UTC]"}
+
+    def __init__(self,service_uri,auth=None,session=None):
+        self.service_uri = service_uri
+        self.auth = auth
+        self.session = session
+        self._schema = None
+
+    def schema(self):
+        """(fields, dynamic fields) of the core, with the defaults of their types"""
+        if self._schema is None:
+            session = connection.get_session(self.session)
+            fields = {}
+            dynamic = []
+            for path, key in (("fields","fields"),("dynamicfields","dynamicFields")):
+                r = session.get("{}/schema/{}".format(self.service_uri,path),params={"showDefaults" : "true", "wt" : "json"},auth=self.auth)
+                r.raise_for_status()
+                for field in r.json().get(key,[]):
+                    if key == "fields":
+                        fields[field["name"]] = field
+                    else:
+                        dynamic.append(field)
+            # longer patterns take precedence, as in Solr
+            dynamic.sort(key=lambda field: -len(field["name"]))
+            self._schema = (fields,dynamic)
+        return self._schema
+
+    def field(self,name):
+        """Schema properties of a field or of the dynamic field matching it, or None"""
+        fields, dynamic = self.schema()
+        if name in fields:
+            return fields[name]
+        for field in dynamic:
+            pattern = field["name"]
+            if (pattern.startswith("*") and name.endswith(pattern[1:])) or (pattern.endswith("*") and name.startswith(pattern[:-1])):
+                return field
+        return None
+
+    def qualifies(self,fl,sort="id asc"):
+        """
+        True if every field in fl and sort has docValues and none is a
+        pseudo field, function or transformer, as /export requires.
+        """
+        names = list(fl) + [clause.split()[0] for clause in sort.split(",") if clause.strip()]
+        for name in names:
+            if name == "score" or not re.fullmatch(r"[\w.]+",name):
+                logger.debug("{} can not be exported".format(name))
+                return False
+            field = self.field(name)
+            if field is None or not field.get("docValues",False):
+                logger.debug("{} has no docValues".format(name))
+                return False
+        return True
+
+    def dtype(self,name):
+        try:
+            field = self.field(name)
+        except Exception:
+            field = None
+        if field is not None:
+            if field.get("multiValued",False):
+                return "object"
+            return self._types.get(field.get("type"),"object")
+        for suffix, dtype in self._suffixes.items():
+            if name.endswith(suffix):
+                return dtype
+        return "object"
+
+    def _frame(self,fl,dtypes,columns):
+        frame = {}
+        for name, values in zip(fl,columns):
+            dtype = dtypes[name]
+            if dtype.startswith("datetime"):
+                frame[name] = pd.to_datetime(pd.Series(values,dtype=object),utc=True)
+            elif dtype == "object":
+                frame[name] = pd.Series(values,dtype=object)
+            else:
+                frame[name] = pd.Series(values,dtype=object).astype(dtype)
+        return pd.DataFrame(frame)
+
+    def _chunks(self,docs,fl,dtypes,chunk_rows):
+        getters = [operator.methodcaller("get",name) for name in fl]
+        columns = [[] for name in fl]
+        n = 0
+        for doc in docs:
+            if "EOF" in doc:
+                break
+            for column, getter in zip(columns,getters):
+                column.append(getter(doc))
+            n = n + 1
+            if n >= chunk_rows:
+                yield self._frame(fl,dtypes,columns)
+                columns = [[] for name in fl]
+                n = 0
+        if n > 0:
+            yield self._frame(fl,dtypes,columns)
+
+    def export(self,fl,query="*:*",fq=None,sort="id asc",chunk_rows=100000,chunk_size=1<<16):
+        """Yields DataFrames of chunk_rows rows from /export, while the response arrives"""
+        fl = list(fl)
+        dtypes = {name : self.dtype(name) for name in fl}
+        params = {"q" : query, "fl" : ",".join(fl), "sort" : sort, "wt" : "json"}
+        if fq is not None:
+            params["fq"] = fq
+        r = connection.get_session(self.session).post("{}/export".format(self.service_uri),data=params,auth=self.auth,stream=True)
+        try:
+            r.raise_for_status()
+            header = {}
+            yield from self._chunks(iter_json_docs(r.iter_content(chunk_size=chunk_size),header),fl,dtypes,chunk_rows)
+            status = header.get("responseHeader",{}).get("status",0)
+            if status != 0:
+                raise HTTPException("/export failed with status {}".format(status))
+        finally:
+            r.close()
+
+    def select(self,fl,query="*:*",fq=None,sort="id asc",chunk_rows=100000,rows=10000):
+        """Same chunks as export(), from cursorMark paging over /select"""
+        fl = list(fl)
+        dtypes = {name : self.dtype(name) for name in fl}
+        q = {"q" : query, "fl" : ",".join(fl), "wt" : "json"}
+        if fq is not None:
+            q["fq"] = fq
+        # cursorMark needs the uniqueKey as the last tie-breaker
+        if not any(clause.split()[0] == "id" for clause in sort.split(",") if clause.strip()):
+            sort = sort + ",id asc"
+        pages = cursor_pages(self.service_uri,q,auth=self.auth,rows=rows,sort=sort,session=self.session)
+        docs = (doc for page in pages for doc in page["response"]["docs"])
+        yield from self._chunks(docs,fl,dtypes,chunk_rows)
+
+    def frames(self,fl,query="*:*",fq=None,sort="id asc",chunk_rows=100000,export=None):
+        """export() if the fields qualify (or export is True), otherwise select()"""
+        if export is None:
+            try:
+                export = self.qualifies(fl,sort)
+            except Exception as err:
+                logger.warning("Solr schema not available, using /select: {}".format(err))
+                export = False
+        if export:
+            return self.export(fl,query=query,fq=fq,sort=sort,chunk_rows=chunk_rows)
+        return self.select(fl,query=query,fq=fq,sort=sort,chunk_rows=chunk_rows)
+
+    def frame(self,fl,query="*:*",fq=None,sort="id asc",chunk_rows=100000,export=None):
+        chunks = list(self.frames(fl,query=query,fq=fq,sort=sort,chunk_rows=chunk_rows,export=export))
+        if not chunks:
+            return pd.DataFrame({name : pd.Series([],dtype=self.dtype(name)) for name in fl})
+        return pd.concat(chunks,ignore_index=True)
+
+    def studies(self,fields=["s_uuid_s","effectendpoint_s","loValue_d","unit_s"],substance_fields=["s_uuid_hs","name_hs","publicname_hs","substanceType_hs"],
+                fq=None,on=("s_uuid_s","s_uuid_hs"),sort="id asc",chunk_rows=100000,export=None):
+        """
+        type_s:study docs with fields, joined locally to the type_s:substance
+        docs with substance_fields, exported separately; on is the pair of
+        (study, substance) join fields.
+        """
+        substances = self.frame(substance_fields,query="type_s:substance",sort=sort,chunk_rows=chunk_rows,export=export)
+        substances = substances.drop_duplicates(on[1]).set_index(on[1])
+        chunks = []
+        for chunk in self.frames(fields,query="type_s:study",fq=fq,sort=sort,chunk_rows=chunk_rows,export=export):
+            joined = substances.reindex(chunk[on[0]])
+            for name in joined.columns:
+                chunk[name] = joined[name].to_numpy()
+            chunks.append(chunk)
+        if not chunks:
+            return pd.DataFrame(columns=list(fields)+[name for name in substance_fields if name != on[1]])
+        return pd.concat(chunks,ignore_index=True)
+
 
 class IndexSolr:
     @staticmethod
-    def substance_entry(dbtag,name,publicname,ownername,substanceType,uuid, vectors = [{"dense_256" : None}] ):
+    def substance_entry(dbtag,name,publicname,ownername,substanceType,uuid, vectors = {"dense_256" : None} ):
         tmp = {
             "id" : uuid,
             "content_hss":[],
@@ -634,24 +1816,35 @@ class IndexSolr:
         tmp['dbtag_hss'].append(dbtag)
         if vectors is None:
             return tmp
-        for solr_field in vectors:
-            try:
-                if not (vectors[solr_field] is None):
-                    tmp[solr_field] = vectors[solr_field].tolist()
-            except:
-                pass
+        for solr_field, vector in IndexSolr._vector_fields(vectors).items():
+            if not (vector is None):
+                tmp[solr_field] = vector.tolist() if hasattr(vector,"tolist") else list(vector)
         return tmp
 
+    @staticmethod
+    def _vector_fields(vector_fields):
+        # accepts {solr_field : value} as well as the older [{solr_field : value}]
+        if vector_fields is None:
+            return {}
+        if isinstance(vector_fields, dict):
+            return vector_fields
+        merged = {}
+        for item in vector_fields:
+            merged.update(item)
+        return merged
+
     @staticmethod
     def df2solr(row,fields=
                 {"dbtag":"dbtag","uuid":"uuid",
                 "name":"name","publicname":"publicname","ownername":"ownername","substanceType":"substanceType"},
-                vector_fields = [{"dense_256" : (0,256)}]):
-
-        if not (vector_fields is None):
-            for vector_fields in vector_fields:
-                entry = vector_fields[vector_fields]
-                vector_fields[vector_fields] = row[entry[0]:entry[1]].values
+                vector_fields = {"dense_256" : (0,256)}):
+        """
+        Substance entry from a DataFrame row; vector_fields maps a solr field
+        to the (start, end) positions of the vector columns in the row.
+        """
+        vectors = {}
+        for solr_field, (start, end) in IndexSolr._vector_fields(vector_fields).items():
+            vectors[solr_field] = row.iloc[start:end].values
 
         values = {}
         for field in fields:
@@ -659,22 +1852,131 @@ class IndexSolr:
                 values[field] = row[fields[field]]
             except:
                 values[field] = ""
-        return IndexSolr.substance_entry(values["dbtag"],values["name"],values["publicname"],values["ownername"],values["substanceType"],values["uuid"],vector_fields)
+        return IndexSolr.substance_entry(values["dbtag"],values["name"],values["publicname"],values["ownername"],values["substanceType"],values["uuid"],vectors)
 
     @staticmethod
-    def submit_dataframe(df, solr_url, auth_obj = None,delete = True, commit = True):
-        tmp = df.apply(IndexSolr.df2solr,axis=1)
-        return IndexSolr.submit_json(tmp.tmp.tolist(), solr_url, auth_obj = auth_obj,delete = delete, commit = commit)
+    def df2docs(df,fields=
+                {"dbtag":"dbtag","uuid":"uuid",
+                "name":"name","publicname":"publicname","ownername":"ownername","substanceType":"substanceType"},
+                vector_fields = {"dense_256" : (0,256)}):
+        """
+        Same entries as df2solr for every row, generated lazily from whole
+        columns instead of one pandas row at a time.
+        """
+        n = len(df)
+        values = {}
+        for field in fields:
+            if fields[field] in df.columns:
+                values[field] = df[fields[field]].tolist()
+            else:
+                values[field] = [""] * n
+        vectors = {}
+        for solr_field, (start, end) in IndexSolr._vector_fields(vector_fields).items():
+            vectors[solr_field] = df.iloc[:,start:end].to_numpy(dtype=float)
+        for i in range(n):
+            yield IndexSolr.substance_entry(values["dbtag"][i],values["name"][i],values["publicname"][i],
+                values["ownername"][i],values["substanceType"][i],values["uuid"][i],
+                {solr_field : vectors[solr_field][i] for solr_field in vectors})
 
     @staticmethod
-    def submit_json(json, solr_url, auth_obj = None,delete = True, commit = True):
-        if delete:
-            res = requests.get("{}/update?commit=true".format(solr_url), json = {"delete" : { "query" : "*:*"}}, auth = auth_obj)
-            if res.status_code != 200:
-                raise HTTPException(status_code=res.status_code, detail=res.text)
-        res = requests.post("{}/update?commit=true".format(solr_url),json=json, auth = auth_obj)
+    def submit_dataframe(df, solr_url, auth_obj = None,delete = True, commit = True, session = None,
+                fields = {"dbtag":"dbtag","uuid":"uuid","name":"name","publicname":"publicname","ownername":"ownername","substanceType":"substanceType"},
+                vector_fields = {"dense_256" : (0,256)}, chunk_size = None, workers = 4, jsonl = False, commit_within = None):
+        """
+        Indexes the rows of df as substances. With chunk_size the documents
+        are sent in chunks by submit_chunks and its report is returned.
+        """
+        docs = IndexSolr.df2docs(df, fields=fields, vector_fields=vector_fields)
+        if chunk_size is None:
+            return IndexSolr.submit_json(list(docs), solr_url, auth_obj = auth_obj,delete = delete, commit = commit, session = session)
+        return IndexSolr.submit_chunks(docs, solr_url, auth_obj = auth_obj, delete = delete, commit = commit, session = session,
+                chunk_size = chunk_size, workers = workers, jsonl = jsonl, commit_within = commit_within)
+
+    @staticmethod
+    def raise_for_status(res):
+        """requests.HTTPError carrying the response, unless the status is 200"""
         if res.status_code != 200:
-                raise HTTPException(status_code=res.status_code, detail=res.text)
-        else:
-            return res.json()
+            raise requests.HTTPError("{} {}".format(res.status_code, res.text), response = res)
 
+    @staticmethod
+    def delete_all(solr_url, auth_obj = None, session = None):
+        res = connection.get_session(session).get("{}/update?commit=true".format(solr_url), json = {"delete" : { "query" : "*:*"}}, auth = auth_obj)
+        IndexSolr.raise_for_status(res)
+
+    @staticmethod
+    def submit_json(json, solr_url, auth_obj = None,delete = True, commit = True, session = None):
+        session = connection.get_session(session)
+        if delete:
+            IndexSolr.delete_all(solr_url, auth_obj = auth_obj, session = session)
+        res = session.post("{}/update{}".format(solr_url, "?commit=true" if commit else ""),json=json, auth = auth_obj)
+        IndexSolr.raise_for_status(res)
+        return res.json()
+
+    @staticmethod
+    def submit_chunks(docs, solr_url, auth_obj = None, delete = False, commit = True, session = None,
+                chunk_size = 1000, workers = 4, jsonl = False, commit_within = None):
+        """
+        Sends an iterable of documents in chunks of chunk_size over workers
+        parallel connections, as a json array to /update or, with jsonl, as
+        json lines to /update/json/docs. No chunk commits; with commit_within
+        (ms) Solr commits on its own, otherwise one commit is sent at the end
+        if commit. Only a few chunks are held in memory at a time.
+        Returns a DataFrame with one row per chunk: docs, bytes, seconds,
+        status and error; a failed chunk does not stop the others.
+        attrs docs_per_second counts the indexed documents only; attrs
+        failed_chunks and failed_docs tell what was not indexed.
+        """
+        session = connection.get_session(session)
+        if delete:
+            IndexSolr.delete_all(solr_url, auth_obj = auth_obj, session = session)
+        url = "{}/update/json/docs".format(solr_url) if jsonl else "{}/update".format(solr_url)
+        params = {} if commit_within is None else {"commitWithin" : commit_within}
+        headers = {"Content-Type" : "application/json"}
+
+        def send(chunk_no, chunk):
+            if jsonl:
+                body = "\n".join(json.dumps(doc) for doc in chunk)
+            else:
+                body = json.dumps(chunk)
+            body = body.encode("utf-8")
+            report = {"chunk" : chunk_no, "docs" : len(chunk), "bytes" : len(body), "status" : None, "error" : None}
+            start = time.perf_counter()
+            try:
+                res = session.post(url, params=params, data=body, headers=headers, auth=auth_obj)
+                report["status"] = res.status_code
+                if res.status_code != 200:
+                    report["error"] = res.text[:1000]
+            except Exception as err:
+                report["error"] = str(err)
+            report["seconds"] = time.perf_counter() - start
+            return report
+
+        reports = []
+        start = time.perf_counter()
+        docs = iter(docs)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            chunk_no = 0
+            while True:
+                chunk = list(itertools.islice(docs, chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(send, chunk_no, chunk))
+                chunk_no = chunk_no + 1
+                if len(pending) >= 2 * workers:
+                    reports.append(pending.popleft().result())
+            while pending:
+                reports.append(pending.popleft().result())
+        if commit and commit_within is None:
+            res = session.get("{}/update".format(solr_url), params={"commit" : "true"}, auth=auth_obj)
+            IndexSolr.raise_for_status(res)
+        elapsed = time.perf_counter() - start
+        report = pd.DataFrame(reports, columns=["chunk","docs","bytes","seconds","status","error"])
+        failed = report["error"].notna()
+        indexed = int(report.loc[~failed, "docs"].sum())
+        report.attrs["docs_per_second"] = indexed / elapsed if elapsed > 0 else np.nan
+        report.attrs["failed_chunks"] = int(failed.sum())
+        report.attrs["failed_docs"] = int(report.loc[failed, "docs"].sum())
+        logger.info("Indexed {} docs in {} chunks, {:.1f} docs/s, {} chunks ({} docs) failed".format(
+            indexed, len(report), report.attrs["docs_per_second"], report.attrs["failed_chunks"], report.attrs["failed_docs"]))
+        return report
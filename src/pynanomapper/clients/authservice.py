@@ -3,6 +3,7 @@ import h5py,h5pyd
 import traceback
 from keycloak import KeycloakOpenID
 import time 
+from pynanomapper import connection
 
 def get_kcclient (keycloak_server_url,keycloak_client_id,keycloak_realm_name,client_secret_key):
     return KeycloakOpenID(
@@ -61,14 +62,15 @@ class TokenService():
         return expiration_time - current_time
 
 class QueryService():
-    def __init__(self,tokenservice):
+    def __init__(self,tokenservice,session=None):
         self.tokenservice = tokenservice
+        self.session = session
 
     def get(self,url,params):
-        return requests.get(url, params,headers=self.tokenservice.getHeaders())
+        return connection.get_session(self.session).get(url, params,headers=self.tokenservice.getHeaders())
 
-    def post(self,url,data,files):
-        return requests.post(url, data = data, files = files,headers=self.tokenservice.getHeaders())
+    def post(self,url,data,files=None):
+        return connection.get_session(self.session).post(url, data = data, files = files,headers=self.tokenservice.getHeaders())
 
     def api_key(self):
         return self.tokenservice.api_key()
@@ -12,6 +12,7 @@ import ramanchada2 as rc2
 import uuid
 from datetime import date
 import scipy.stats as stats
+from pynanomapper.clients import spectra
 
 def prefixed_uuid(value, prefix="CRMA"):
     return prefix+"-"+str(uuid.uuid3(uuid.NAMESPACE_OID, value))
@@ -90,6 +91,18 @@ class StudyRaman:
         y = h5[dataset][1]
         return StudyRaman.xy2embedding(x,y,xlinspace,remove_baseline=remove_baseline,window=window)
 
+    @staticmethod
+    def batch2embedding(xy,xlinspace = None,remove_baseline=True,window=16,workers=None):
+        """
+        xy2embedding for many (x, y) spectra, without a Spectrum and an
+        rv_histogram per spectrum. Returns (cdf, pdf) matrices, one row per spectrum.
+        """
+        return spectra.embed_spectra(xy,xlinspace=xlinspace,remove_baseline=remove_baseline,window=window,workers=workers)
+
+    @staticmethod
+    def h5batch2embedding(h5files,dataset="raw",xlinspace = None,remove_baseline=True,window=16,workers=None):
+        return StudyRaman.batch2embedding(spectra.h5spectra(h5files,dataset),xlinspace,remove_baseline=remove_baseline,window=window,workers=workers)
+
     def to_solr_json(self):
         _solr = {}
         id = prefixed_uuid(self.filename)
@@ -54,7 +54,7 @@ class AmbitParser:
     def parse_attribute_value(attr_value):
         if isinstance(attr_value, np.ndarray):
             return attr_value.tolist()
-        elif attr_value.startswith("{"):
+        elif isinstance(attr_value, str) and attr_value.startswith("{"):
             try:
                 return json.loads(attr_value.replace("'","\""))
             except:
@@ -70,40 +70,114 @@ class AmbitParser:
             except Exception as err:
                 print(err, h5path, ambitobj, props)
 
+    @staticmethod
+    def read_all_attributes(h5file, h5path):
+        """
+        All the attributes of the object at h5path, parsed, opening the object
+        once and reading attrs.items() in one pass; {} if there is no such object
+        """
+        try:
+            attrs = h5file[h5path].attrs
+        except KeyError:
+            return {}
+        return {a: AmbitParser.parse_attribute_value(value) for (a, value) in attrs.items()}
 
+    @staticmethod
+    def _select(attributes, props):
+        return {a: attributes[a] for a in props if a in attributes}
 
+    @staticmethod
+    def _field(value,col):
+        # as split_results: "" and missing fields are NA, plain values are loValue
+        if isinstance(value,dict):
+            value = value.get(col,pd.NA)
+            return pd.NA if isinstance(value,str) and value == "" else value
+        if value is None or value is pd.NA or (isinstance(value,str) and value == "") \
+                or (isinstance(value,(float,np.floating)) and np.isnan(value)):
+            return pd.NA
+        if col == "loValue" and isinstance(value,(str,int,float,np.number)):
+            return value
+        return pd.NA
+
+    @staticmethod
+    def split_column(values,cols,indexcols=None):
+        """
+        split_results for a whole column at once: a DataFrame with the cols
+        fields of dict values, and the loValue of plain values, as indexcols
+        """
+        if indexcols is None:
+            indexcols=cols
+        values = pd.Series(values) if not isinstance(values,pd.Series) else values
+        data = values.tolist()
+        columns = {}
+        for col, indexcol in zip(cols,indexcols):
+            columns[indexcol] = pd.Series([AmbitParser._field(value,col) for value in data],index=values.index,dtype=object)
+        return pd.DataFrame(columns,index=values.index,columns=indexcols)
 
     @staticmethod
     def effects2df(study_effects, conditions = ["concentration","E.exposure_time","Material","replicate","Replicate","Technical replicate","Biological replicate"]):
         df = pd.DataFrame(study_effects)
         cols = AmbitParser._cols
         cols_param = AmbitParser._cols_param
-        df[cols] = df["result"].apply(AmbitParser.split_results,cols=cols)
+        results = AmbitParser.split_column(df["result"],cols)
         df.drop(columns=["result"],inplace=True)
+        for c in cols:
+            df[c] = results[c]
         prefix="c_"
         c_cols = list(map(lambda x : prefix+x,conditions))
-
-        df[c_cols] = df["conditions"].apply(AmbitParser.split_results,cols=conditions)
+        _conditions = df["conditions"] if "conditions" in df.columns else pd.Series(None,index=df.index,dtype=object)
+        _conditions = AmbitParser.split_column(_conditions,conditions,c_cols)
+        # the condition values, then their units
+        params = {}
         for c in c_cols:
-            prefix= c
-            v_cols = list(map(lambda x : prefix+("" if x=="loValue" else ("_"+x)),cols_param))
-            try:
-                df[v_cols] = df[c].apply(AmbitParser.split_results,cols=cols_param,indexcols=v_cols)
-            except Exception as err:
-                print(traceback.format_exc())
+            v_cols = list(map(lambda x : c+("" if x=="loValue" else ("_"+x)),cols_param))
+            params[c] = AmbitParser.split_column(_conditions[c],cols_param,v_cols)
+        for c in c_cols:
+            df[c] = params[c][c]
+        for c in c_cols:
+            for v in params[c].columns:
+                if v != c:
+                    df[v] = params[c][v]
         for c in df.columns:
             if c.find("replicate")>=0:
                 cc = c.replace("c_","")
-                df[c] = df[c].apply(lambda x : pd.NA if pd.isna(x) else x.replace(cc,""))
-        df.drop(columns=["conditions"],axis=1,inplace=True)
+                values = df[c].tolist()
+                df[c] = pd.Series([x.replace(cc,"") if isinstance(x,str) else x for x in values],index=df.index,dtype=object)
+        df.drop(columns=["conditions"],axis=1,inplace=True,errors="ignore")
         df = df[df['loValue'].notna() | df['textValue'].notna()]
-        df.dropna(axis=1,how="all",inplace=True)
+        df = df.dropna(axis=1,how="all")
 
         return df
 
     @staticmethod
-    def make_dataset(df):
-        df.fillna("",inplace=True)
+    def _group_codes(df, cols):
+        """Row codes of the cols combinations, numbered in sorted order, and the key columns"""
+        codes = np.zeros(len(df), dtype=np.int64)
+        keys = {}
+        for c in cols:
+            values = df[c]
+            if values.dtype == object:
+                values = values.where(values.notna(), "").infer_objects()
+            keys[c] = values
+            try:
+                (c_codes, uniques) = pd.factorize(values, sort=True, use_na_sentinel=False)
+            except TypeError:
+                # mixed numbers and strings
+                (c_codes, uniques) = pd.factorize(values, use_na_sentinel=False)
+            codes = pd.factorize(codes * len(uniques) + c_codes, sort=True)[0]
+        return (codes, keys)
+
+    @staticmethod
+    def make_dataset(df, max_memory=2**30):
+        """
+        One row per combination of the non-value columns, with the mean
+        loValue of each (endpoint, endpointtype, unit) in a loValue_<endpoint>_
+        <endpointtype>_<unit> column and the grouping columns as <column>___.
+        Only combinations and endpoints with a value are kept, in sorted
+        order, and the numeric columns keep their dtype. Groups are factorized
+        to integer codes and the means scattered into a float matrix; the
+        sums and counts are accumulated in row blocks of about max_memory bytes.
+        """
         gcols = list(df.columns.values)
         values = ["loValue","upValue","textValue"]
         for v in values:
@@ -114,77 +188,148 @@ class AmbitParser:
         for e in endpoints:
             gcols.remove(e)
         gcols.sort()
-        tmp = df.pivot_table(columns=endpoints,values=["loValue"],index=gcols,dropna=False).reset_index()
-        tmp.dropna(axis=1,how="all",inplace=True)
-        tmp.columns = tmp.columns.map('_'.join)
-        nonempty = False
-        value_cols = [c for c in tmp if c.startswith('loValue')]
-        for c in value_cols:
-            nonempty = nonempty | tmp[c].notna()
-        return tmp.loc[nonempty]
+        loValue = pd.to_numeric(df["loValue"], errors="coerce").to_numpy(dtype=float)
+        df = df[~np.isnan(loValue)]
+        loValue = loValue[~np.isnan(loValue)]
+        (rows, keys) = AmbitParser._group_codes(df, gcols)
+        (cols, endpoint_keys) = AmbitParser._group_codes(df, endpoints)
+        nrows = rows.max() + 1 if len(rows) else 0
+        ncols = cols.max() + 1 if len(cols) else 0
 
+        matrix = np.empty((nrows, ncols))
+        block = max(1, max_memory // max(1, ncols * 8 * 2))
+        order = np.argsort(rows, kind="stable")
+        bounds = np.searchsorted(rows[order], np.arange(0, nrows + block, block))
+        for b, start in enumerate(range(0, nrows, block)):
+            stop = min(start + block, nrows)
+            entries = order[bounds[b]:bounds[b + 1]]
+            flat = (rows[entries] - start) * ncols + cols[entries]
+            size = (stop - start) * ncols
+            sums = np.bincount(flat, weights=loValue[entries], minlength=size)
+            counts = np.bincount(flat, minlength=size)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                matrix[start:stop] = (sums / counts).reshape(stop - start, ncols)
+
+        first_row = np.unique(rows, return_index=True)[1]
+        first_col = np.unique(cols, return_index=True)[1]
+        tmp = {}
+        for c in gcols:
+            tmp["_".join([c] + [""] * len(endpoints))] = keys[c].iloc[first_row].to_numpy()
+        names = ["_".join(["loValue"] + [str(endpoint_keys[e].iloc[i]) for e in endpoints]) for i in first_col]
+        tmp = pd.DataFrame(tmp)
+        for c in tmp.columns:
+            tmp[c] = tmp[c].infer_objects()
+        return pd.concat([tmp, pd.DataFrame(matrix, columns=names)], axis=1)
 
     @staticmethod
-    def hdf52ambit(h5file):
-        substances = {}
+    def read_study(h5file, _uuid, owner=None):
+        """
+        The study at /study/_uuid as in hdf52ambit, reading each group's
+        attributes once; owner is the substance uuid, if already known
+        """
+        study = { "owner" : { "substance" : {} , "company" : {}}, "citation" : {}, "protocol" : { "category": {}} , "parameters" : [], "effects" : []}
+        study['uuid'] = _uuid
+        h5path = "/study/{}".format(_uuid)
+        if owner is None:
+            study['owner']['substance'].update(AmbitParser._select(
+                AmbitParser.read_all_attributes(h5file, "{}/owner/substance".format(h5path)), ['uuid']))
+        else:
+            study['owner']['substance']['uuid'] = owner
+        study.update(AmbitParser._select(AmbitParser.read_all_attributes(h5file, h5path), ['investigation_uuid', "assay_uuid"]))
+        study['owner']['company'].update(AmbitParser._select(
+            AmbitParser.read_all_attributes(h5file, "{}/owner/company".format(h5path)), ['uuid', 'name']))
+        study['citation'].update(AmbitParser._select(
+            AmbitParser.read_all_attributes(h5file, "{}/citation".format(h5path)), ['title', 'year', 'owner']))
+        protocol = AmbitParser.read_all_attributes(h5file, "{}/protocol".format(h5path))
+        study['protocol'].update(AmbitParser._select(protocol, ['topcategory', 'endpoint','guideline']))
+        study['protocol']['category'].update(AmbitParser._select(protocol, ['code', 'title', 'term']))
+        for (attr, value) in AmbitParser.read_all_attributes(h5file, "{}/parameters".format(h5path)).items():
+            study['parameters'].append({attr: value})
+        results = h5file["{}/results".format(h5path)]
+        for endpointtype in results:
+            group = results[endpointtype]
+            for key in group:
+                effect = {"endpoint" : "","unit" : "","conditions" : []}
+                effect["endpointtype"] = endpointtype
+                for (attr, value) in group[key].attrs.items():
+                    if "endpoint" == attr or "endpoint.unit" == attr:
+                        effect[attr] = value
+                    else:
+                        effect["conditions"].append({attr : AmbitParser.parse_attribute_value(value)})
+                study["effects"].append(effect)
+        return study
+
+    @staticmethod
+    def iter_hdf52ambit(h5file):
+        """
+        Yields the substances of a file written by ambit2hdf5, one at a time
+        with their studies, as the items of hdf52ambit(h5file)["substance"].
+        Works with h5py and h5pyd files; only the study to substance index
+        (one attribute per study) and the current substance are in memory.
+        Studies of substances not in /substance are skipped.
+        """
+        studies = {}
         for _uuid in h5file["substance"]:
+            studies[_uuid] = []
+        for _uuid in h5file["study"]:
+            owner = AmbitParser.read_all_attributes(h5file, "/study/{}/owner/substance".format(_uuid)).get("uuid")
+            if owner in studies:
+                studies[owner].append(_uuid)
+        for _uuid in studies:
             substance = {}
             substance['i5uuid'] = _uuid
             substance['study'] = []
-            AmbitParser.read_attributes(h5file, "/substance/{}".format(_uuid), substance,
-                        props=["ownerName", "substanceType", "name", "publicname"])
-            substances[_uuid] = substance
-
-        for _uuid in h5file["study"]:
-            study = { "owner" : { "substance" : {} , "company" : {}}, "citation" : {}, "protocol" : { "category": {}} , "parameters" : [], "effects" : []}
-            study['uuid'] = _uuid
-            h5path = "/study/{}".format(study['uuid'])
-            AmbitParser.read_attributes(h5file, "{}/owner/substance".format(h5path), study['owner']['substance'], props=['uuid'])
-            substances[study['owner']['substance']["uuid"]]["study"].append(study)
-            AmbitParser.read_attributes(h5file, h5path, study, props=['investigation_uuid', "assay_uuid"])
-            AmbitParser.read_attributes(h5file, "{}/owner/company".format(h5path), study['owner']['company'], props=['uuid', 'name'])
-
-            AmbitParser.read_attributes(h5file, "{}/citation".format(h5path), study['citation'], props=['title', 'year', 'owner'])
-            AmbitParser.read_attributes(h5file, "{}/protocol".format(h5path), study['protocol'], props=['topcategory', 'endpoint','guideline'])
-            AmbitParser.read_attributes(h5file, "{}/protocol".format(h5path), study['protocol']['category'], props=['code', 'title', 'term'])
-            params = h5file["{}/parameters".format(h5path)].attrs
-            for attr in params:
-                param = {}
-                param[attr] = AmbitParser.parse_attribute_value(params[attr])
-                study['parameters'].append(param)
-            results = h5file["{}/results".format(h5path)]
-            effects = []
-            for endpointtype in results:
-                for key in results[endpointtype]:
-                    effect = {"endpoint" : "","unit" : "","conditions" : []}
-                    effect["endpointtype"] = endpointtype
-                    dataset = results[endpointtype][key]
-                    for attr in dataset.attrs:
-                        value = dataset.attrs[attr]
-                        if "endpoint" == attr:
-                            effect[attr] = value
-                        elif "endpoint.unit" == attr:
-                            effect[attr] = value
-                        else:
-
-                            effect["conditions"].append({attr : AmbitParser.parse_attribute_value(value)});
-                    study["effects"].append(effect)
+            substance.update(AmbitParser._select(AmbitParser.read_all_attributes(h5file, "/substance/{}".format(_uuid)),
+                                                 ["ownerName", "substanceType", "name", "publicname"]))
+            for study_uuid in studies[_uuid]:
+                substance['study'].append(AmbitParser.read_study(h5file, study_uuid, owner=_uuid))
+            yield substance
 
+    @staticmethod
+    def hdf52ambit(h5file):
+        return {"substance" : list(AmbitParser.iter_hdf52ambit(h5file))}
 
-        datamodel = {"substance" : [] }
-        for _uuid in substances:
-            datamodel["substance"].append(substances[_uuid])
-        return datamodel
-
+    _dt_effects = np.dtype([("endpoint", np.float64), ("concentration", np.float64), ("time", np.int64)])
 
     @staticmethod
-    def ambit2hdf5(datamodel, h5file):
-        for substance in datamodel['substance']:
+    def _effect_row(effect):
+        """(dataset name, properties, row or None) of an effect, for ambit2hdf5"""
+        _unit = effect["unit"] if "unit" in effect else "None"
+        concentration_unit = "None"
+        conditions = effect.get("conditions") or {}
+        try:
+            if "concentration" in conditions and "unit" in conditions["concentration"]:
+                concentration_unit = str(conditions["concentration"]["unit"])
+        except Exception as err:
+            pass
+        properties = {"endpoint": effect["endpoint"], "endpoint.unit": _unit, "concentration.unit": concentration_unit}
+        if "E.exposure_time" in conditions:
+            properties["E.exposure_time"] = str(conditions["E.exposure_time"])
+        try:
+            row = (float(effect["result"]["loValue"]), float(conditions["concentration"]["loValue"]),
+                   int(conditions["E.exposure_time"]["loValue"]))
+        except Exception as err:
+            row = None
+        return ("{}/{}({})".format(effect["endpointtype"], effect["endpoint"], _unit), properties, row)
 
-            # print(substance['ownerName'], substance["substanceType"], substance["name"], substance["publicname"])
+    @staticmethod
+    def ambit2hdf5(datamodel, h5file, compression="gzip", compression_opts=None, chunks=True):
+        """
+        Writes the substances and studies of an AMBIT datamodel, a
+        {"substance": [...]} dict or any iterable of substances (e.g. a
+        generator reading them one by one), to an open h5py/h5pyd file.
+        Effects are grouped per results dataset in one pass over each study
+        and every dataset is allocated and written once, chunked and compressed with
+        compression ("gzip", "lzf" or None) and compression_opts.
+        """
+        substances = datamodel['substance'] if isinstance(datamodel, dict) else datamodel
+        dt_effects = AmbitParser._dt_effects
+        options = {"chunks": chunks, "compression": compression, "compression_opts": compression_opts}
+        for substance in substances:
             AmbitParser.write_attributes(h5file, "/substance/{}".format(
                         substance['i5uuid']), substance,
                         props=["ownerName", "substanceType", "name", "publicname"])
+            # rows and properties per results dataset
             results = {}
             for study in substance['study']:
                 AmbitParser.write_attributes(h5file, "/study/{}".format(study['uuid']), study, props=['investigation_uuid', "assay_uuid"])
@@ -193,70 +338,21 @@ class AmbitParser:
                 AmbitParser.write_attributes(h5file, "/study/{}/citation".format(study['uuid']), study['citation'], props=['title', 'year', 'owner'])
                 AmbitParser.write_attributes(h5file, "/study/{}/protocol".format(study['uuid']), study['protocol'], props=['topcategory', 'endpoint','guideline'])
                 AmbitParser.write_attributes(h5file, "/study/{}/protocol".format(study['uuid']), study['protocol']['category'], props=['code', 'title', 'term'])
-                for param in study['parameters']:
-                    AmbitParser.write_attributes(h5file, "/study/{}/parameters".format(study['uuid']), study['parameters'], props= [ param])
-
+                if study['parameters']:
+                    AmbitParser.write_attributes(h5file, "/study/{}/parameters".format(study['uuid']), study['parameters'], props=list(study['parameters']))
 
-
-                # print(study['reliability'])
-                dt_effects = np.dtype([("endpoint", np.float), ("concentration", np.float), ("time", np.integer)])
                 for effect in study['effects']:
-                    AmbitParser.effects2df(study['effects'], conditions = ["concentration","E.exposure_time","Material","Replicate","Technical replicate","Biological replicate"])
-                    if "unit" in effect:
-                        _unit = effect["unit"]
-                    else:
-                        _unit = "None"
-                    try:
-                        if "concentration" in effect["conditions"]:
-                            if "unit" in effect["conditions"]["concentration"]:
-                                concentration_unit = str(effect["conditions"]["concentration"]["unit"])
-                                control = None
-                            else:
-                                control = effect["conditions"]["concentration"]
-                                concentration_unit = "None"
-                    except Exception as err:
-                        # no concentration
-                        concentration_unit = "None"
-                        control = None
-                        pass
-
-                    _tag = "/study/{}/results/{}".format(study['uuid'],effect["endpointtype"])
-                    _tag_endpoint = "{}/{}({})".format(_tag, effect["endpoint"],_unit)
+                    (name, properties, row) = AmbitParser._effect_row(effect)
+                    _tag_endpoint = "/study/{}/results/{}".format(study['uuid'], name)
                     if not (_tag_endpoint in results):
-                        results[_tag_endpoint] = {"dataset": np.array([], dtype=dt_effects), "properties": {}}
-                    # print(_tag_endpoint,_tmp)
-                    try:
-                        _tmp = results[_tag_endpoint]["dataset"]
-                        results[_tag_endpoint]["properties"] = {
-                                    "endpoint": effect["endpoint"],
-                                    "endpoint.unit": _unit, "concentration.unit": concentration_unit}
-                        # results[_tag_endpoint]["properties"]["unit"] = _unit
-
-                        try:
-                            results[_tag_endpoint]["properties"]["E.exposure_time"] = str(effect["conditions"]["E.exposure_time"])
-                        except Exception as err:
-                            pass
-                            # print("!!!",err,effect["conditions"]["E.exposure_time"])
-                        results[_tag_endpoint]["dataset"]=  np.append(_tmp,
-                            np.array([(effect["result"]["loValue"],
-                                    effect["conditions"]["concentration"]["loValue"],
-                                    int(effect["conditions"]["E.exposure_time"]["loValue"])
-                                    )], dtype=dt_effects))
+                        results[_tag_endpoint] = {"rows": [], "properties": {}}
+                    results[_tag_endpoint]["properties"] = properties
+                    if row is not None:
+                        results[_tag_endpoint]["rows"].append(row)
 
-                        # print(effect["endpoint"]["loValue"],effect["conditions"]["concentration"]["loValue"])
-                    except Exception as err:
-                        # print(err)
-                        pass
-                    #
-                    # print(effect["endpoint"])
-                    # print(effect["endpointtype"])
-                    # for condition in effect["conditions"]:
-                    #    print(condition,effect["conditions"][condition])
-                    #  print(">>result")
-                    # for result in effect["result"]:
-                        #print(result,effect["result"][result])
-            #print(results)
             for _tag in results:
-                result_dataset = h5file.require_dataset(_tag, data=results[_tag]["dataset"], shape=(len(results[_tag]["dataset"]), ), dtype=dt_effects)
+                dataset = np.array(results[_tag]["rows"], dtype=dt_effects)
+                result_dataset = h5file.require_dataset(_tag, data=dataset, shape=dataset.shape, dtype=dt_effects,
+                                                        **(options if len(dataset) > 0 else {}))
                 for prop in results[_tag]["properties"]:
                     result_dataset.attrs[prop] = results[_tag]["properties"][prop]
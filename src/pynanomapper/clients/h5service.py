@@ -4,8 +4,8 @@ import h5pyd
 import traceback
 
 class H5BasicService(QueryService):
-    def __init__(self,tokenservice):
-        super().__init__(tokenservice)
+    def __init__(self,tokenservice,session=None):
+        super().__init__(tokenservice,session=session)
 
     def File(self,name, mode='r',retries=1):
         return h5pyd.File(name, mode=mode, retries=retries, api_key=self.tokenservice.api_key());
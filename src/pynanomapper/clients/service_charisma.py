@@ -3,6 +3,7 @@ import traceback
 from matplotlib.figure import Figure
 import numpy as np
 from pynanomapper.clients.authservice import QueryService
+from pynanomapper import connection
 from pynanomapper.clients.h5service import H5BasicService
 from pynanomapper.clients.datamodel_simple import StudyRaman, Substance
 from ramanchada2.spectrum import from_chada
@@ -20,8 +21,8 @@ from io import BytesIO
 import base64
 
 class H5Service(H5BasicService):
-    def __init__(self,tokenservice):
-        super().__init__(tokenservice)
+    def __init__(self,tokenservice,session=None):
+        super().__init__(tokenservice,session=session)
         self.tags = ["sample","investigation","provider","instrument","wavelength","optical_path"]
 
     def create_domain(self,domain):
@@ -138,14 +139,14 @@ class H5Service(H5BasicService):
         _token = self.tokenservice.api_key()
         if _token != None:
             headers["Authorization"] = "Bearer {}".format(_token);
-        return requests.get(solr_url, params = params, headers= headers)
+        return connection.get_session(self.session).get(solr_url, params = params, headers= headers)
 
     def solrquery_post(self,solr_url, json):
         headers = {}
         _token = self.tokenservice.api_key()
         if _token != None:
             headers["Authorization"] = "Bearer {}".format(_token);
-        return requests.get(solr_url, json = json, headers= headers)
+        return connection.get_session(self.session).get(solr_url, json = json, headers= headers)
 
     def thumbnail(self,solr_url,domain,figsize=(6,4),extraprm=""):
         rs = None
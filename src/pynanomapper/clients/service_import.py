@@ -6,8 +6,8 @@ import json
 import pandas as pd
 
 class ImportService(H5Service):
-    def __init__(self,tokenservice,ramandb_api,hsds_investigation,dry_run=False):
-        super().__init__(tokenservice)
+    def __init__(self,tokenservice,ramandb_api,hsds_investigation,dry_run=False,session=None):
+        super().__init__(tokenservice,session=session)
         self.ramandb_api = ramandb_api
         self.hsds_investigation = hsds_investigation
         self.dry_run = dry_run
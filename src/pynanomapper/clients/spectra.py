@@ -0,0 +1,193 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+def x4search(dim=1024):
+    return np.linspace(140,3*1024+140,num=dim)
+
+
+def moving_minimum(y,window=16):
+    """
+    Same baseline as ramanchada2 Spectrum.moving_minimum: the larger of the
+    minima over the window starting and the window ending at each point.
+    For a 2d y, every row is a spectrum.
+    """
+    y = np.asarray(y,dtype=float)
+    pad = np.full(y.shape[:-1] + (window-1,),np.inf)
+    # minima over z[j:j+span], doubling span with one np.minimum each time
+    z = np.concatenate((pad,y,pad),axis=-1)
+    span = 1
+    while 2*span <= window:
+        z = np.minimum(z[...,:-span],z[...,span:])
+        span = 2*span
+    if span < window:
+        z = np.minimum(z[...,:span-window],z[...,window-span:])
+    # z[j] is the minimum over the window ending at j + window - 1 of y
+    return np.maximum(z[...,window-1:],z[...,:y.shape[-1]])
+
+
+def hist_embedding(x,y,xlinspace=None,remove_baseline=True,window=16):
+    """
+    CDF and PDF on xlinspace of the spectrum taken as a histogram, with bins
+    centered on x. Same values as scipy.stats.rv_histogram in
+    StudyRaman.xy2embedding, computed with cumsum and searchsorted.
+    Spectra with fewer than two points in the xlinspace range give NaN.
+    """
+    if xlinspace is None:
+        xlinspace = x4search()
+    x = np.asarray(x,dtype=float)
+    counts = np.asarray(y,dtype=float)
+    index = (x>=xlinspace[0]) & (x<=xlinspace[-1])
+    x = x[index]
+    counts = counts[index]
+    if len(x) < 2:
+        return (np.full(len(xlinspace),np.nan),np.full(len(xlinspace),np.nan))
+    if remove_baseline:
+        counts = counts - moving_minimum(counts,window)
+    bins = np.empty(len(x)+1)
+    bins[0] = (3*x[0] - x[1])/2
+    bins[1:-1] = (x[1:] + x[:-1])/2
+    bins[-1] = (3*x[-1] - x[-2])/2
+    # rv_histogram scales counts to a density; with counts in every bin this
+    # is counts / sum(counts * widths), for equal as well as varying widths
+    mass = np.cumsum(counts * np.diff(bins))
+    with np.errstate(divide="ignore",invalid="ignore"):
+        hpdf = counts / mass[-1]
+        hcdf = mass / mass[-1]
+    pdf = np.concatenate(([0.0],hpdf,[0.0]))[np.searchsorted(bins,xlinspace,side="right")]
+    cdf = np.interp(xlinspace,bins,np.concatenate(([0.0],hcdf)))
+    cdf[xlinspace>=bins[-1]] = 1.0
+    return (cdf,pdf)
+
+
+def _inside(x,xlinspace):
+    return (x>=xlinspace[0]) & (x<=xlinspace[-1])
+
+
+def _searchsorted_rows(a,v):
+    """
+    np.searchsorted(a[i],v,side="right") for every row of a, v ascending:
+    the number of edges of a row at or below v[t] is the number of its
+    edges with fewer than t+1 values of v below them.
+    """
+    (n,m) = a.shape
+    below = np.searchsorted(v,a,side="left") + (len(v)+1)*np.arange(n)[:,None]
+    counts = np.bincount(below.ravel(),minlength=n*(len(v)+1)).reshape(n,len(v)+1)
+    return np.cumsum(counts,axis=1)[:,:len(v)]
+
+
+def hist_embeddings(x,y,xlinspace=None,remove_baseline=True,window=16):
+    """
+    hist_embedding of n spectra at once, x and y being (n, points) arrays.
+    The rows of x may differ, but must have the same number of points in
+    the xlinspace range, which has to be ascending. Returns (cdf, pdf) as
+    (n, len(xlinspace)) matrices.
+    """
+    if xlinspace is None:
+        xlinspace = x4search()
+    xlinspace = np.asarray(xlinspace,dtype=float)
+    x = np.asarray(x,dtype=float)
+    counts = np.asarray(y,dtype=float)
+    index = _inside(x,xlinspace)
+    inside = index.sum(axis=1)
+    if len(inside) > 0 and (inside != inside[0]).any():
+        raise ValueError("Spectra with different numbers of points in the xlinspace range")
+    n = len(x)
+    m = inside[0] if n > 0 else 0
+    if m < 2:
+        return (np.full((n,len(xlinspace)),np.nan),np.full((n,len(xlinspace)),np.nan))
+    if not index.all():
+        x = x[index].reshape(n,m)
+        counts = counts[index].reshape(n,m)
+    if remove_baseline:
+        counts = counts - moving_minimum(counts,window)
+    # spectra on one axis share the bins and the lookups
+    if (x == x[0]).all():
+        x = x[:1]
+    bins = np.empty((len(x),m+1))
+    bins[:,0] = (3*x[:,0] - x[:,1])/2
+    bins[:,1:-1] = (x[:,1:] + x[:,:-1])/2
+    bins[:,-1] = (3*x[:,-1] - x[:,-2])/2
+    mass = np.cumsum(counts * np.diff(bins,axis=1),axis=1)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        hpdf = counts / mass[:,-1:]
+        hcdf = mass / mass[:,-1:]
+    k = _searchsorted_rows(bins,xlinspace)
+    j = np.clip(k-1,0,m-1)
+    (xp0,xp1) = (np.take_along_axis(bins,j,axis=1),np.take_along_axis(bins,j+1,axis=1))
+    with np.errstate(divide="ignore",invalid="ignore"):
+        weight = (xlinspace - xp0) / (xp1 - xp0)
+    zeros = np.zeros((n,1))
+    hpdf = np.concatenate((zeros,hpdf,zeros),axis=1)
+    fp = np.concatenate((zeros,hcdf),axis=1)
+    if len(bins) == 1:
+        # one axis: the lookups index columns
+        (k,j,weight) = (k[0],j[0],weight[0])
+        pdf = hpdf[:,k]
+        (fp0,fp1) = (fp[:,j],fp[:,j+1])
+    else:
+        pdf = np.take_along_axis(hpdf,k,axis=1)
+        (fp0,fp1) = (np.take_along_axis(fp,j,axis=1),np.take_along_axis(fp,j+1,axis=1))
+    # np.interp over the bin edges, row by row
+    cdf = (fp1 - fp0) * weight + fp0
+    cdf[...,k==0] = 0.0
+    cdf[...,k>m] = 1.0
+    return (cdf,pdf)
+
+
+def _embed_chunk(args):
+    (spectra,xlinspace,remove_baseline,window) = args
+    if len({len(x) for (x,y) in spectra}) == 1:
+        x = np.array([x for (x,y) in spectra],dtype=float)
+        # on one axis, as one array; with an axis per spectrum the lookups
+        # cost more in a batch than one at a time
+        if (x == x[0]).all():
+            return hist_embeddings(x,np.array([y for (x,y) in spectra],dtype=float),xlinspace,remove_baseline,window)
+    # one at a time
+    cdf = np.empty((len(spectra),len(xlinspace)))
+    pdf = np.empty((len(spectra),len(xlinspace)))
+    for i, (x,y) in enumerate(spectra):
+        (cdf[i],pdf[i]) = hist_embedding(x,y,xlinspace,remove_baseline,window)
+    return (cdf,pdf)
+
+
+def _chunks(spectra,xlinspace,remove_baseline,window,chunksize):
+    chunk = []
+    for spectrum in spectra:
+        chunk.append(spectrum)
+        if len(chunk) >= chunksize:
+            yield (chunk,xlinspace,remove_baseline,window)
+            chunk = []
+    if chunk:
+        yield (chunk,xlinspace,remove_baseline,window)
+
+
+def embed_spectra(spectra,xlinspace=None,remove_baseline=True,window=16,workers=None,chunksize=500):
+    """
+    Embeds many spectra at once. spectra is an iterable of (x, y) pairs of
+    any length, or a 3d array (n, 2, points) such as a stack of "raw"
+    datasets. Returns (cdf, pdf) as two (n, len(xlinspace)) matrices, rows in
+    the order of spectra. A chunk of spectra sharing one x axis is embedded
+    by hist_embeddings as one array, other chunks spectrum by spectrum.
+    With workers > 1, chunks of chunksize spectra are embedded in a process
+    pool.
+    """
+    if xlinspace is None:
+        xlinspace = x4search()
+    xlinspace = np.asarray(xlinspace,dtype=float)
+    chunks = _chunks(spectra,xlinspace,remove_baseline,window,chunksize)
+    if workers is None or workers <= 1:
+        results = [_embed_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_embed_chunk,chunks))
+    if not results:
+        return (np.empty((0,len(xlinspace))),np.empty((0,len(xlinspace))))
+    return (np.vstack([cdf for (cdf,pdf) in results]),np.vstack([pdf for (cdf,pdf) in results]))
+
+
+def h5spectra(h5files,dataset="raw"):
+    """(x, y) from dataset of each open h5py/h5pyd file, for embed_spectra"""
+    for h5 in h5files:
+        data = h5[dataset][()]
+        yield (data[0],data[1])
@@ -0,0 +1,129 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3.util.retry import Retry
+
+_lock = threading.Lock()
+_session = None
+
+# Solr request handlers that only read, where a POST can be safely sent again
+READ_ONLY_PATHS = ("/select", "/query", "/export")
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter with a default timeout for requests sent without one"""
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+class CachingHTTPAdapter(TimeoutHTTPAdapter):
+    """
+    TimeoutHTTPAdapter answering from a cache.ResponseCache where possible.
+    Streamed requests are passed through.
+    """
+    def __init__(self, cache, **kwargs):
+        self.cache = cache
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('stream') or not self.cache.cacheable(request):
+            return super().send(request, **kwargs)
+        key = self.cache.key(request)
+        entry = self.cache.get(key)
+        if entry is not None:
+            if entry['fresh']:
+                return self.cache.response(entry, request)
+            request = request.copy()
+            if entry['etag']:
+                request.headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                request.headers['If-Modified-Since'] = entry['last_modified']
+        response = super().send(request, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self.cache.revalidated(key)
+            return self.cache.response(entry, request)
+        if response.status_code == 200:
+            self.cache.put(key, response)
+        return response
+
+
+class ReadOnlyRoutingAdapter(BaseAdapter):
+    """
+    Sends POSTs to the read_only_paths (Solr queries) through read_only, an
+    adapter that also retries POST, and all other requests through default,
+    which retries only the idempotent methods: an import or an /update the
+    server has applied before failing must not be sent twice.
+    """
+    def __init__(self, default, read_only, read_only_paths=READ_ONLY_PATHS):
+        self.default = default
+        self.read_only = read_only
+        self.read_only_paths = tuple(read_only_paths)
+        super().__init__()
+
+    def send(self, request, **kwargs):
+        path = urlsplit(request.url).path.rstrip("/")
+        if request.method == "POST" and path.endswith(self.read_only_paths):
+            return self.read_only.send(request, **kwargs)
+        return self.default.send(request, **kwargs)
+
+    def close(self):
+        self.default.close()
+        self.read_only.close()
+
+
+def create_session(pool_connections=10, pool_maxsize=10, retries=3, backoff_factor=0.5,
+                   status_forcelist=(429, 500, 502, 503, 504), timeout=(10, 300), cache=None,
+                   read_only_paths=READ_ONLY_PATHS):
+    """
+    requests.Session with keep-alive connection pools, retry with exponential
+    backoff on the status_forcelist codes and a default (connect, read)
+    timeout. pool_connections is the number of hosts with a cached pool,
+    pool_maxsize the number of connections kept per host.
+    Only idempotent methods are retried, and POSTs to read_only_paths, as
+    Solr queries are often POSTs (see ReadOnlyRoutingAdapter).
+    cache is an optional cache.ResponseCache.
+    """
+    def adapter(allowed_methods):
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=status_forcelist, allowed_methods=allowed_methods,
+                      raise_on_status=False, respect_retry_after_header=True)
+        if cache is None:
+            return TimeoutHTTPAdapter(timeout=timeout, pool_connections=pool_connections,
+                                      pool_maxsize=pool_maxsize, max_retries=retry)
+        return CachingHTTPAdapter(cache, timeout=timeout, pool_connections=pool_connections,
+                                  pool_maxsize=pool_maxsize, max_retries=retry)
+
+    adapter = ReadOnlyRoutingAdapter(adapter(Retry.DEFAULT_ALLOWED_METHODS),
+                                     adapter(Retry.DEFAULT_ALLOWED_METHODS | {"POST"}),
+                                     read_only_paths=read_only_paths)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(session=None):
+    """Returns session if given, otherwise the process-wide shared session"""
+    global _session
+    if session is not None:
+        return session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def set_session(session):
+    """Replaces the shared session, e.g. with one from create_session(...)"""
+    global _session
+    with _lock:
+        _session = session
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+
+class KNNIndex:
+    """
+    Exact nearest neighbour search in memory, for offline evaluation of the
+    Solr {!knn} search. Scores follow the Solr DenseVectorField similarities,
+    so they can be compared with client_solr.knn_search results:
+    cosine (1 + cos) / 2, dot_product (1 + dot) / 2, euclidean 1 / (1 + d^2).
+    """
+    similarities = ("cosine", "dot_product", "euclidean")
+
+    def __init__(self, vectors, ids=None, similarity="cosine", block_size=1024):
+        if similarity not in self.similarities:
+            raise ValueError("similarity should be one of {}".format(self.similarities))
+        self.vectors = np.ascontiguousarray(np.atleast_2d(vectors), dtype=np.float32)
+        self.ids = np.asarray(range(self.vectors.shape[0]) if ids is None else ids, dtype=object)
+        if len(self.ids) != self.vectors.shape[0]:
+            raise ValueError("{} ids for {} vectors".format(len(self.ids), self.vectors.shape[0]))
+        self.similarity = similarity
+        self.block_size = block_size
+        if similarity == "cosine":
+            self.vectors = self._normalize(self.vectors)
+        self.sqnorms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def scores(self, queries):
+        """Score matrix, queries x indexed vectors"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.similarity == "cosine":
+            queries = self._normalize(queries)
+        dot = queries @ self.vectors.T
+        if self.similarity == "euclidean":
+            d2 = np.einsum("ij,ij->i", queries, queries)[:, None] - 2 * dot + self.sqnorms[None, :]
+            return 1 / (1 + np.maximum(d2, 0))
+        return (1 + dot) / 2
+
+    def search(self, queries, topk=10, query_ids=None):
+        """
+        Top topk hits per row of queries, as the same tidy DataFrame as
+        client_solr.knn_search (query_id, rank, hit_id, score).
+        Queries are scored block_size rows at a time to bound memory.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        n = queries.shape[0]
+        query_ids = np.asarray(range(n) if query_ids is None else query_ids, dtype=object)
+        topk = min(topk, self.vectors.shape[0])
+        frames = []
+        for start in range(0, n, self.block_size):
+            scores = self.scores(queries[start:start + self.block_size])
+            if topk < scores.shape[1]:
+                top = np.argpartition(-scores, topk - 1, axis=1)[:, :topk]
+            else:
+                top = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            frames.append(pd.DataFrame({
+                "query_id": np.repeat(query_ids[start:start + scores.shape[0]], topk),
+                "rank": np.tile(np.arange(topk), scores.shape[0]),
+                "hit_id": self.ids[top.ravel()],
+                "score": top_scores.ravel().astype(float)}))
+        if not frames:
+            return pd.DataFrame(columns=["query_id", "rank", "hit_id", "score"])
+        return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,205 @@
+import json
+import uuid
+from pathlib import Path
+
+import pandas as pd
+
+from pynanomapper.client_solr import StudyDocuments
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+PARTITION_COLUMNS = ("p.oht.module", "p.oht.section")
+# dataset schema, merged over all the written batches
+SCHEMA_FILE = "_common_metadata"
+_PARTITION_KEY = b"pynanomapper.partition_cols"
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is required for parquet export, pip install pyarrow")
+
+
+def _value_type(t):
+    return t.value_type if pa.types.is_dictionary(t) else t
+
+
+def _storage_type(t):
+    # categoricals as string dictionaries, so that the x.* columns of all the
+    # batches have one type whatever their values
+    if pa.types.is_dictionary(t):
+        return pa.dictionary(pa.int32(), pa.string())
+    return t
+
+
+def _merge_type(old, new):
+    """Type that both old and new values can be cast to"""
+    if old == new or pa.types.is_null(new):
+        return old
+    if pa.types.is_null(old):
+        return new
+    dictionary = pa.types.is_dictionary(old) or pa.types.is_dictionary(new)
+    v_old, v_new = _value_type(old), _value_type(new)
+    if v_old == v_new or pa.types.is_null(v_new):
+        value_type = v_old
+    elif pa.types.is_null(v_old):
+        value_type = v_new
+    elif (pa.types.is_integer(v_old) or pa.types.is_floating(v_old)) and \
+            (pa.types.is_integer(v_new) or pa.types.is_floating(v_new)):
+        value_type = pa.float64()
+    else:
+        value_type = pa.string()
+    return pa.dictionary(pa.int32(), value_type) if dictionary else value_type
+
+
+def _cast(column, t):
+    if column.type == t:
+        return column
+    if pa.types.is_dictionary(t):
+        if pa.types.is_dictionary(column.type):
+            column = column.cast(t.value_type)
+        elif column.type != t.value_type:
+            column = column.cast(t.value_type)
+        return pc.dictionary_encode(column).cast(t)
+    if pa.types.is_dictionary(column.type):
+        column = column.cast(column.type.value_type)
+    return column.cast(t)
+
+
+def _to_arrow(series):
+    try:
+        return pa.chunked_array([pa.Array.from_pandas(series)])
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # mixed python objects, e.g. numbers and strings in a x.params.* column
+        values = series.astype(object)
+        values = [None if (x is None or (not isinstance(x, (list, tuple)) and pd.isna(x))) else str(x) for x in values]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            return pa.chunked_array([pa.array(values, type=pa.string()).dictionary_encode()])
+        return pa.chunked_array([pa.array(values, type=pa.string())])
+
+
+class StudyParquetWriter:
+    """
+    Writes StudyDocuments results to a Parquet dataset in folder, with hive
+    style partitions (p.oht.module=.../p.oht.section=...). Categorical columns
+    are stored as dictionary encoded strings. Every batch goes to new files; the dataset
+    schema in _common_metadata grows with the x.params.* and x.conditions.*
+    columns of each batch, and a column seen with incompatible types is
+    widened to float64 or string. Writing to an existing folder appends.
+    """
+
+    def __init__(self, folder, partition_cols=PARTITION_COLUMNS, batch=10000):
+        _require_pyarrow()
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.partition_cols = list(partition_cols)
+        self.batch = batch
+        self.rows = []
+        self.schema = None
+        if (self.folder / SCHEMA_FILE).exists():
+            self.schema = pq.read_schema(self.folder / SCHEMA_FILE)
+            metadata = self.schema.metadata or {}
+            if _PARTITION_KEY in metadata:
+                self.partition_cols = json.loads(metadata[_PARTITION_KEY])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data):
+        """Appends a DataFrame (parse_columnar, rows2frame) or a list of row dicts (parse)"""
+        if isinstance(data, pd.DataFrame):
+            self.flush()
+            self._write_frame(data)
+        else:
+            self.rows.extend(data)
+            if len(self.rows) >= self.batch:
+                self.flush()
+
+    def flush(self):
+        if self.rows:
+            df = StudyDocuments().rows2frame(self.rows)
+            self.rows = []
+            self._write_frame(df)
+
+    def close(self):
+        self.flush()
+
+    def _write_frame(self, df):
+        if df.empty:
+            return
+        columns = {}
+        for name in df.columns:
+            if name in self.partition_cols:
+                values = df[name].astype(object)
+                columns[name] = pa.chunked_array([pa.array(values.where(values.notna(), None), type=pa.string())])
+            else:
+                columns[name] = _to_arrow(df[name])
+        fields = {field.name: field.type for field in self.schema} if self.schema is not None else {}
+        for name, column in columns.items():
+            t = _storage_type(column.type)
+            fields[name] = _merge_type(fields[name], t) if name in fields else t
+        metadata = {_PARTITION_KEY: json.dumps(self.partition_cols).encode("utf-8")}
+        self.schema = pa.schema([pa.field(name, t) for name, t in fields.items()], metadata=metadata)
+        table = pa.table({name: _cast(column, fields[name]) for name, column in columns.items()})
+        ds.write_dataset(table, self.folder, format="parquet",
+                         partitioning=[c for c in self.partition_cols if c in columns], partitioning_flavor="hive",
+                         basename_template="part-{}-{{i}}.parquet".format(uuid.uuid4().hex),
+                         existing_data_behavior="overwrite_or_ignore")
+        pq.write_metadata(self.schema, self.folder / SCHEMA_FILE)
+
+
+def write_studies(data, folder, partition_cols=PARTITION_COLUMNS, batch=10000):
+    """
+    Writes an iterable of DataFrames or row dict lists, e.g. from
+    StudyDocuments.iter_query, to the Parquet dataset in folder.
+    """
+    with StudyParquetWriter(folder, partition_cols=partition_cols, batch=batch) as writer:
+        for chunk in data:
+            writer.write(chunk)
+    return writer.schema
+
+
+def _expression(filters):
+    if filters is None or isinstance(filters, ds.Expression):
+        return filters
+    if isinstance(filters, dict):
+        expression = None
+        for column, value in filters.items():
+            if isinstance(value, (list, tuple, set)):
+                term = ds.field(column).isin(list(value))
+            else:
+                term = ds.field(column) == value
+            expression = term if expression is None else expression & term
+        return expression
+    return pq.filters_to_expression(filters)
+
+
+def read_studies(folder, columns=None, filters=None):
+    """
+    Reads a dataset written by StudyParquetWriter as a DataFrame with the
+    rows2frame categorical columns. Only the given columns are read, and
+    filters, a {column: value or list} dict, a pyarrow.dataset expression or
+    DNF tuples as in pandas.read_parquet, skip the partitions and row groups
+    that do not match.
+    """
+    _require_pyarrow()
+    folder = Path(folder)
+    schema = None
+    partition_cols = list(PARTITION_COLUMNS)
+    if (folder / SCHEMA_FILE).exists():
+        schema = pq.read_schema(folder / SCHEMA_FILE)
+        metadata = schema.metadata or {}
+        if _PARTITION_KEY in metadata:
+            partition_cols = json.loads(metadata[_PARTITION_KEY])
+    partitioning = ds.partitioning(pa.schema([pa.field(c, pa.string()) for c in partition_cols]), flavor="hive")
+    dataset = ds.dataset(folder, format="parquet", partitioning=partitioning, schema=schema)
+    table = dataset.to_table(columns=columns, filter=_expression(filters))
+    return StudyDocuments.categorize(table.to_pandas())
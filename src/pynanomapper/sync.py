@@ -0,0 +1,163 @@
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from pynanomapper import client_solr
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteMirror:
+    """
+    Local copy of the study table, one JSON record per study id (the
+    StudyDocuments.long2wide row, without the empty fields), and the
+    synchronisation state, in a SQLite file.
+    """
+
+    def __init__(self, path="studies.sqlite"):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS study (id TEXT PRIMARY KEY, record TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+
+    def get_state(self, key, default=None):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM state WHERE key=?", (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set_state(self, key, value):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO state VALUES (?,?)", (key, json.dumps(value)))
+
+    @staticmethod
+    def _record(row):
+        record = {}
+        for key, value in row.items():
+            if isinstance(value, np.generic):
+                value = value.item()
+            if value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NA:
+                continue
+            record[key] = value
+        return json.dumps(record, default=str)
+
+    def upsert(self, df):
+        """Inserts or replaces the rows of a study table with an id.study column"""
+        records = [(row["id.study"], self._record(row)) for row in df.to_dict("records")]
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO study VALUES (?,?)", records)
+        return len(records)
+
+    def delete(self, ids):
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM study WHERE id=?", [(i,) for i in ids])
+        return len(ids)
+
+    def ids(self):
+        with self.lock:
+            return {row[0] for row in self.db.execute("SELECT id FROM study")}
+
+    def frame(self):
+        """The mirrored studies as a DataFrame with the rows2frame categoricals"""
+        with self.lock:
+            records = [json.loads(row[0]) for row in self.db.execute("SELECT record FROM study ORDER BY id")]
+        df = pd.DataFrame(records)
+        # the core columns, even where all the values were empty
+        sd = client_solr.StudyDocuments
+        core = list(sd._substance_columns) + list(sd._study_columns) + ["id.study"]
+        df = df.reindex(columns=core + [col for col in df.columns if col not in core])
+        return sd.categorize(df)
+
+    def close(self):
+        self.db.close()
+
+
+class DeltaHarvester:
+    """
+    Incremental synchronisation of a mirror (SQLiteMirror) with the studies
+    in the Solr core at service_uri. Each sync() fetches only the studies
+    whose updated_field is between the stored high-water mark and the
+    current maximum, upserts them, and with deletions=True removes the
+    mirrored studies whose ids are no longer in Solr, comparing id-only
+    listings (via /export where the schema allows it). The range includes
+    the mark, as updated_s may only have a day resolution, so the studies
+    updated on the day of the last run are fetched again.
+    """
+    state_key = "high_water_mark"
+
+    def __init__(self, service_uri, mirror, auth=None, session=None, updated_field="updated_s", rows=100, fq=None):
+        self.service_uri = service_uri
+        self.mirror = mirror
+        self.auth = auth
+        self.session = session
+        self.updated_field = updated_field
+        self.rows = rows
+        self.fq = fq
+
+    def latest(self):
+        """Largest updated_field value of the studies in Solr, or None"""
+        query = {"q": "type_s:study", "fl": self.updated_field, "rows": 1, "wt": "json",
+                 "sort": "{} desc".format(self.updated_field), "fq": "{}:[* TO *]".format(self.updated_field)}
+        r = client_solr.post(self.service_uri, query, auth=self.auth, session=self.session)
+        r.raise_for_status()
+        docs = r.json()["response"]["docs"]
+        return docs[0][self.updated_field] if docs else None
+
+    def changed(self, since=None, until=None):
+        """Yields parse_long tables of the studies updated in [since, until]"""
+        sd = client_solr.StudyDocuments()
+        textfilter = "type_s:study"
+        if since is not None or until is not None:
+            bounds = ["*" if value is None else '"{}"'.format(value) for value in (since, until)]
+            updated = "{}:[{} TO {}]".format(self.updated_field, *bounds)
+            sd.settings['endpointfilter'] = updated
+            textfilter = "type_s:study AND " + updated
+        query = sd.getQuery(textfilter=textfilter, fq=self.fq or '', rows=self.rows)
+        query.pop("json.facet", None)
+        for page in client_solr.cursor_pages(self.service_uri, query, auth=self.auth, rows=self.rows, session=self.session):
+            docs = page["response"]["docs"]
+            if docs:
+                yield sd.parse_long(docs, process=None)
+
+    def remote_ids(self):
+        export = client_solr.Export(self.service_uri, auth=self.auth, session=self.session)
+        ids = set()
+        for chunk in export.frames(["id"], query="type_s:study", fq=self.fq):
+            ids.update(chunk["id"].tolist())
+        return ids
+
+    def sync(self, deletions=True, full=False):
+        """
+        Brings the mirror up to date; full=True ignores the high-water mark.
+        Returns a dict with the previous and new mark and the numbers of
+        upserted and deleted studies.
+        """
+        since = None if full else self.mirror.get_state(self.state_key)
+        until = self.latest()
+        upserted = 0
+        if since is None:
+            # first run: everything, including studies without updated_field
+            changes = self.changed()
+        elif until is not None:
+            changes = self.changed(since, until)
+        else:
+            changes = []
+        for tables in changes:
+            if len(tables["studies"]) > 0:
+                upserted = upserted + self.mirror.upsert(
+                    client_solr.StudyDocuments.long2wide(tables, keep_ids=True))
+        deleted = 0
+        if deletions:
+            gone = self.mirror.ids() - self.remote_ids()
+            deleted = self.mirror.delete(sorted(gone))
+        if until is not None:
+            self.mirror.set_state(self.state_key, until)
+        report = {"since": since, "until": until, "upserted": upserted, "deleted": deleted}
+        logger.info("Synchronised {}: {}".format(self.service_uri, report))
+        return report
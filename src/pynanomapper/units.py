@@ -9,23 +9,121 @@ from measurement.measures import Distance
 from measurement.base import MeasureBase
 from measurement.base import BidimensionalMeasure
 
-from measurement.utils import guess
+from measurement.utils import get_all_measures
 from os.path import isfile, join
+from functools import lru_cache
 import json
+import numpy as np
+import pandas as pd
 
 def convert_units(value,from_units, to_units="nm",measures=None,debug=False):
+    factor = conversion_factor(from_units,to_units,measures)
     try:
-        to_units = to_units.replace("\u00b5","u")
-        from_units = from_units.replace("\u00b5","u")
-        m = guess(value, from_units)
-        xp='m.' + to_units
-        return (eval(xp))
+        (scale,offset) = factor
+        return value*scale + offset
     except Exception as err:
         if debug:
             print(value,from_units,to_units)
             print(err)
         return None
 
+def _spellings(unit):
+    """Keyword spellings to try for a unit string, as given first"""
+    unit = unit.strip()
+    variants = [unit, unit.replace("\u00b5","u").replace("\u03bc","u")]
+    variants = variants + [v.replace("/","__") for v in variants if v.count("/")==1 and "__" not in v]
+    return list(dict.fromkeys(variants))
+
+def _accepts(measure,spelling):
+    try:
+        measure(**{spelling: 1.0})
+        return True
+    except (AttributeError,KeyError,ValueError,TypeError):
+        return False
+
+@lru_cache(maxsize=None)
+def _candidates(unit,measures):
+    """
+    (measure, spelling) pairs for unit. The measurement classes match units
+    case insensitively, so mM would also be a Distance: a unit that one of
+    DOMAIN_MEASURES accepts is only looked up in those. Lower case spellings
+    are only tried when no measure accepts the unit as written.
+    """
+    exact = _spellings(unit)
+    folded = [v for v in dict.fromkeys(v.lower() for v in exact) if v not in exact]
+    domain = [m for m in measures if m in DOMAIN_MEASURES]
+    generic = [m for m in measures if m not in DOMAIN_MEASURES]
+    for (spellings,group) in ((exact,domain),(exact,generic),(folded,domain),(folded,generic)):
+        candidates = [(measure,f) for measure in group for f in spellings if _accepts(measure,f)]
+        if candidates:
+            return candidates
+    return []
+
+@lru_cache(maxsize=None)
+def _conversion_factor(from_units,to_units,measures):
+    targets = _candidates(to_units,measures)
+    for (measure,f) in _candidates(from_units,measures):
+        one = measure(**{f: 1.0})
+        zero = measure(**{f: 0.0})
+        for (target,t) in targets:
+            if target is not measure:
+                continue
+            try:
+                offset = float(getattr(zero,t))
+                return (float(getattr(one,t)) - offset, offset)
+            except (AttributeError,KeyError,ValueError,TypeError):
+                continue
+    return None
+
+def conversion_factor(from_units,to_units="nm",measures=None):
+    """
+    (scale, offset) with value in to_units = value * scale + offset, from the
+    first of measures (default MEASURES) knowing both units, or None.
+    Resolved once per unit pair and cached.
+    """
+    if not isinstance(from_units,str) or not isinstance(to_units,str):
+        return None
+    measures = MEASURES if measures is None else tuple(measures)
+    return _conversion_factor(from_units,to_units,measures)
+
+def conversion_factors(from_units,to_units,n,measures=None):
+    """
+    Per value (scale, offset) arrays of length n, NaN scale where the units
+    can not be converted. from_units and to_units are a unit or n units; each
+    distinct pair is resolved once by conversion_factor.
+    """
+    (fcodes,funiques) = pd.factorize(pd.Series(np.broadcast_to(np.asarray(from_units,dtype=object),n)))
+    (tcodes,tuniques) = pd.factorize(pd.Series(np.broadcast_to(np.asarray(to_units,dtype=object),n)))
+    nt = max(len(tuniques),1)
+    pairs = np.where((fcodes<0) | (tcodes<0),-1,fcodes*nt+tcodes)
+    (keys,inverse) = np.unique(pairs,return_inverse=True)
+    scale = np.full(len(keys),np.nan)
+    offset = np.zeros(len(keys))
+    for k, key in enumerate(keys):
+        if key < 0:
+            continue
+        factor = conversion_factor(funiques[key//nt],tuniques[key%nt],measures)
+        if factor is not None:
+            (scale[k],offset[k]) = factor
+    return (scale[inverse],offset[inverse])
+
+def convert_array(values,from_units,to_units="nm",measures=None):
+    """
+    Converts an array or pandas Series of values at once, see
+    conversion_factors. Returns (converted, convertible): float values, NaN
+    where the units could not be converted, and the boolean mask of the
+    values with convertible units, as arrays or as Series with the index of
+    values.
+    """
+    index = values.index if isinstance(values,pd.Series) else None
+    values = pd.to_numeric(pd.Series(np.asarray(values,dtype=object).ravel()),errors="coerce").to_numpy(dtype=float)
+    (scale,offset) = conversion_factors(from_units,to_units,len(values),measures)
+    converted = values*scale + offset
+    convertible = ~np.isnan(scale)
+    if index is not None:
+        return (pd.Series(converted,index=index),pd.Series(convertible,index=index))
+    return (converted,convertible)
+
 Distance.ALIAS['\u00B5m'] = 'um'
 
 class Dose(BidimensionalMeasure):
@@ -57,6 +155,7 @@ class Molar(MeasureBase):
         '\u00B5mol' : 1e-6,
         'umol' : 1e-6,
         'mmol' : 1e-3,
+        'nmol' : 1e-9,
     }
     ALIAS = {
         'micromol': 'umol',
@@ -97,10 +196,20 @@ class ConcentrationMolar(BidimensionalMeasure):
         'micromol per ml' : 'umol__l',
         'millimol per l' : 'mmol__l',
         'millimol / l' : 'mmol__l',
-        'micromol per mL' : 'umol__ml'
+        'micromol per mL' : 'umol__ml',
+        'M' : 'mol__l',
+        'mM' : 'mmol__l',
+        'uM' : 'umol__l',
+        '\u00B5M' : 'umol__l',
+        'nM' : 'nmol__l',
+        'nmol/l' : 'nmol__l'
     }
 
 
+# the ones above first, so that e.g. mM is not taken for millimetre
+DOMAIN_MEASURES = (Molar,ConcentrationMolar,Concentration,Dose,Percent)
+MEASURES = DOMAIN_MEASURES + tuple(m for m in dict.fromkeys(get_all_measures()) if m not in DOMAIN_MEASURES)
+
 
 def unitsdict(mypath,df):
     unit_dict={}
@@ -116,3 +225,101 @@ def unitsdict(mypath,df):
     with open(file_ud, 'w') as fp:
         json.dump(unit_dict, fp, indent=2)
     return unit_dict
+
+
+def resolve_unit(unit,measures=None):
+    """The spelling of unit that one of measures accepts, or None"""
+    measures = MEASURES if measures is None else tuple(measures)
+    candidates = _candidates(unit,measures)
+    return candidates[0][1] if candidates else None
+
+def alias_index(units,mypath=None,measures=None):
+    """
+    Maps each of the free text units to a spelling of the measure classes
+    (resolve_unit), None where there is none. With mypath, the index is
+    kept in mypath/unitdict.json as in unitsdict: entries already there,
+    including hand corrections, are reused and only new units are resolved.
+    """
+    unit_dict = {}
+    file_ud = None if mypath is None else join(mypath,'unitdict.json')
+    if file_ud is not None and isfile(file_ud):
+        with open(file_ud) as fp:
+            unit_dict = json.load(fp)
+    new_units = [unit for unit in dict.fromkeys(units) if isinstance(unit,str) and unit != '' and unit not in unit_dict]
+    for unit in new_units:
+        unit_dict[unit] = resolve_unit(unit,measures)
+    if file_ud is not None and new_units:
+        with open(file_ud, 'w') as fp:
+            json.dump(unit_dict, fp, indent=2)
+    return unit_dict
+
+HARMONIZE_STATUS = ["unchanged","converted","incompatible","unknown unit","no unit"]
+
+def harmonize_units(df,mypath=None,canonical=None,endpoint=("p.oht.section","value.endpoint"),
+                    columns=("value.range.lo","value.range.up"),uncertainty="value.uncertainty",measures=None):
+    """
+    Converts the values of a study table (StudyDocuments.parse, rows2frame)
+    to one unit per endpoint, in one pass over all the rows. The canonical
+    unit of an endpoint (the values of the endpoint columns) is given in
+    canonical, a {endpoint value or tuple of values: unit} dict, or else is
+    the known unit most of its rows can be converted to. The units are
+    resolved through alias_index(mypath). Returns a copy with columns converted, uncertainty
+    scaled, value.unit set to the canonical unit, the original unit in
+    value.unit.original, the scale in value.unit.factor and one of
+    HARMONIZE_STATUS in value.unit.status; rows that can not be converted
+    keep their values and unit.
+    """
+    endpoint = list(endpoint)
+    result = df.copy()
+    n = len(result)
+    raw = result["value.unit"].astype(object)
+    raw = raw.where(raw.notna() & (raw != ''),None)
+    index = alias_index(raw.dropna().unique(),mypath,measures)
+    aliases = raw.map(index)
+
+    group = result.groupby(endpoint,dropna=False,observed=True,sort=False).ngroup().to_numpy()
+    known = pd.DataFrame({"group": group,"unit": raw})[aliases.notna().to_numpy()]
+    counts = known.groupby(["group","unit"]).size()
+    target = {}
+    for g, group_counts in counts.groupby(level="group"):
+        units = group_counts.droplevel("group")
+        # the unit the most rows can be converted to, then the most frequent
+        best = None
+        for unit, count in units.items():
+            coverage = sum(c for (u,c) in units.items()
+                           if conversion_factor(index[u],index[unit],measures) is not None)
+            if best is None or (coverage,count) > best[:2]:
+                best = (coverage,count,unit)
+        target[g] = best[2]
+    if canonical:
+        keys = result[endpoint].assign(group=group).drop_duplicates("group")
+        for row in keys.itertuples(index=False):
+            key = tuple(row[:-1])
+            key = key[0] if len(key)==1 else key
+            if key in canonical:
+                target[row[-1]] = canonical[key]
+    target_units = pd.Series(group).map(target).to_numpy(dtype=object)
+    for unit in set(target.values()) - set(index):
+        index[unit] = resolve_unit(unit,measures)
+    target_aliases = pd.Series(target_units).map(index).to_numpy(dtype=object)
+
+    (scale,offset) = conversion_factors(aliases.to_numpy(dtype=object),target_aliases,n,measures)
+    unchanged = (raw.to_numpy(dtype=object) == target_units) & raw.notna().to_numpy()
+    scale[unchanged] = 1.0
+    offset[unchanged] = 0.0
+    ok = ~np.isnan(scale)
+    for column in columns:
+        if column in result.columns:
+            values = pd.to_numeric(result[column],errors="coerce").to_numpy(dtype=float)
+            result[column] = np.where(ok,values*scale + offset,values)
+    if uncertainty in result.columns:
+        values = pd.to_numeric(result[uncertainty],errors="coerce").to_numpy(dtype=float)
+        result[uncertainty] = np.where(ok,values*scale,values)
+
+    status = np.select([unchanged,ok,aliases.notna().to_numpy(),raw.notna().to_numpy()],
+                       ["unchanged","converted","incompatible","unknown unit"],"no unit")
+    result["value.unit.original"] = pd.Categorical(raw)
+    result["value.unit"] = pd.Categorical(np.where(ok,target_units,df["value.unit"].to_numpy(dtype=object)))
+    result["value.unit.factor"] = scale
+    result["value.unit.status"] = pd.Categorical(status,categories=HARMONIZE_STATUS)
+    return result
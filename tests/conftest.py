@@ -0,0 +1,82 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+
+class FakeSolrHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _params(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        body = b""
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > 0:
+            body = self.rfile.read(length)
+            if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                params.update(parse_qs(body.decode("utf-8")))
+        params = {key: value[0] if len(value) == 1 else value for key, value in params.items()}
+        return url.path, params, body
+
+    def _handle(self):
+        path, params, body = self._params()
+        self.server.requests.append((self.command, path, params))
+        self.server.clients.add(self.client_address)
+        handler = self.server.handlers.get(path)
+        if handler is None:
+            self.send_error(404)
+            return
+        status, content_type, payload, *extra = handler(self.server, params, body, self.headers)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for key, value in (extra[0] if extra else {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+def select(server, params, body, headers):
+    """/select with cursorMark deep paging over server.docs, sorted by id"""
+    docs = sorted(server.docs, key=lambda doc: doc["id"])
+    rows = int(params.get("rows", 10))
+    mark = params.get("cursorMark")
+    start = 0 if mark in (None, "*") else int(mark)
+    page = docs[start:start + rows]
+    result = {"responseHeader": {"status": 0, "params": params},
+              "response": {"numFound": len(docs), "start": 0 if mark else start, "docs": page}}
+    if mark is not None:
+        result["nextCursorMark"] = str(start + len(page)) if page else mark
+    return 200, "application/json", json.dumps(result).encode("utf-8")
+
+
+class FakeSolr(ThreadingHTTPServer):
+    """Minimal stand-in for a Solr core, listening on a random local port."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeSolrHandler)
+        self.docs = []
+        self.requests = []
+        self.clients = set()
+        self.handlers = {"/solr/core/select": select}
+        self.url = "http://127.0.0.1:{}/solr/core".format(self.server_address[1])
+
+
+@pytest.fixture
+def fake_solr():
+    server = FakeSolr()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
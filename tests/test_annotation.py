@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from pynanomapper import annotation
+
+
+def write_properties(folder, name, text, mtime=None):
+    path = folder / name
+    path.write_text(text, encoding="utf-8")
+    if mtime is not None:
+        os.utime(path, ns=(mtime, mtime))
+    return path
+
+
+def test_dictionary_cache_and_reload(tmp_path):
+    annotation.clear_cache()
+    write_properties(tmp_path, "endpointcategory.properties", "PC_MELTING_SECTION=Melting point\n", mtime=10**18)
+    a = annotation.DictionaryEndpointCategory(folder=tmp_path)
+    b = annotation.DictionaryEndpointCategory(folder=tmp_path)
+    assert a.lookup is b.lookup
+    assert a.annotate("pc melting section") == "Melting point"
+    assert a.annotate("unknown") == "unknown"
+    write_properties(tmp_path, "endpointcategory.properties", "PC_MELTING_SECTION=Melting\n", mtime=2 * 10**18)
+    c = annotation.DictionaryEndpointCategory(folder=tmp_path)
+    assert c.annotate("PC_MELTING_SECTION") == "Melting"
+
+
+def test_verbose_and_missing(tmp_path):
+    annotation.clear_cache()
+    write_properties(tmp_path, "substancetype.terse.properties", "NPO_1373=ZnO\n")
+    assert annotation.DictionarySubstancetypes(folder=tmp_path, verbose=False).annotate("NPO_1373") == "ZnO"
+    missing = annotation.DictionarySubstancetypes(folder=tmp_path, verbose=True)
+    assert missing.lookup is None
+    assert missing.annotate("NPO_1373") is None
+
+
+def test_annotate_series(tmp_path):
+    annotation.clear_cache()
+    write_properties(tmp_path, "assays.properties", "A=alpha\nB_C=beta\n")
+    a = annotation.DictionaryAssays(folder=tmp_path)
+    series = pd.Series(["a", "b c", None, "x", "a", np.nan, 5], index=list("pqrstuv"), name="m")
+    result = a.annotate_series(series)
+    assert result.equals(series.apply(a.annotate).astype(object))
+    assert result.tolist() == ["alpha", "beta", None, "x", "alpha", None, None]
+    assert a.annotate_series(series.iloc[:0]).empty
@@ -2,7 +2,13 @@
 def test_import():
     from pynanomapper import aa
     from pynanomapper import annotation
+    from pynanomapper import cache
     from pynanomapper import client_ambit
+    from pynanomapper import client_ambit_async
+    from pynanomapper import knn
+    from pynanomapper import parquet
     from pynanomapper import client_solr
+    from pynanomapper import connection
+    from pynanomapper import sync
     from pynanomapper import units
     from pyambit import datamodel 
@@ -0,0 +1,88 @@
+import json
+
+from requests.auth import HTTPBasicAuth
+
+from pynanomapper import client_ambit, client_solr, connection
+from pynanomapper.cache import ResponseCache
+
+
+def counting(calls, etag=None):
+    def handler(server, params, body, headers):
+        calls.append(headers.get("If-None-Match"))
+        if etag is not None and headers.get("If-None-Match") == etag:
+            return 304, "application/json", b"", {"ETag": etag}
+        payload = json.dumps({"response": {"docs": [{"id": str(len(calls))}]}, "substance": []})
+        return 200, "application/json", payload.encode("utf-8"), {"ETag": etag} if etag else {}
+    return handler
+
+
+def test_cache_hit(fake_solr, tmp_path):
+    calls = []
+    fake_solr.handlers["/solr/core/select"] = counting(calls)
+    session = connection.create_session(cache=ResponseCache(tmp_path))
+    r1 = client_solr.post(fake_solr.url, {"q": "*:*", "fq": "type_s:study"}, session=session)
+    r2 = client_solr.post(fake_solr.url, {"fq": "type_s:study", "q": "*:*"}, session=session)
+    assert len(calls) == 1
+    assert r2.json() == r1.json()
+    assert getattr(r2, "from_cache", False)
+    client_solr.post(fake_solr.url, {"q": "*:*"}, session=session, auth=HTTPBasicAuth("user", "pass"))
+    assert len(calls) == 2
+    client_solr.get(fake_solr.url, {"q": "*:*"}, session=session)
+    client_solr.get(fake_solr.url, {"q": "*:*"}, session=session)
+    assert len(calls) == 3
+
+
+def test_cache_persistent(fake_solr, tmp_path):
+    calls = []
+    fake_solr.handlers["/enm/substance"] = counting(calls)
+    root = fake_solr.url.replace("/solr/core", "/enm")
+    for _ in range(2):
+        session = connection.create_session(cache=ResponseCache(tmp_path))
+        r = client_ambit.AMBITSubstance(root).get(session=session)
+        assert r.status_code == 200
+    assert len(calls) == 1
+
+
+def test_cache_revalidate(fake_solr, tmp_path):
+    calls = []
+    fake_solr.handlers["/solr/core/select"] = counting(calls, etag='"v1"')
+    session = connection.create_session(cache=ResponseCache(tmp_path, ttl=0))
+    r1 = client_solr.get(fake_solr.url, {"q": "*:*"}, session=session)
+    r2 = client_solr.get(fake_solr.url, {"q": "*:*"}, session=session)
+    assert calls == [None, '"v1"']
+    assert r2.status_code == 200
+    assert r2.json() == r1.json()
+
+
+def test_cache_not_for_update(fake_solr, tmp_path):
+    calls = []
+    fake_solr.handlers["/solr/core/update"] = counting(calls)
+    session = connection.create_session(cache=ResponseCache(tmp_path))
+    for _ in range(2):
+        session.post(fake_solr.url + "/update", json=[{"id": "1"}])
+    assert len(calls) == 2
+
+
+def test_cache_eviction(fake_solr, tmp_path):
+    calls = []
+    fake_solr.handlers["/solr/core/select"] = counting(calls)
+    cache = ResponseCache(tmp_path, max_size=150)
+    session = connection.create_session(cache=cache)
+    for q in ("a", "b", "c", "a"):
+        client_solr.get(fake_solr.url, {"q": q}, session=session)
+    count, size = cache.size()
+    assert size <= 150
+    assert count < 3
+    # "a" was evicted before being asked again
+    assert len(calls) == 4
+
+
+def test_cache_key_invalid_json(fake_solr, tmp_path):
+    calls = []
+    fake_solr.handlers["/solr/core/select"] = counting(calls)
+    session = connection.create_session(cache=ResponseCache(tmp_path))
+    headers = {"Content-Type": "application/json"}
+    for body in (b"{not json", b"{not json", b"{not json either", b'{"q": "*:*"}', b'{ "q":"*:*" }'):
+        assert session.post(fake_solr.url + "/select", data=body, headers=headers).status_code == 200
+    # keyed on the raw bytes when the body does not parse
+    assert len(calls) == 3
@@ -0,0 +1,75 @@
+import json
+import time
+
+import pandas as pd
+import pytest
+
+from pynanomapper import client_ambit
+
+
+def substance_handler(n, total=False):
+    def handler(server, params, body, headers):
+        page, pagesize = int(params["page"]), int(params["pagesize"])
+        records = [{"i5uuid": "S-{:03d}".format(i), "name": "substance {}".format(i),
+                    "owner": {"name": "provider"}}
+                   for i in range(page * pagesize, min(n, (page + 1) * pagesize))]
+        result = {"substance": records}
+        if total:
+            result["total"] = n
+        return 200, "application/json", json.dumps(result).encode("utf-8")
+    return handler
+
+
+def test_iter_all_probe(fake_solr):
+    fake_solr.handlers["/enm/substance"] = substance_handler(23)
+    root = fake_solr.url.replace("/solr/core", "/enm")
+    res = client_ambit.AMBITSubstance(root)
+    records = list(res.iter_all(pagesize=5, workers=3))
+    assert [r["i5uuid"] for r in records] == ["S-{:03d}".format(i) for i in range(23)]
+
+
+def test_iter_all_total(fake_solr):
+    fake_solr.handlers["/enm/substance"] = substance_handler(20, total=True)
+    root = fake_solr.url.replace("/solr/core", "/enm")
+    res = client_ambit.AMBITSubstance(root)
+    df = res.fetch_all(pagesize=5, workers=2)
+    assert len(df) == 20
+    assert "owner.name" in df.columns
+    assert sorted(int(params["page"]) for (_, _, params) in fake_solr.requests) == [0, 1, 2, 3]
+
+
+def test_iter_all_single_page(fake_solr):
+    fake_solr.handlers["/enm/substance"] = substance_handler(3)
+    root = fake_solr.url.replace("/solr/core", "/enm")
+    records = client_ambit.AMBITSubstance(root).fetch_all(pagesize=5, frame=False)
+    assert len(records) == 3
+    assert len(fake_solr.requests) == 1
+
+
+def test_iter_all_bounded(fake_solr):
+    fake_solr.handlers["/enm/substance"] = substance_handler(40, total=True)
+    root = fake_solr.url.replace("/solr/core", "/enm")
+    records = client_ambit.AMBITSubstance(root).iter_all(pagesize=2, workers=2)
+    # into the second page, the workers are running
+    assert [next(records)["i5uuid"] for _ in range(3)] == ["S-000", "S-001", "S-002"]
+    time.sleep(0.3)
+    # the consumed pages and at most workers pages ahead, not all 20
+    assert len(fake_solr.requests) <= 2 + 2
+    assert len(list(records)) == 37
+    assert len(fake_solr.requests) == 20
+
+
+def test_iter_all_records_key(fake_solr):
+    def handler(server, params, body, headers):
+        page, pagesize = int(params["page"]), int(params["pagesize"])
+        entries = [{"compound": {"URI": "C{}".format(i)}} for i in range(page * pagesize, min(7, (page + 1) * pagesize))]
+        return 200, "application/json", json.dumps({"query": {}, "dataEntry": entries}).encode("utf-8")
+    fake_solr.handlers["/enm/compound"] = handler
+    root = fake_solr.url.replace("/solr/core", "/enm")
+    df = client_ambit.AMBITCompound(root).fetch_all(pagesize=3)
+    assert df["compound.URI"].tolist() == ["C{}".format(i) for i in range(7)]
+
+    fake_solr.handlers["/enm/nmparser"] = lambda server, params, body, headers: (
+        200, "application/json", json.dumps({"query": {}}).encode("utf-8"))
+    with pytest.raises(TypeError):
+        client_ambit.AMBITParser(root).fetch_all()
@@ -0,0 +1,89 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from pynanomapper import client_ambit_async
+
+
+def ambit_server(fake_solr, n=8, delay=0.1):
+    state = {"active": 0, "max": 0}
+    lock = threading.Lock()
+
+    def resource(key, items):
+        def handler(server, params, body, headers):
+            with lock:
+                state["active"] += 1
+                state["max"] = max(state["max"], state["active"])
+            time.sleep(delay)
+            with lock:
+                state["active"] -= 1
+            assert params["media"] == "application/json"
+            return 200, "application/json", json.dumps({key: items}).encode("utf-8")
+        return handler
+
+    root = fake_solr.url.replace("/solr/core", "/enm")
+    uris = []
+    for i in range(n):
+        path = "/enm/substance/S{}".format(i)
+        fake_solr.handlers[path + "/study"] = resource("study", [{"uuid": "STUDY-{}".format(i)}])
+        fake_solr.handlers[path + "/composition"] = resource("composition", [{"compositionUUID": "C-{}".format(i)}])
+        uris.append(root + "/substance/S{}".format(i))
+    return uris, state
+
+
+def check(result, uris):
+    assert list(result) == uris
+    for i, uri in enumerate(uris):
+        assert result[uri]["study"] == [{"uuid": "STUDY-{}".format(i)}]
+        assert result[uri]["composition"] == [{"compositionUUID": "C-{}".format(i)}]
+
+
+def test_harvest_threads(fake_solr, monkeypatch):
+    monkeypatch.setattr(client_ambit_async, "httpx", None)
+    uris, state = ambit_server(fake_solr)
+    start = time.perf_counter()
+    result = client_ambit_async.harvest(uris, limit=4)
+    elapsed = time.perf_counter() - start
+    check(result, uris)
+    assert state["max"] <= 4
+    assert elapsed < 16 * 0.1
+
+
+def test_fetch_substances_httpx(fake_solr):
+    pytest.importorskip("httpx")
+    uris, state = ambit_server(fake_solr)
+    result = asyncio.run(client_ambit_async.fetch_substances(uris, limit=5))
+    check(result, uris)
+    assert 1 < state["max"] <= 5
+
+
+def test_fetch_substances_errors(fake_solr, monkeypatch):
+    monkeypatch.setattr(client_ambit_async, "httpx", None)
+    uris, state = ambit_server(fake_solr, n=2, delay=0)
+    uris.append(uris[0] + "-missing")
+    result = client_ambit_async.harvest(uris, composition=False)
+    assert result[uris[0]]["study"] == [{"uuid": "STUDY-0"}]
+    assert isinstance(result[uris[-1]]["study"], Exception)
+
+
+def test_async_resource_uri():
+    res = client_ambit_async.AsyncAMBITCompound("http://host/enm", key="/1/conformer/2")
+    assert res.uricompose() == "http://host/enm/compound/1"
+    assert res.parse({"x": 1}) == {"x": 1}
+
+
+def test_harvest_pages(fake_solr, monkeypatch):
+    monkeypatch.setattr(client_ambit_async, "httpx", None)
+
+    def studies(server, params, body, headers):
+        page, pagesize = int(params["page"]), int(params["pagesize"])
+        items = [{"uuid": "STUDY-{}".format(i)} for i in range(page * pagesize, min(25, (page + 1) * pagesize))]
+        return 200, "application/json", json.dumps({"study": items}).encode("utf-8")
+    fake_solr.handlers["/enm/substance/S0/study"] = studies
+    uri = fake_solr.url.replace("/solr/core", "/enm") + "/substance/S0"
+    result = client_ambit_async.harvest([uri], composition=False, pagesize=10)
+    assert result[uri]["study"] == [{"uuid": "STUDY-{}".format(i)} for i in range(25)]
+    assert [params["page"] for (_, _, params) in fake_solr.requests] == ["0", "1", "2"]
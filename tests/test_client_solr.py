@@ -0,0 +1,580 @@
+import json
+import pytest
+
+import pandas as pd
+import numpy as np
+import requests
+from pynanomapper import client_solr
+
+
+def make_docs(nsubstances=20, nstudies=5):
+    docs = []
+    for s in range(nsubstances):
+        s_uuid = "SUBST-{}".format(s)
+        children = []
+        if s % 3 != 2:
+            children.append({"type_s": "composition", "id": "{}/c1".format(s_uuid),
+                             "component_s": "CORE", "CASRN_s": "1314-13-2",
+                             "formula_s": "ZnO"})
+        if s % 2 == 0:
+            children.append({"type_s": "composition", "id": "{}/c2".format(s_uuid),
+                             "component_s": "COATING", "SMILES_s": "CCO"})
+        for i in range(nstudies):
+            doc_uuid = "DOC-{}-{}".format(s, i // 2)
+            study_id = "{}/study/{}".format(s_uuid, i)
+            study = {"type_s": "study", "id": study_id,
+                     "document_uuid_s": doc_uuid,
+                     "topcategory_s": "TOX" if i % 2 else "P-CHEM",
+                     "endpointcategory_s": "ENM_0000068_SECTION",
+                     "s_uuid_s": s_uuid,
+                     "effectendpoint_synonym_ss": ["E1", "E2"]}
+            if i % 4 != 3:
+                study["effectendpoint_s"] = "IC50"
+            if i % 2 == 0:
+                study["loValue_d"] = float(i * s)
+                study["loQualifier_s"] = ">="
+            if i % 3 == 0:
+                study["unit_s"] = "ug/ml"
+            if i % 5 == 0:
+                study["upValue_d"] = 2.5
+                study["assay_uuid_s"] = "ASSAY-{}".format(s)
+            if i == 3:
+                study["upValue_d"] = 1.0
+            if i == 1:
+                study["guidance_s"] = "OECD TG 203"
+                study["reference_year_s"] = "2020"
+            children.append(study)
+            if i % 2 == 0:
+                children.append({"type_s": "conditions", "id": study_id + "/cn",
+                                 "effectid_hs": study_id,
+                                 "topcategory_s": "TOX",
+                                 "E.exposure_time_s": "{} h".format(24 * i),
+                                 "concentration_d": 0.1 * s})
+            if i % 2 == 0:
+                children.append({"type_s": "params", "id": doc_uuid + "/prm",
+                                 "document_uuid_s": doc_uuid,
+                                 "E.method_s": "method {}".format(s % 4),
+                                 "T.cell_s" if s % 5 else "E.cell_type_s": "A549"})
+        doc = {"id": s_uuid, "type_s": "substance", "dbtag_hss": ["ENM"],
+               "name_hs": "substance {}".format(s), "s_uuid_hs": s_uuid,
+               "_childDocuments_": children}
+        if s % 4:
+            doc["publicname_hs"] = "public {}".format(s)
+            doc["substanceType_hs"] = "NPO_1486"
+        docs.append(doc)
+    docs.append({"id": "EMPTY", "type_s": "substance", "dbtag_hss": ["ENM"],
+                 "name_hs": "no studies", "s_uuid_hs": "EMPTY"})
+    return docs
+
+
+def test_parse_columnar_matches_rows2frame():
+    sd = client_solr.StudyDocuments()
+    docs = make_docs()
+    expected = sd.rows2frame(sd.parse(docs, process=None))
+    df = sd.parse_columnar(docs, process=None)
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_parse_columnar_empty():
+    sd = client_solr.StudyDocuments()
+    assert sd.parse_columnar([], process=None).empty
+
+
+def test_cursor_pages(fake_solr):
+    fake_solr.docs = [{"id": "doc{:03d}".format(i), "type_s": "substance"} for i in range(25)]
+    query = client_solr.Materials().getQuery()
+    pages = list(client_solr.cursor_pages(fake_solr.url, query, rows=10))
+    ids = [doc["id"] for page in pages for doc in page["response"]["docs"]]
+    assert ids == sorted(doc["id"] for doc in fake_solr.docs)
+    marks = [params["cursorMark"] for (_, _, params) in fake_solr.requests]
+    assert marks == ["*", "10", "20", "25"]
+    assert all(params["sort"] == "id asc" for (_, _, params) in fake_solr.requests)
+
+
+def test_materials_iter_query(fake_solr):
+    fake_solr.docs = [{"id": "doc{:03d}".format(i), "name_hs": str(i)} for i in range(7)]
+    mat = client_solr.Materials()
+    chunks = list(mat.iter_query(fake_solr.url, mat.getQuery(), rows=3, prefetch=False))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    assert pd.concat(chunks)["name_hs"].tolist() == [str(i) for i in range(7)]
+
+
+def test_studydocuments_iter_query(fake_solr):
+    fake_solr.docs = make_docs()
+    sd = client_solr.StudyDocuments()
+    expected = sd.parse_columnar(sorted(fake_solr.docs, key=lambda doc: doc["id"]), process=None)
+    chunks = list(sd.iter_query(fake_solr.url, sd.getQuery(), rows=6))
+    assert len(chunks) == 4
+    df = pd.concat(chunks, ignore_index=True)
+    assert df["uuid.document"].astype(str).tolist() == expected["uuid.document"].astype(str).tolist()
+    rows = [row for chunk in sd.iter_query(fake_solr.url, sd.getQuery(), rows=6, frame=False) for row in chunk]
+    assert len(rows) == len(expected)
+
+
+def test_iter_json_docs_small_chunks():
+    docs = [{"id": "a", "unit_s": "µg/ml", "loValue_d": 12345.5},
+            {"id": "b", "nested": {"docs": [1, 2]}, "n": 10}]
+    body = json.dumps({"responseHeader": {"status": 0, "params": {"fl": "docs"}},
+                       "response": {"numFound": 2, "start": 0, "docs": docs},
+                       "nextCursorMark": "AoE"}, indent=1).encode("utf-8")
+    for size in (1, 3, 1024):
+        header = {}
+        chunks = (body[i:i + size] for i in range(0, len(body), size))
+        assert list(client_solr.iter_json_docs(chunks, header)) == docs
+        assert header["response"] == {"numFound": 2, "start": 0}
+        assert header["nextCursorMark"] == "AoE"
+
+
+def test_iter_json_docs_empty():
+    body = b'{"response":{"numFound":0,"docs":[]}}'
+    assert list(client_solr.iter_json_docs([body])) == []
+
+
+def test_studydocuments_stream_query(fake_solr):
+    fake_solr.docs = make_docs()
+    sd = client_solr.StudyDocuments()
+    expected = sd.parse_columnar(sorted(fake_solr.docs, key=lambda doc: doc["id"]), process=None)
+    chunks = list(sd.stream_query(fake_solr.url, sd.getQuery(rows=100), batch=5, chunk_size=512))
+    assert len(chunks) == 5
+    df = pd.concat(chunks, ignore_index=True)
+    assert df["uuid.document"].astype(str).tolist() == expected["uuid.document"].astype(str).tolist()
+    rows = [row for chunk in sd.stream_query(fake_solr.url, sd.getQuery(rows=100), frame=False) for row in chunk]
+    assert len(rows) == len(expected)
+
+
+def index_frame(n=25):
+    df = pd.DataFrame(np.arange(n * 4, dtype=float).reshape(n, 4), columns=["v0", "v1", "v2", "v3"])
+    df["uuid"] = ["S-{}".format(i) for i in range(n)]
+    df["name"] = ["name {}".format(i) for i in range(n)]
+    df["dbtag"] = "TEST"
+    return df
+
+
+def update_handler(server, params, body, headers):
+    if body:
+        if server.fail_chunks and b'"S-0"' in body:
+            return 400, "application/json", b'{"error":"bad chunk"}'
+        text = body.decode("utf-8")
+        docs = [json.loads(line) for line in text.split("\n")] if not text.startswith(("[", "{\"delete")) else json.loads(text)
+        if isinstance(docs, list):
+            server.indexed.extend(docs)
+    return 200, "application/json", b'{"responseHeader":{"status":0}}'
+
+
+def test_index_errors(fake_solr):
+    fake_solr.handlers["/solr/core/update"] = lambda server, params, body, headers: (
+        400, "application/json", b'{"error":"bad request"}')
+    docs = list(client_solr.IndexSolr.df2docs(index_frame(3), vector_fields={"dense_4": (0, 4)}))
+    for submit in (lambda: client_solr.IndexSolr.delete_all(fake_solr.url),
+                   lambda: client_solr.IndexSolr.submit_json(docs, fake_solr.url, delete=False),
+                   lambda: client_solr.IndexSolr.submit_chunks(docs, fake_solr.url)):
+        with pytest.raises(requests.HTTPError) as err:
+            submit()
+        assert err.value.response.status_code == 400
+        assert err.value.response.json() == {"error": "bad request"}
+
+
+def test_df2docs_matches_df2solr():
+    df = index_frame(5)
+    vector_fields = {"dense_4": (0, 4)}
+    expected = [client_solr.IndexSolr.df2solr(row, vector_fields=vector_fields) for _, row in df.iterrows()]
+    assert list(client_solr.IndexSolr.df2docs(df, vector_fields=vector_fields)) == expected
+    assert expected[1]["dense_4"] == [4.0, 5.0, 6.0, 7.0]
+    assert expected[1]["publicname_hs"] == ""
+    # older list form is still accepted
+    assert client_solr.IndexSolr.df2solr(df.iloc[1], vector_fields=[{"dense_4": (0, 4)}]) == expected[1]
+
+
+@pytest.mark.parametrize("jsonl", [False, True])
+def test_submit_chunks(fake_solr, jsonl):
+    fake_solr.indexed = []
+    fake_solr.fail_chunks = False
+    fake_solr.handlers["/solr/core/update"] = update_handler
+    fake_solr.handlers["/solr/core/update/json/docs"] = update_handler
+    report = client_solr.IndexSolr.submit_dataframe(index_frame(), fake_solr.url, vector_fields={"dense_4": (0, 4)},
+                                        delete=False, chunk_size=10, workers=2, jsonl=jsonl)
+    assert report["docs"].tolist() == [10, 10, 5]
+    assert report["error"].isna().all()
+    assert report.attrs["failed_chunks"] == 0
+    assert report.attrs["failed_docs"] == 0
+    assert sorted(doc["id"] for doc in fake_solr.indexed) == sorted("S-{}".format(i) for i in range(25))
+    updates = [r for r in fake_solr.requests if r[1].startswith("/solr/core/update")]
+    # no per-chunk commits, a single commit at the end
+    assert [r for r in updates if "commit" in r[2]] == [updates[-1]]
+
+
+def test_submit_chunks_commit_within_and_failures(fake_solr):
+    fake_solr.indexed = []
+    fake_solr.fail_chunks = True
+    fake_solr.handlers["/solr/core/update"] = update_handler
+    docs = client_solr.IndexSolr.df2docs(index_frame(), vector_fields={"dense_4": (0, 4)})
+    report = client_solr.IndexSolr.submit_chunks(docs, fake_solr.url, chunk_size=10, workers=2, commit_within=5000)
+    assert report.attrs["failed_chunks"] == 1
+    assert report.attrs["failed_docs"] == 10
+    assert report.loc[0, "status"] == 400
+    assert len(fake_solr.indexed) == 15
+    assert all(r[2].get("commitWithin") == "5000" for r in fake_solr.requests)
+
+
+def test_knn_query_precision():
+    vector = np.array([0.123456789, 1e-7, 2.0])
+    assert client_solr.knn_query("dense_3", 5, vector, precision=4) == "{!knn f=dense_3 topK=5}[0.1235,1e-07,2]"
+    assert client_solr.knn_query("dense_3", 5, [1, 2]) == "{!knn f=dense_3 topK=5}[1,2]"
+
+
+def test_knn_search(fake_solr):
+    def knn(server, params, body, headers):
+        vector = [float(v) for v in params["q"].split("[")[1].rstrip("]").split(",")]
+        docs = [{"id": "hit-{}-{}".format(int(vector[0]), i), "score": 1.0 / (i + 1)} for i in range(int(params["rows"]))]
+        return 200, "application/json", json.dumps({"response": {"docs": docs}}).encode("utf-8")
+    fake_solr.handlers["/solr/core/select"] = knn
+    vectors = np.arange(12, dtype=float).reshape(4, 3)
+    hits = client_solr.knn_search(fake_solr.url, vectors, solr_field="dense_3", topk=2, query_ids=list("abcd"), workers=3)
+    assert hits.columns.tolist() == ["query_id", "rank", "hit_id", "score"]
+    assert hits["query_id"].tolist() == ["a", "a", "b", "b", "c", "c", "d", "d"]
+    assert hits["hit_id"].tolist()[2:4] == ["hit-3-0", "hit-3-1"]
+    assert hits["score"].tolist()[:2] == [1.0, 0.5]
+    assert hits.attrs["failed_queries"] == []
+
+
+def test_knn_search_failures(fake_solr):
+    def knn(server, params, body, headers):
+        vector = [float(v) for v in params["q"].split("[")[1].rstrip("]").split(",")]
+        if vector[0] == 3:
+            return 400, "application/json", b'{"error":"bad vector"}'
+        docs = [{"id": "hit", "score": 1.0}] if vector[0] == 0 else []
+        return 200, "application/json", json.dumps({"response": {"docs": docs}}).encode("utf-8")
+    fake_solr.handlers["/solr/core/select"] = knn
+    vectors = np.arange(9, dtype=float).reshape(3, 3)
+    hits = client_solr.knn_search(fake_solr.url, vectors, solr_field="dense_3", query_ids=list("abc"))
+    # b failed, c has no neighbours
+    assert hits["query_id"].tolist() == ["a"]
+    assert hits.attrs["failed_queries"] == ["b"]
+
+
+def make_facets(fields, fanout=3, seed=0):
+    rng = np.random.default_rng(seed)
+
+    def level(n, prefix):
+        key = "field{}".format(n)
+        buckets = []
+        for i in range(fanout if n > 1 else fanout + 1):
+            bucket = {"val": "{}{}".format(prefix, i), "count": int(rng.integers(1, 100))}
+            if n > 1:
+                bucket.update(level(n - 1, bucket["val"] + "."))
+            buckets.append(bucket)
+        result = {"buckets": buckets}
+        if n > 1 and rng.random() < 0.5:
+            result["missing"] = {"count": 7}
+            result["missing"].update(level(n - 1, "m."))
+        return {key: result}
+
+    facets = {"count": 1000}
+    facets.update(level(len(fields), ""))
+    return facets
+
+
+def test_flatten_matches_parse():
+    fields = ["topcategory_s", "endpointcategory_s", "E.method_s", "unit_s"]
+    facets = make_facets(fields)
+    stats = []
+
+    def process(prefix, val, count, key, _tuple):
+        if len(_tuple) == len(fields):
+            stats.append((*_tuple, val, count))
+
+    client_solr.Facets().parse(facets, prefix=">", process=process)
+    expected = pd.DataFrame(stats, columns=["Z"] + fields + ["n"]).drop("Z", axis=1)
+    table = client_solr.Facets().flatten(facets, fields=fields, statistics="n")
+    assert isinstance(table.index, pd.MultiIndex)
+    pd.testing.assert_frame_equal(table.reset_index(), expected)
+    # levels inferred from the response
+    inferred = client_solr.Facets().flatten(facets)
+    assert inferred.index.names == ["level1", "level2", "level3", "level4"]
+    assert inferred["count"].tolist() == expected["n"].tolist()
+
+
+def test_flatten_totals():
+    facets = {"count": 10, "field2": {"buckets": [
+        {"val": "A", "count": 6, "field1": {"buckets": [{"val": "x", "count": 4}, {"val": "y", "count": 2}]}},
+        {"val": "B", "count": 4, "field1": {"buckets": [], "missing": {"count": 4}}}]}}
+    table = client_solr.Facets().flatten(facets, fields=["f", "g"], totals=True)
+    assert table.index.tolist() == [("_total", "_total"), ("A", "_total"), ("A", "x"), ("A", "y"),
+                                    ("B", "_total"), ("B", "_")]
+    assert table["count"].tolist() == [10, 6, 4, 2, 4, 4]
+    assert client_solr.Facets().flatten(facets, fields=["f", "g"]).loc["A"]["count"].sum() == 6
+
+
+def test_summary(fake_solr, tmp_path):
+    fields = ["topcategory_s", "endpointcategory_s"]
+    facets = make_facets(fields)
+    fake_solr.handlers["/solr/core/select"] = lambda server, params, body, headers: (
+        200, "application/json", json.dumps({"facets": facets}).encode("utf-8"))
+    (tmp_path / "endpointcategory.properties").write_text("0.1=first\n")
+    f = client_solr.Facets()
+    f.set_annotation_folder(tmp_path)
+    df = f.summary(fake_solr.url, None, fields=fields)
+    assert df.columns.tolist()[:3] == fields + ["Number of data points"]
+    assert len(df) == len(client_solr.Facets().flatten(facets, fields=fields))
+    assert df.loc[df["endpointcategory_s"] == "0.1", "endpointcategory_term"].tolist() == ["first"]
+
+
+def test_annotate_summary_method(tmp_path):
+    (tmp_path / "assays.properties").write_text("COMET_ASSAY=Comet assay\n")
+    f = client_solr.Facets()
+    f.set_annotation_folder(tmp_path)
+    df = pd.DataFrame({"E.method_s": ["comet assay", "MTT", None], "n": [1, 2, 3]})
+    f.annotate_summary(df)
+    assert df["method_term"].tolist() == ["Comet assay", "MTT", None]
+
+
+def facet_docs(n=300, seed=3):
+    rng = np.random.default_rng(seed)
+    docs = []
+    for i in range(n):
+        doc = {"a": "A{}".format(rng.integers(0, 7)), "b": "B{}".format(rng.integers(0, 5))}
+        if rng.random() < 0.8:
+            doc["c"] = "C{}".format(rng.integers(0, 4))
+        docs.append(doc)
+    return docs
+
+
+def terms_facet(server, params, body, headers):
+    """json.facet with a single paged terms facet over server.facet_docs, filtered by fq"""
+    fq = params.get("fq", [])
+    fq = [fq] if isinstance(fq, str) else fq
+    docs = server.facet_docs
+    for f in fq:
+        if f.startswith("{!term f="):
+            field, val = f[len("{!term f="):].split("}", 1)
+            docs = [d for d in docs if d.get(field) == val]
+        elif f.startswith("-"):
+            field = f[1:].split(":")[0]
+            docs = [d for d in docs if field not in d]
+    ((key, facet),) = json.loads(params["json.facet"]).items()
+    counts = {}
+    for d in docs:
+        if facet["field"] in d:
+            counts[d[facet["field"]]] = counts.get(d[facet["field"]], 0) + 1
+    ordered = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))
+    page = ordered[facet["offset"]:facet["offset"] + facet["limit"]]
+    result = {key: {"buckets": [{"val": v, "count": c} for v, c in page],
+                    "missing": {"count": sum(1 for d in docs if facet["field"] not in d)}}}
+    return 200, "application/json", json.dumps({"facets": result}).encode("utf-8")
+
+
+def test_summary_paged(fake_solr, tmp_path):
+    fake_solr.facet_docs = facet_docs()
+    fake_solr.handlers["/solr/core/select"] = terms_facet
+    fields = ["a", "b", "c"]
+    f = client_solr.Facets()
+    f.set_annotation_folder(tmp_path)
+    df = f.summary_paged(fake_solr.url, None, fq=None, fields=fields, page_size=2, workers=3)
+    expected = pd.DataFrame(fake_solr.facet_docs).fillna("_").groupby(fields).size()
+    assert df["Number of data points"].sum() == len(fake_solr.facet_docs)
+    got = df.set_index(fields)["Number of data points"].sort_index()
+    assert got.to_dict() == expected.sort_index().to_dict()
+    # top level buckets in count order, as Solr sorts them
+    top = df.drop_duplicates("a")["a"].tolist()
+    sizes = pd.DataFrame(fake_solr.facet_docs)["a"].value_counts()
+    assert top == sorted(sizes.index, key=lambda v: (-sizes[v], v))
+    assert df.attrs["truncated"] is False
+
+
+def test_summary_paged_budget(fake_solr):
+    fake_solr.facet_docs = facet_docs()
+    fake_solr.handlers["/solr/core/select"] = terms_facet
+    df = client_solr.Facets().summary_paged(fake_solr.url, None, fq=None, fields=["a", "b", "c"], page_size=2, max_buckets=20)
+    assert df.attrs["truncated"] is True
+    assert len(df) < 20
+
+
+def test_iter_drilldown_budget_workers(fake_solr):
+    fake_solr.facet_docs = facet_docs()
+    fake_solr.handlers["/solr/core/select"] = terms_facet
+    for max_buckets in (10, 20, 35):
+        budget = {}
+        list(client_solr.Facets().iter_drilldown(fake_solr.url, None, fq=None, fields=["a", "b", "c"], page_size=1,
+                                                 workers=8, max_buckets=max_buckets, budget=budget))
+        # the concurrent pages never count past the budget
+        assert budget["buckets"] == max_buckets
+        assert budget["truncated"] is True
+
+
+def test_iter_drilldown_budget_partial_page(fake_solr):
+    fake_solr.facet_docs = facet_docs()
+    fake_solr.handlers["/solr/core/select"] = terms_facet
+    budget = {}
+    chunks = list(client_solr.Facets().iter_drilldown(fake_solr.url, None, fq=None, fields=["a"], page_size=5,
+                                                      max_buckets=6, budget=budget))
+    # the second page of 2 buckets is cut at 1, and it is yielded
+    assert [len(chunk) for chunk in chunks] == [5, 1]
+    assert budget["buckets"] == 6 and budget["truncated"] is True
+
+    full = client_solr.Facets().summary_paged(fake_solr.url, None, fq=None, fields=["a", "b"], page_size=10, workers=1)
+    # 7 top level buckets and the first 9 leaves
+    df = client_solr.Facets().summary_paged(fake_solr.url, None, fq=None, fields=["a", "b"], page_size=10, workers=1,
+                                            max_buckets=16)
+    assert df.attrs["truncated"] is True
+    pd.testing.assert_frame_equal(df, full.iloc[:9], check_dtype=False)
+
+
+def study_table(n=400, seed=5):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "p.oht.module": rng.choice(["P-CHEM", "TOX", "ECOTOX"], n),
+        "p.oht.section": rng.choice(["S1", "S2", "S3", "S4"], n),
+        "x.params.E.method": rng.choice(["M1", "M2", None], n),
+        "m.substance.type": rng.choice(["NPO_1373", "NPO_1892"], n),
+        "p.study_provider": rng.choice(["lab1", "lab2", ""], n)})
+    return client_solr.StudyDocuments.categorize(df)
+
+
+def test_filter_mask():
+    df = study_table()
+    mask = client_solr.Facets.filter_mask(df, ["type_s:study", 'topcategory_s:"TOX" AND -endpointcategory_s:(S1 OR S2)'])
+    expected = (df["p.oht.module"] == "TOX") & ~df["p.oht.section"].isin(["S1", "S2"])
+    assert mask.tolist() == expected.tolist()
+    assert client_solr.Facets.filter_mask(df, "E.method_s:[* TO *]").sum() == df["x.params.E.method"].notna().sum()
+    with pytest.raises(ValueError):
+        client_solr.Facets.filter_mask(df, "a:b OR c:d")
+
+
+def test_summary_local_matches_solr(fake_solr, tmp_path):
+    fields = ["topcategory_s", "endpointcategory_s", "E.method_s", "reference_owner_s"]
+    df = study_table()
+    columns = [client_solr.Facets.local_column(f, df.columns) for f in fields]
+    fake_solr.facet_docs = [{f: v for f, v in zip(fields, row) if pd.notna(v) and v != ""}
+                            for row in df[columns].astype(object).itertuples(index=False)]
+    fake_solr.handlers["/solr/core/select"] = terms_facet
+    f = client_solr.Facets()
+    f.set_annotation_folder(tmp_path)
+    expected = f.summary_paged(fake_solr.url, None, fq=None, fields=fields, page_size=3)
+    local = f.summary_local(df, fields=fields)
+    pd.testing.assert_frame_equal(local, expected, check_dtype=False)
+    filtered = f.summary_local(df, fq="topcategory_s:TOX", fields=fields)
+    assert set(filtered["topcategory_s"]) == {"TOX"}
+    totals = f.summary_local(df, fields=fields[:2], totals=True)
+    assert totals.iloc[0].tolist()[:3] == ["_total", "_total", len(df)]
+    assert totals.iloc[1]["endpointcategory_s"] == "_total"
+    assert totals[totals["endpointcategory_s"] != "_total"]["Number of data points"].sum() == len(df)
+
+
+def test_parse_long_roundtrip():
+    docs = make_docs()
+    wide = client_solr.StudyDocuments().parse_columnar(docs)
+    tables = client_solr.StudyDocuments().parse_long(docs)
+    assert tables["studies"]["id.study"].nunique() == len(wide)
+    assert not any(col.startswith(("x.", "c1.")) for col in tables["studies"].columns)
+    assert tables["params"].columns.tolist() == ["uuid.document", "name", "value"]
+    assert set(tables["conditions"]["name"]) == {"effectid_hs", "E.exposure_time", "concentration_d"}
+    restored = client_solr.StudyDocuments.long2wide(tables)
+    assert sorted(restored.columns) == sorted(wide.columns)
+    restored = restored[wide.columns]
+    for col in wide.columns:
+        expected = wide[col].astype(object).where(wide[col].notna(), None).tolist()
+        got = restored[col].astype(object).where(restored[col].notna(), None).tolist()
+        assert got == expected, col
+        assert (wide[col].dtype == "category") == (restored[col].dtype == "category"), col
+
+
+def test_parse_parallel():
+    docs = make_docs(nsubstances=30)
+    parser = client_solr.StudyDocuments()
+    expected = parser.parse_columnar(docs, process=None)
+    seen = []
+    result = parser.parse_parallel(docs, workers=2, chunksize=4, process=lambda record, doc: seen.append(record))
+    assert seen == list(range(1, len(docs) + 1))
+    pd.testing.assert_frame_equal(result, expected)
+    rows = parser.parse_parallel(docs, workers=2, chunksize=7, frame=False, process=None)
+    pd.testing.assert_frame_equal(parser.rows2frame(rows), parser.rows2frame(parser.parse(docs, process=None)))
+
+
+EXPORT_SCHEMA = {
+    "fields": [{"name": "id", "type": "string", "docValues": True},
+               {"name": "type_s", "type": "string", "docValues": True},
+               {"name": "content", "type": "text_general", "docValues": False}],
+    "dynamicFields": [{"name": "*_s", "type": "string", "docValues": True},
+                      {"name": "*_hs", "type": "string", "docValues": True},
+                      {"name": "*_d", "type": "pdouble", "docValues": True},
+                      {"name": "*_ss", "type": "strings", "docValues": True, "multiValued": True},
+                      {"name": "*_t", "type": "text_general", "docValues": False}]}
+
+
+def export_server(fake_solr, nsubstances=30, nstudies=7):
+    docs = []
+    for s in range(nsubstances):
+        docs.append({"id": "S{:03d}".format(s), "type_s": "substance", "s_uuid_hs": "U{}".format(s),
+                     "name_hs": "name {}".format(s)})
+        for i in range(nstudies):
+            study = {"id": "S{:03d}/{}".format(s, i), "type_s": "study", "s_uuid_s": "U{}".format(s),
+                     "effectendpoint_s": "IC50", "unit_s": "ug/ml"}
+            if i % 3:
+                study["loValue_d"] = float(s * i)
+            docs.append(study)
+    docs.append({"id": "X", "type_s": "study", "s_uuid_s": "UNKNOWN", "loValue_d": 1.0})
+    fake_solr.docs = docs
+
+    def schema(key):
+        return lambda server, params, body, headers: (
+            200, "application/json", json.dumps({key: EXPORT_SCHEMA[key]}).encode("utf-8"))
+
+    def export(server, params, body, headers):
+        assert "sort" in params
+        kind = params["q"].split(":")[1]
+        fl = params["fl"].split(",")
+        rows = [{f: d[f] for f in fl if f in d} for d in sorted(server.docs, key=lambda d: d["id"]) if d["type_s"] == kind]
+        return 200, "application/json", json.dumps(
+            {"responseHeader": {"status": 0}, "response": {"numFound": len(rows), "docs": rows}}).encode("utf-8")
+
+    fake_solr.handlers["/solr/core/schema/fields"] = schema("fields")
+    fake_solr.handlers["/solr/core/schema/dynamicfields"] = schema("dynamicFields")
+    fake_solr.handlers["/solr/core/export"] = export
+    return docs
+
+
+def test_export_qualifies(fake_solr):
+    export_server(fake_solr)
+    export = client_solr.Export(fake_solr.url)
+    assert export.qualifies(["s_uuid_s", "loValue_d", "synonym_ss"])
+    assert not export.qualifies(["s_uuid_s", "content"])
+    assert not export.qualifies(["s_uuid_s", "description_t"])
+    assert not export.qualifies(["score"])
+    assert not export.qualifies(["s_uuid_s"], sort="unknown asc")
+    assert export.dtype("loValue_d") == "float64"
+    assert export.dtype("synonym_ss") == "object"
+
+
+def test_export_studies(fake_solr):
+    docs = export_server(fake_solr)
+    export = client_solr.Export(fake_solr.url)
+    chunks = list(export.frames(["id", "s_uuid_s", "loValue_d"], query="type_s:study", chunk_rows=50))
+    assert [len(c) for c in chunks] == [50, 50, 50, 50, 11]
+    assert chunks[0]["loValue_d"].dtype == "float64"
+    assert any(r[1] == "/solr/core/export" for r in fake_solr.requests)
+    df = export.studies(fields=["s_uuid_s", "effectendpoint_s", "loValue_d"], substance_fields=["s_uuid_hs", "name_hs"], chunk_rows=64)
+    assert len(df) == sum(1 for d in docs if d["type_s"] == "study")
+    assert df.columns.tolist() == ["s_uuid_s", "effectendpoint_s", "loValue_d", "name_hs"]
+    assert df.loc[df["s_uuid_s"] == "U3", "name_hs"].unique().tolist() == ["name 3"]
+    assert pd.isna(df.loc[df["s_uuid_s"] == "UNKNOWN", "name_hs"]).all()
+
+
+def test_export_falls_back_to_select(fake_solr):
+    export_server(fake_solr)
+    export = client_solr.Export(fake_solr.url)
+    df = export.frame(["id", "content"], query="*:*", chunk_rows=40)
+    assert len(df) == len(fake_solr.docs)
+    assert not any(r[1] == "/solr/core/export" for r in fake_solr.requests)
+
+
+def test_export_select_sort(fake_solr):
+    export_server(fake_solr)
+    export = client_solr.Export(fake_solr.url)
+    # s_uuid_s contains "id", but is not the uniqueKey
+    df = export.frame(["id", "s_uuid_s"], query="*:*", sort="s_uuid_s asc", export=False)
+    assert len(df) == len(fake_solr.docs)
+    sorts = {r[2]["sort"] for r in fake_solr.requests if r[1] == "/solr/core/select"}
+    assert sorts == {"s_uuid_s asc,id asc"}
+    fake_solr.requests.clear()
+    export.frame(["id"], query="*:*", sort="id desc", export=False)
+    assert {r[2]["sort"] for r in fake_solr.requests if r[1] == "/solr/core/select"} == {"id desc"}
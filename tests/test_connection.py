@@ -0,0 +1,76 @@
+import time
+
+import pytest
+import requests
+
+from pynanomapper import client_solr, connection
+
+
+def test_keep_alive(fake_solr):
+    session = connection.create_session()
+    for _ in range(5):
+        r = client_solr.get(fake_solr.url, {"q": "*:*"}, session=session)
+        assert r.status_code == 200
+    assert len(fake_solr.requests) == 5
+    assert len(fake_solr.clients) == 1
+
+
+def test_retry_on_503(fake_solr):
+    calls = []
+
+    def flaky(server, params, body, headers):
+        calls.append(params)
+        if len(calls) < 3:
+            return 503, "text/plain", b"busy"
+        return 200, "application/json", b'{"response": {"docs": []}}'
+
+    fake_solr.handlers["/solr/core/select"] = flaky
+    session = connection.create_session(retries=3, backoff_factor=0)
+    r = client_solr.post(fake_solr.url, {"q": "*:*"}, session=session)
+    assert r.status_code == 200
+    assert len(calls) == 3
+
+    calls.clear()
+    r = client_solr.post(fake_solr.url, {"q": "*:*"}, session=connection.create_session(retries=1, backoff_factor=0))
+    assert r.status_code == 503
+
+
+def test_no_retry_on_update(fake_solr):
+    calls = []
+
+    def failing(server, params, body, headers):
+        calls.append(body)
+        return 503, "text/plain", b"busy"
+
+    fake_solr.handlers["/solr/core/update"] = failing
+    session = connection.create_session(retries=3, backoff_factor=0)
+    r = session.post(fake_solr.url + "/update", data=b"[]", headers={"Content-Type": "application/json"})
+    assert r.status_code == 503
+    assert len(calls) == 1
+
+    # the same failure on a GET is retried
+    r = session.get(fake_solr.url + "/update")
+    assert len(calls) == 1 + 4
+
+
+def test_default_timeout(fake_solr):
+    def slow(server, params, body, headers):
+        time.sleep(1)
+        return 200, "application/json", b"{}"
+
+    fake_solr.handlers["/solr/core/select"] = slow
+    session = connection.create_session(retries=0, timeout=0.2)
+    with pytest.raises(requests.exceptions.ConnectionError, match="timed out"):
+        client_solr.get(fake_solr.url, {"q": "*:*"}, session=session)
+
+
+def test_shared_session():
+    session = connection.create_session()
+    previous = connection.get_session()
+    try:
+        connection.set_session(session)
+        assert connection.get_session() is session
+        other = requests.Session()
+        assert connection.get_session(other) is other
+    finally:
+        connection.set_session(previous)
@@ -0,0 +1,112 @@
+import pandas as pd
+
+from pynanomapper.clients.h5converter import AmbitParser
+
+
+def make_effects(n=6):
+    effects = []
+    for i in range(n):
+        effects.append({
+            "endpoint": "CELL_VIABILITY" if i % 2 else "IC50", "endpointtype": "MEAN",
+            "result": {"unit": "%", "loQualifier": "=", "loValue": 10.0 * i, "upQualifier": "",
+                       "errQualifier": "sd", "err": 0.5} if i != 3 else {"textValue": "negative", "unit": ""},
+            "conditions": {"concentration": {"loValue": 0.1 * i, "unit": "ug/ml"},
+                           "E.exposure_time": {"loValue": 24, "unit": "h"},
+                           "Material": "TiO2" if i % 3 else None,
+                           "Technical replicate": {"loValue": "Technical replicate {}".format(i)},
+                           "Biological replicate": ""}})
+    # no value, dropped
+    effects.append({"endpoint": "IC50", "endpointtype": "MEAN", "result": {"unit": "%"}, "conditions": {}})
+    return effects
+
+
+def test_split_column():
+    values = pd.Series([{"loValue": 1, "unit": "h", "err": ""}, "text", None, "", {"unit": "%"}])
+    cols = AmbitParser._cols
+    expected = pd.DataFrame([AmbitParser.split_results(value, cols=cols) for value in values])
+    pd.testing.assert_frame_equal(AmbitParser.split_column(values, cols), expected)
+
+
+def test_effects2df():
+    df = AmbitParser.effects2df(make_effects())
+    assert list(df.columns) == [
+        "endpoint", "endpointtype", "unit", "loQualifier", "loValue", "errQualifier", "err", "textValue",
+        "c_concentration", "c_E.exposure_time", "c_Material", "c_Technical replicate",
+        "c_concentration_unit", "c_E.exposure_time_unit"]
+    assert len(df) == 6
+    assert df["loValue"].tolist()[:3] == [0.0, 10.0, 20.0]
+    assert df["textValue"].iloc[3] == "negative"
+    assert pd.isna(df["unit"].iloc[3])
+    assert df["c_Technical replicate"].tolist() == [" {}".format(i) for i in range(6)]
+    assert df["c_Material"].isna().tolist() == [True, False, False, True, False, False]
+    assert df["c_concentration_unit"].unique().tolist() == ["ug/ml"]
+
+
+def make_substances(n=3):
+    for s in range(n):
+        yield {"i5uuid": "SUBST-{}".format(s), "ownerName": "owner", "substanceType": "NPO_1486",
+               "name": "substance {}".format(s), "publicname": "public {}".format(s),
+               "study": [{"uuid": "STUDY-{}".format(s), "investigation_uuid": "INV", "assay_uuid": "ASSAY",
+                          "owner": {"substance": {"uuid": "SUBST-{}".format(s)}, "company": {"uuid": "C", "name": "company"}},
+                          "citation": {"title": "title", "year": "2020", "owner": "owner"},
+                          "protocol": {"topcategory": "TOX", "endpoint": "viability", "guideline": ["MTT"],
+                                       "category": {"code": "ENM_0000068_SECTION", "title": "title", "term": "term"}},
+                          "parameters": {"E.cell_type": "A549"},
+                          "effects": make_effects()}]}
+
+
+def test_ambit2hdf5(tmp_path):
+    import h5py
+    with h5py.File(tmp_path / "ambit.h5", "w") as h5file:
+        AmbitParser.ambit2hdf5(make_substances(), h5file, compression="lzf")
+    with h5py.File(tmp_path / "ambit.h5", "r") as h5file:
+        assert sorted(h5file["substance"]) == ["SUBST-0", "SUBST-1", "SUBST-2"]
+        assert h5file["substance/SUBST-1"].attrs["publicname"] == "public 1"
+        assert h5file["study/STUDY-1/parameters"].attrs["E.cell_type"] == "A549"
+        results = h5file["study/STUDY-0/results/MEAN"]
+        assert sorted(results) == ["CELL_VIABILITY(None)", "IC50(None)"]
+        dataset = results["IC50(None)"]
+        assert dataset.compression == "lzf"
+        assert dataset["endpoint"].tolist() == [0.0, 20.0, 40.0]
+        assert dataset["concentration"].tolist() == [0.0, 0.2, 0.4]
+        assert dataset["time"].tolist() == [24, 24, 24]
+        # the text result and the valueless effect have no row
+        dataset = results["CELL_VIABILITY(None)"]
+        assert len(dataset) == 2
+        assert dataset.attrs["concentration.unit"] == "ug/ml"
+
+
+def test_hdf52ambit(tmp_path):
+    import h5py
+    substances = list(make_substances(2))
+    with h5py.File(tmp_path / "ambit.h5", "w") as h5file:
+        AmbitParser.ambit2hdf5({"substance": substances}, h5file)
+    with h5py.File(tmp_path / "ambit.h5", "r") as h5file:
+        lazy = AmbitParser.iter_hdf52ambit(h5file)
+        substance = next(lazy)
+        assert substance["i5uuid"] == "SUBST-0" and substance["publicname"] == "public 0"
+        study = substance["study"][0]
+        assert study["owner"] == {"substance": {"uuid": "SUBST-0"}, "company": {"uuid": "C", "name": "company"}}
+        assert study["protocol"]["category"]["code"] == "ENM_0000068_SECTION"
+        assert study["parameters"] == [{"E.cell_type": "A549"}]
+        assert sorted(effect["endpoint"] for effect in study["effects"]) == ["CELL_VIABILITY", "IC50"]
+        assert [s["i5uuid"] for s in lazy] == ["SUBST-1"]
+        assert AmbitParser.hdf52ambit(h5file)["substance"][0] == substance
+
+
+def test_make_dataset():
+    df = AmbitParser.effects2df(make_effects(6))
+    df = df.drop(columns=["c_Technical replicate", "textValue"])
+    # a replicate value of the first effect
+    df = pd.concat([df, df.iloc[[0]].assign(loValue=3.0)])
+    for max_memory in (2**30, 1):
+        dataset = AmbitParser.make_dataset(df, max_memory=max_memory)
+        assert list(dataset.columns) == [
+            "c_E.exposure_time___", "c_E.exposure_time_unit___", "c_Material___", "c_concentration___",
+            "c_concentration_unit___", "err___", "errQualifier___", "loQualifier___",
+            "loValue_CELL_VIABILITY_MEAN_%", "loValue_IC50_MEAN_%"]
+        assert dataset["c_Material___"].tolist() == ["", "TiO2", "TiO2", "TiO2", "TiO2"]
+        assert dataset["c_concentration___"].tolist() == [0.0, 0.1, 0.2, 0.4, 0.5]
+        assert dataset["c_E.exposure_time___"].dtype == "int64"
+        assert dataset["loValue_IC50_MEAN_%"].dropna().tolist() == [1.5, 20.0, 40.0]
+        assert dataset["loValue_CELL_VIABILITY_MEAN_%"].dropna().tolist() == [10.0, 50.0]
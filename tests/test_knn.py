@@ -0,0 +1,28 @@
+import numpy as np
+
+from pynanomapper.knn import KNNIndex
+
+
+def test_cosine_search_matches_full_sort():
+    rng = np.random.default_rng(0)
+    library = rng.random((50, 8))
+    queries = rng.random((7, 8))
+    index = KNNIndex(library, ids=["L{}".format(i) for i in range(50)], block_size=3)
+    hits = index.search(queries, topk=5)
+    assert len(hits) == 35
+    norm = library / np.linalg.norm(library, axis=1, keepdims=True)
+    for q in range(7):
+        cos = norm @ (queries[q] / np.linalg.norm(queries[q]))
+        expected = ["L{}".format(i) for i in np.argsort(-cos)[:5]]
+        got = hits[hits["query_id"] == q]
+        assert got["hit_id"].tolist() == expected
+        assert np.allclose(got["score"], (1 + np.sort(cos)[::-1][:5]) / 2, atol=1e-5)
+
+
+def test_euclidean_self_match():
+    library = np.eye(4)
+    hits = KNNIndex(library, similarity="euclidean").search(library, topk=10)
+    assert hits["rank"].max() == 3
+    top = hits[hits["rank"] == 0]
+    assert top["hit_id"].tolist() == [0, 1, 2, 3]
+    assert np.allclose(top["score"], 1)
@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from pynanomapper import parquet  # noqa: E402
+from pynanomapper.client_solr import StudyDocuments  # noqa: E402
+
+from test_client_solr import make_docs  # noqa: E402
+
+
+def test_roundtrip_with_schema_evolution(tmp_path):
+    docs = make_docs()
+    frames = [StudyDocuments().parse_columnar(docs[:len(docs) // 2]),
+              StudyDocuments().parse_columnar(docs[len(docs) // 2:])]
+    rows = StudyDocuments().parse(docs[:5])
+    extra = StudyDocuments().rows2frame(rows).assign(**{"x.params.new_field": "1.5"})
+    parquet.write_studies(frames + [extra], tmp_path / "studies")
+    df = parquet.read_studies(tmp_path / "studies")
+    expected = pd.concat(frames + [extra], ignore_index=True)
+    assert len(df) == len(expected)
+    assert set(expected.columns) <= set(df.columns)
+    assert isinstance(df["p.oht.section"].dtype, pd.CategoricalDtype)
+    assert isinstance(df["x.params.new_field"].dtype, pd.CategoricalDtype)
+    assert df["x.params.new_field"].notna().sum() == len(extra)
+    key = ["uuid.document", "m.substance.name", "value.endpoint", "value.range.lo"]
+    assert sorted(map(str, df[key].astype(object).itertuples(index=False))) == \
+        sorted(map(str, expected[key].astype(object).itertuples(index=False)))
+
+
+def test_projection_and_filters(tmp_path):
+    docs = make_docs()
+    frame = StudyDocuments().parse_columnar(docs)
+    with parquet.StudyParquetWriter(tmp_path) as writer:
+        writer.write(StudyDocuments().parse(docs))
+    section = frame["p.oht.section"].iloc[0]
+    df = parquet.read_studies(tmp_path, columns=["p.oht.section", "value.range.lo"],
+                              filters={"p.oht.section": section})
+    assert df.columns.tolist() == ["p.oht.section", "value.range.lo"]
+    assert len(df) == (frame["p.oht.section"] == section).sum()
+    df = parquet.read_studies(tmp_path, columns=["uuid.document"], filters=[("p.oht.section", "!=", section)])
+    assert len(df) == (frame["p.oht.section"] != section).sum()
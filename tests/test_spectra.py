@@ -0,0 +1,103 @@
+import warnings
+
+import numpy as np
+import pytest
+import scipy.stats as stats
+
+from pynanomapper.clients import spectra
+
+
+def reference_moving_minimum(arr, window_size):
+    # ramanchada2 baseline.moving_minimum
+    mov_min_left = [min(arr[max(0, i):min(i+window_size, len(arr))]) for i in range(len(arr))]
+    mov_min_right = [min(arr[max(0, i-window_size):min(i, len(arr))]) for i in range(1, len(arr)+1)]
+    return np.maximum.reduce([mov_min_left, mov_min_right])
+
+
+def reference_embedding(x, y, xlinspace, window=16):
+    # StudyRaman.spectra2dist / xy2embedding with rv_histogram
+    index = np.where((x >= xlinspace[0]) & (x <= xlinspace[-1]))[0]
+    x = x[index]
+    counts = y[index]
+    counts = counts - reference_moving_minimum(counts, window)
+    bins = np.concatenate(([(3*x[0] - x[1])/2], (x[1:] + x[:-1])/2, [(3*x[-1] - x[-2])/2]))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        hist_dist = stats.rv_histogram((counts, bins))
+    return (hist_dist.cdf(xlinspace), hist_dist.pdf(xlinspace))
+
+
+def random_spectra(n, seed=0):
+    rng = np.random.default_rng(seed)
+    result = []
+    for i in range(n):
+        points = rng.integers(200, 1500)
+        x = np.sort(rng.uniform(50, 3500, points))
+        if i % 2:
+            x = np.linspace(100, 3400, points)
+        y = rng.random(points) * 100 + np.exp(-((x - rng.uniform(200, 3000)) / 30) ** 2) * 1000
+        result.append((x, y))
+    return result
+
+
+def test_moving_minimum():
+    y = np.random.default_rng(1).random(100)
+    assert np.allclose(spectra.moving_minimum(y, 16), reference_moving_minimum(y, 16))
+    assert np.allclose(spectra.moving_minimum(y[:5], 16), reference_moving_minimum(y[:5], 16))
+
+
+def test_embedding_matches_rv_histogram():
+    xlinspace = spectra.x4search(256)
+    data = random_spectra(8)
+    (cdf, pdf) = spectra.embed_spectra(data, xlinspace=xlinspace, chunksize=3)
+    assert cdf.shape == (8, 256)
+    for i, (x, y) in enumerate(data):
+        (ref_cdf, ref_pdf) = reference_embedding(x, y, xlinspace)
+        assert np.allclose(cdf[i], ref_cdf, atol=1e-9)
+        assert np.allclose(pdf[i], ref_pdf, rtol=1e-6, atol=1e-12)
+
+
+def test_embedding_process_pool_and_short_spectra():
+    data = random_spectra(4, seed=2) + [(np.array([0.0, 1.0]), np.array([1.0, 2.0]))]
+    (cdf, pdf) = spectra.embed_spectra(data, workers=2, chunksize=2)
+    (cdf1, pdf1) = spectra.embed_spectra(data)
+    assert np.array_equal(cdf[:4], cdf1[:4])
+    assert np.isnan(cdf[4]).all()
+
+
+def test_hist_embeddings_batched(monkeypatch):
+    xlinspace = spectra.x4search(256)
+    rng = np.random.default_rng(4)
+    # equal length spectra, on a shared and on per spectrum axes, with 20
+    # points below the xlinspace range each
+    below = np.linspace(50, 130, 20)
+    shared = np.concatenate((below, np.linspace(150, 3200, 680)))
+    x = np.vstack([shared] * 3 + [np.concatenate((below, np.sort(rng.uniform(150, 3200, 680)))) for _ in range(3)])
+    y = rng.random(x.shape) * 100
+    y[2] = 5.0  # flat, no mass left after the baseline
+    (cdf, pdf) = spectra.hist_embeddings(x, y, xlinspace)
+    for i in range(len(x)):
+        (ref_cdf, ref_pdf) = spectra.hist_embedding(x[i], y[i], xlinspace)
+        assert np.allclose(cdf[i], ref_cdf, atol=1e-12, equal_nan=True)
+        assert np.allclose(pdf[i], ref_pdf, rtol=1e-12, atol=0, equal_nan=True)
+    (ref_cdf, ref_pdf) = reference_embedding(x[3], y[3], xlinspace)
+    assert np.allclose(cdf[3], ref_cdf, atol=1e-9)
+    assert np.allclose(spectra.moving_minimum(y, 16)[4], reference_moving_minimum(y[4], 16))
+
+    # embed_spectra takes the batched path for spectra on one axis, not the loop
+    monkeypatch.setattr(spectra, "hist_embedding", None)
+    (cdf1, pdf1) = spectra.embed_spectra(list(zip(x[:3], y[:3])), xlinspace=xlinspace)
+    assert np.array_equal(cdf1, cdf[:3], equal_nan=True)
+    (cdf1, pdf1) = spectra.embed_spectra(np.stack((x[:3], y[:3]), axis=1), xlinspace=xlinspace)
+    assert np.array_equal(pdf1, pdf[:3], equal_nan=True)
+
+
+def test_hist_embeddings_ragged():
+    xlinspace = spectra.x4search(64)
+    x = np.vstack([np.linspace(100, 3400, 50), np.linspace(1000, 4000, 50)])
+    y = np.ones_like(x)
+    with pytest.raises(ValueError):
+        spectra.hist_embeddings(x, y, xlinspace)
+    # same length, different axes: spectrum by spectrum
+    (cdf, pdf) = spectra.embed_spectra(list(zip(x, y)), xlinspace=xlinspace, remove_baseline=False)
+    assert np.array_equal(cdf[1], spectra.hist_embedding(x[1], y[1], xlinspace, remove_baseline=False)[0])
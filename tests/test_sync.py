@@ -0,0 +1,80 @@
+import json
+import re
+
+from pynanomapper import sync
+from pynanomapper.client_solr import StudyDocuments
+
+from test_client_solr import make_docs
+
+
+def delta_handler(server, params, body, headers):
+    """block join with an updated_s range, the latest updated_s and id-only study listings"""
+    rows = int(params.get("rows", 10))
+    mark = params.get("cursorMark")
+    start = 0 if mark in (None, "*") else int(mark)
+    q = params["q"]
+    studies = [child for doc in server.docs for child in doc.get("_childDocuments_", []) if child["type_s"] == "study"]
+    if q.startswith("{!parent"):
+        m = re.search(r'updated_s:\["([^"]*)" TO "([^"]*)"\]', q)
+
+        def changed(child):
+            return child["type_s"] != "study" or m is None or m.group(1) <= child.get("updated_s", "") <= m.group(2)
+        docs = []
+        for doc in server.docs:
+            children = [child for child in doc.get("_childDocuments_", []) if changed(child)]
+            if any(child["type_s"] == "study" for child in children):
+                docs.append(dict(doc, _childDocuments_=children))
+    elif params.get("sort", "").startswith("updated_s desc"):
+        docs = sorted((s for s in studies if "updated_s" in s), key=lambda s: s["updated_s"], reverse=True)
+        docs = [{"updated_s": s["updated_s"]} for s in docs]
+    else:
+        docs = [{"id": s["id"]} for s in sorted(studies, key=lambda s: s["id"])]
+    server.log.append(q)
+    page = docs[start:start + rows]
+    result = {"response": {"numFound": len(docs), "docs": page}}
+    if mark is not None:
+        result["nextCursorMark"] = str(start + len(page)) if page else mark
+    return 200, "application/json", json.dumps(result).encode("utf-8")
+
+
+def set_updated(docs):
+    for s, doc in enumerate(docs):
+        for child in doc.get("_childDocuments_", []):
+            if child["type_s"] == "study":
+                child["updated_s"] = "2024-01-{:02d}".format(s + 1)
+
+
+def test_delta_sync(fake_solr, tmp_path):
+    docs = make_docs(nsubstances=10, nstudies=4)
+    set_updated(docs)
+    fake_solr.docs = docs
+    fake_solr.log = []
+    fake_solr.handlers["/solr/core/select"] = delta_handler
+    mirror = sync.SQLiteMirror(tmp_path / "mirror.sqlite")
+    harvester = sync.DeltaHarvester(fake_solr.url, mirror, rows=3)
+
+    report = harvester.sync()
+    assert report == {"since": None, "until": "2024-01-10", "upserted": 40, "deleted": 0}
+    df = mirror.frame()
+    expected = StudyDocuments().parse_columnar(docs, process=None)
+    assert len(df) == len(expected)
+    assert set(expected.columns) <= set(df.columns)
+
+    # one study changed, one substance removed
+    changed = docs[1]["_childDocuments_"]
+    study = [c for c in changed if c["type_s"] == "study"][0]
+    study["updated_s"] = "2024-02-01"
+    study["effectendpoint_s"] = "LC50"
+    removed = docs.pop(2)
+    fake_solr.log.clear()
+    report = harvester.sync()
+    assert report["since"] == "2024-01-10" and report["until"] == "2024-02-01"
+    # the changed study, and again the ones updated on the day of the mark
+    assert report["upserted"] == 1 + 4
+    assert report["deleted"] == 4
+    assert any('updated_s:["2024-01-10" TO "2024-02-01"]' in q for q in fake_solr.log)
+    df = mirror.frame()
+    assert len(df) == 36
+    assert df.loc[df["id.study"] == study["id"], "value.endpoint"].tolist() == ["LC50"]
+    assert not df["id.study"].isin([c["id"] for c in removed["_childDocuments_"]]).any()
+    assert mirror.get_state("high_water_mark") == "2024-02-01"
@@ -0,0 +1,92 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pynanomapper import units
+
+
+def test_convert_units():
+    assert units.convert_units(5, "um", "nm") == pytest.approx(5000)
+    assert units.convert_units(1, "µg/ml", "mg__l") == pytest.approx(1)
+    assert units.convert_units(1, "micrograms per mL", "mg/l") == pytest.approx(1)
+    assert units.convert_units(2, "umol/l", "mmol__l") == pytest.approx(0.002)
+    assert units.convert_units(7, "%DNA in Tail", "percent") == pytest.approx(7)
+    assert units.convert_units(0, "c", "k") == pytest.approx(273.15)
+    # units are looked up, never evaluated
+    assert units.convert_units(1, "ug/ml", "__class__") is None
+    assert units.convert_units(1, "ug/ml", "nm") is None
+
+
+def test_molar_units():
+    # molar units are not lengths, whatever the case
+    assert units.conversion_factor("mM", "nm") is None
+    assert units.conversion_factor("M", "m") is None
+    assert units.conversion_factor("mmol/l", "mM") == pytest.approx((1, 0))
+    assert units.conversion_factor("uM", "umol/l") == pytest.approx((1, 0))
+    assert units.conversion_factor("µM", "mM") == pytest.approx((0.001, 0))
+    assert units.conversion_factor("nM", "uM") == pytest.approx((0.001, 0))
+
+
+def test_conversion_factor_cached():
+    units._conversion_factor.cache_clear()
+    assert units.conversion_factor("mg/l", "ug/ml") == pytest.approx((1, 0))
+    units.conversion_factor("mg/l", "ug/ml")
+    assert units._conversion_factor.cache_info().hits == 1
+    assert units.conversion_factor(None, "ug/ml") is None
+
+
+def test_convert_array():
+    values = pd.Series([1, 2, "x", 4, 5, np.nan], index=list("abcdef"))
+    from_units = ["ug/ml", "mg/l", "ug/ml", "bogus", "µg/L", None]
+    (converted, convertible) = units.convert_array(values, from_units, "ug/ml")
+    assert list(converted.index) == list("abcdef")
+    np.testing.assert_allclose(converted, [1, 2, np.nan, np.nan, 0.005, np.nan])
+    assert convertible.tolist() == [True, True, True, False, True, False]
+
+    (converted, convertible) = units.convert_array(np.array([1.0, 2.0]), "nm", ["um", "mg"])
+    np.testing.assert_allclose(converted, [0.001, np.nan])
+    assert convertible.tolist() == [True, False]
+
+
+def test_harmonize_units(tmp_path):
+    df = pd.DataFrame({
+        "p.oht.section": ["A"] * 5 + ["B"] * 2,
+        "value.endpoint": ["IC50"] * 5 + ["X", "X"],
+        "value.unit": ["ug/ml", "µg/ml", "mg/l", "ng/ml", "%", "c", ""],
+        "value.range.lo": [1, 2, 3, 4, 5, 10, 1],
+        "value.range.up": [2, 3, 4, 5, 6, 20, 2],
+        "value.uncertainty": [0.1, 0.1, 0.1, 0.1, 0.1, 1, 0]})
+    result = units.harmonize_units(df, mypath=tmp_path)
+    assert result["value.unit"].tolist() == ["mg/l"] * 4 + ["%", "c", ""]
+    assert result["value.unit.original"].tolist()[:4] == ["ug/ml", "µg/ml", "mg/l", "ng/ml"]
+    assert result["value.unit.status"].tolist() == [
+        "converted", "converted", "unchanged", "converted", "incompatible", "unchanged", "no unit"]
+    np.testing.assert_allclose(result["value.range.lo"], [1, 2, 3, 0.004, 5, 10, 1])
+    np.testing.assert_allclose(result["value.uncertainty"], [0.1, 0.1, 0.1, 0.0001, 0.1, 1, 0])
+    np.testing.assert_allclose(result["value.unit.factor"], [1, 1, 1, 0.001, np.nan, 1, np.nan])
+
+    # the alias index is kept, and hand corrections are used
+    index = json.loads((tmp_path / "unitdict.json").read_text())
+    assert index["µg/ml"] == "µg/ml" and index["ng/ml"] == "ng__ml"
+    index["%"] = "ug__ml"
+    (tmp_path / "unitdict.json").write_text(json.dumps(index))
+    result = units.harmonize_units(df, mypath=tmp_path, canonical={("A", "IC50"): "ug/ml", ("B", "X"): "k"})
+    assert result["value.unit.status"].tolist()[4:6] == ["converted", "converted"]
+    np.testing.assert_allclose(result["value.range.lo"][4:6], [5, 283.15])
+    np.testing.assert_allclose(result["value.uncertainty"][5], 1)
+
+
+def test_harmonize_molar_units():
+    df = pd.DataFrame({
+        "p.oht.section": ["A"] * 6,
+        "value.endpoint": ["EC50"] * 6,
+        "value.unit": ["mM", "mM", "nm", "mmol/l", "uM", "umol/l"],
+        "value.range.lo": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]})
+    result = units.harmonize_units(df)
+    assert result["value.unit"].tolist() == ["mM", "mM", "nm", "mM", "mM", "mM"]
+    assert result["value.unit.status"].tolist() == [
+        "unchanged", "unchanged", "incompatible", "converted", "converted", "converted"]
+    np.testing.assert_allclose(result["value.unit.factor"], [1, 1, np.nan, 1, 0.001, 0.001])
+    np.testing.assert_allclose(result["value.range.lo"], [1, 2, 3, 4, 0.005, 0.006])